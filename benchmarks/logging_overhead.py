@@ -0,0 +1,61 @@
+"""Benchmark the overhead of the logging on the ISBN search hot path.
+
+The same ISBN search (reordering of the text of a book and search of its
+ISBNs) is timed with the `organize_lib` logger at the INFO and DEBUG levels.
+The log records are discarded by a handler writing to `os.devnull`, thus
+the difference between the two levels is the cost of building the DEBUG
+messages.
+
+Usage: python benchmarks/logging_overhead.py [--repeat N] [--lines N]
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from organize_ebooks import lib  # noqa: E402
+
+
+def make_book_text(num_lines):
+    random.seed(0)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'page', 'chapter', '1234']
+    lines = [' '.join(random.choice(words) for _ in range(12)) for _ in range(num_lines)]
+    # Some numbers that look like ISBNs (valid or not) in the middle of the book
+    for i in range(0, num_lines, 200):
+        lines[i] += f' {random.randint(10 ** 9, 10 ** 10 - 1)}'
+    lines[10] += ' ISBN 978-0-306-40615-7'
+    return '\n'.join(lines)
+
+
+def search(text):
+    data = lib.reorder_text(text)
+    return lib.find_isbns(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=20000)
+    args = parser.parse_args()
+
+    text = make_book_text(args.lines)
+    with open(os.devnull, 'w') as devnull:
+        handler = logging.StreamHandler(devnull)
+        lib.logger.addHandler(handler)
+        results = {}
+        for level in ['INFO', 'DEBUG']:
+            lib.logger.setLevel(level)
+            results[level] = min(timeit.repeat(lambda: search(text), number=1,
+                                               repeat=args.repeat))
+        lib.logger.removeHandler(handler)
+    for level, duration in results.items():
+        print(f'{level:<6} {duration * 1000:8.2f} ms per book ({args.lines} lines)')
+    print(f'DEBUG overhead: {(results["DEBUG"] / results["INFO"] - 1) * 100:.1f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark the scheduler of the online metadata sources.
+
+The same ISBN lookups are sent to a local stub of `fetch-ebook-metadata`
+that answers after a delay and throttles each source like the online sources
+do: more than `--limit` requests to a source in one second are answered with
+an HTTP 429 error. The lookups are first sent serially without any pacing
+(like before the scheduler) and then from `--jobs` threads through a
+`SourceScheduler`. The throughput and the number of throttled requests are
+shown for both. With a shorter `--delay` (e.g. 0.2), the serial lookups are
+throttled too.
+
+Usage: python benchmarks/metadata_sources.py [--lookups N] [--jobs N] [--limit N] [--delay S]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from organize_ebooks import lib  # noqa: E402
+
+SOURCES = ['Goodreads', 'Google', 'Amazon.com']
+STUB = '''\
+import fcntl
+import os
+import sys
+import time
+
+state_dir, limit, delay = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+source = [arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--allowed-plugin=')][0]
+isbn = [arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--isbn=')][0]
+with open(os.path.join(state_dir, source), 'a+') as f:
+    fcntl.flock(f, fcntl.LOCK_EX)
+    f.seek(0)
+    now = time.time()
+    recent = [float(line) for line in f if now - float(line) < 1]
+    f.write(f'{now}\\n')
+time.sleep(delay)
+if len(recent) >= limit:
+    print('HTTP Error 429: Too Many Requests', file=sys.stderr)
+    sys.exit(1)
+print(f'Title               : Book {isbn}')
+print(f'Identifiers         : isbn:{isbn}')
+'''
+
+
+# Looks up each ISBN in the sources (in order) until one of them answers.
+# Returns the number of lookups that found metadata and the duration.
+def run_lookups(isbns, command, jobs, scheduler):
+    backends = [lib.CalibreMetadataBackend(source, command, scheduler) for source in SOURCES]
+
+    def lookup(isbn):
+        for backend in backends:
+            if backend.fetch(isbn=isbn).returncode == 0:
+                return True
+        return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(jobs) as executor:
+        found = sum(executor.map(lookup, isbns))
+    return found, time.perf_counter() - start
+
+
+def count_throttled(state_dir, limit):
+    throttled = 0
+    for source in os.listdir(state_dir):
+        with open(os.path.join(state_dir, source)) as f:
+            times = [float(line) for line in f]
+        throttled += sum(1 for i, t in enumerate(times)
+                         if sum(1 for u in times[:i] if t - u < 1) >= limit)
+    return throttled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lookups', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=6)
+    parser.add_argument('--limit', type=int, default=2,
+                        help='Requests per second allowed by each source of the stub')
+    parser.add_argument('--delay', type=float, default=0.8,
+                        help='Response time of the stub in seconds')
+    args = parser.parse_args()
+
+    isbns = [f'978030640{i:04d}' for i in range(args.lookups)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stub_path = os.path.join(tmp_dir, 'fetch_stub.py')
+        with open(stub_path, 'w') as f:
+            f.write(STUB)
+        for name, jobs, scheduler in [
+                ('serial, no scheduler', 1, None),
+                (f'{args.jobs} threads, scheduler', args.jobs,
+                 lib.SourceScheduler(rate=args.limit * 0.8, burst=1, backoff=2,
+                                     max_backoff=10))]:
+            state_dir = tempfile.mkdtemp(dir=tmp_dir)
+            command = f'{sys.executable} {stub_path} {state_dir} {args.limit} {args.delay}'
+            found, duration = run_lookups(isbns, command, jobs, scheduler)
+            throttled = count_throttled(state_dir, args.limit)
+            print(f'{name:<24} {found}/{len(isbns)} found in {duration:6.2f} s '
+                  f'({found / duration:5.2f} lookups/s), {throttled} throttled requests')
+
+
+if __name__ == '__main__':
+    main()
@@ -9,24 +9,41 @@ shell by `na--`.
 
 Ref.: https://github.com/na--/ebook-tools
 """
-import ast
+import atexit
+import errno
+import functools
+import io
+import json
 import logging
-import mimetypes
 import os
 import re
 import shlex
 import shutil
+import signal
 import string
 import subprocess
-import tempfile
+import sys
+import threading
 import time
 from argparse import Namespace
+from collections import deque
 from copy import copy
-from datetime import datetime
+from itertools import accumulate, chain, islice
 from pathlib import Path
 from types import SimpleNamespace
 from unicodedata import normalize
 
+try:
+    import resource
+except ImportError:
+    # e.g. Windows: the memory of the programs can't be limited
+    resource = None
+
+# NOTE: the modules that are only needed by some of the functions (e.g. ast,
+# csv, gzip, hashlib, mimetypes, random, sqlite3, tempfile and
+# concurrent.futures) are imported by these functions to keep the startup of
+# the script fast, see benchmarks/import_time.py
+
 from organize_ebooks import __version__
 
 logger = logging.getLogger('organize_lib')
@@ -36,7 +53,7 @@ logger.setLevel(logging.CRITICAL + 1)
 def get_re_year():
     # In bash: (19[0-9]|20[0-$(date '+%Y' | cut -b 3)])[0-9]"
     # output: (19[0-9]|20[0-1])[0-9]
-    regex = '(19[0-9]|20[0-{}])[0-9]'.format(str(datetime.now())[2])
+    regex = '(19[0-9]|20[0-{}])[0-9]'.format(str(time.localtime().tm_year)[2])
     return regex
 
 
@@ -68,8 +85,42 @@ def get_without_isbn_ignore():
 # ============
 DRY_RUN = False
 SYMLINK_ONLY = False
+# Instead of moving the ebook files, create hard links to them (no copy, but
+# only possible on the same filesystem: symbolic links are created otherwise)
+HARDLINK_ONLY = False
 KEEP_METADATA = False
 REVERSE = False
+# Order in which the files of a folder are organized: 'name' (by filename, see
+# REVERSE), 'cost' (the cheapest files first, e.g. to organize as many files
+# as possible within TIME_BUDGET) or 'ljf' (longest job first: the most
+# expensive files first, thus with JOBS > 1 a huge scanned PDF doesn't start
+# last and keep a thread busy while the others are idle). The cost of a file
+# is estimated from its extension and size, see FileCostModel.
+FILE_ORDER = 'name'
+# JSON file where the time spent on the files of each extension is saved
+# between runs to better estimate the cost of the files
+COST_HISTORY_FILE = None
+# Number of seconds after which no new file is started (None means no limit).
+# The files left are reported as skipped with TIME_BUDGET_REASON.
+TIME_BUDGET = None
+TIME_BUDGET_REASON = 'Time budget exhausted'
+# Folder where the temporary files (converted text, extracted archives, page
+# images, metadata) are created. If None, /dev/shm (tmpfs) is used as long as
+# the temporary files take less than SCRATCH_QUOTA_MIB and the default temp
+# folder otherwise.
+SCRATCH_DIR = None
+SCRATCH_QUOTA_MIB = 256
+# Number of files organized in parallel (small files). The files bigger than
+# HEAVY_FILE_SIZE_MIB go to a separate "heavy" lane with HEAVY_JOBS workers.
+# With JOBS = 1, the files are organized one by one in order.
+JOBS = 1
+HEAVY_JOBS = 1
+# The text of the files bigger than this size is streamed through a temporary
+# file on disk instead of being kept in memory
+HEAVY_FILE_SIZE_MIB = 100
+# Maximum address space (virtual memory) of each program run for the heavy
+# files (e.g. gs, 7z, pdftotext). None means no limit.
+HEAVY_MEMORY_LIMIT_MIB = None
 
 # Convert-to-txt options
 # ======================
@@ -107,6 +158,45 @@ ISBN_RET_SEPARATOR = ' - '
 # NOTE: If you use Calibre versions that are older than 2.84, it's required to
 # manually set the following option to an empty string
 ISBN_METADATA_FETCH_ORDER = ['Goodreads', 'Google', 'Amazon.com', 'ISBNDB', 'WorldCat xISBN', 'OZON.ru']
+# SQLite file of the local metadata catalog (see LocalMetadataCatalog) that is
+# searched before the online sources, by ISBN and by title and author
+METADATA_CATALOG = None
+# Command that fetches the metadata from the online sources (calibre's
+# `fetch-ebook-metadata` or a program with the same options and output)
+FETCH_METADATA_COMMAND = 'fetch-ebook-metadata'
+# Requests per second sent to each online metadata source and number of
+# requests that can be sent at once after a pause (see SourceScheduler)
+METADATA_SOURCE_RATE = 1.0
+METADATA_SOURCE_BURST = 3
+# A failing source is skipped for METADATA_SOURCE_BACKOFF seconds, doubled
+# after each consecutive failure up to METADATA_SOURCE_MAX_BACKOFF seconds. A
+# source fails if its error matches METADATA_SOURCE_ERROR_REGEX or if it
+# returns nothing METADATA_SOURCE_MAX_EMPTY times in a row.
+METADATA_SOURCE_BACKOFF = 30
+METADATA_SOURCE_MAX_BACKOFF = 600
+METADATA_SOURCE_MAX_EMPTY = 5
+METADATA_SOURCE_ERROR_REGEX = '(?i)(429|503|too many requests|rate limit|timed? ?out|' \
+                              'captcha|connection (refused|reset)|temporarily unavailable)'
+# JSON file where the per-MIME-type statistics (hit rate and latency) of the
+# ISBN search steps are saved between runs
+ISBN_SEARCH_STATS_FILE = None
+# If enabled, the ISBN search steps are tried in the order learned from these
+# statistics, i.e. the cheapest steps with the best hit rate first
+ADAPTIVE_ISBN_SEARCH = False
+# Minimum number of tries of a search step for a given MIME type before its
+# statistics are used for reordering the steps
+ADAPTIVE_ISBN_SEARCH_MIN_TRIES = 5
+# Once a program (e.g. ebook-convert) failed this number of times with the same
+# error for a given MIME type, it is not run anymore for this MIME type. Only
+# the failures of the program itself are counted (not installed or file format
+# not supported), not those of a given file (e.g. encrypted or corrupted file)
+FAILURE_MEMO_THRESHOLD = 3
+# Errors that show that a program can't handle a file format at all
+FAILURE_MEMO_ERROR_REGEX = r'(?i)(unsupported|not supported|unknown|unrecognized|no plugin|' \
+                           r'cannot handle|can\'t handle).{0,40}(format|type|extension)|' \
+                           r'(format|type|extension).{0,40}(unsupported|not supported)'
+# JSON file where these failures are saved between runs
+FAILURE_MEMO_FILE = None
 
 # Logging options
 # ===============
@@ -118,11 +208,34 @@ LOGGING_LEVEL = 'info'
 OCR_ENABLED = 'false'
 OCR_COMMAND = 'tesseract_wrapper'
 OCR_ONLY_FIRST_LAST_PAGES = (7, 3)
+# Rasterization (resolution, gs device and interpolation) and tesseract
+# page segmentation mode of each OCR profile. With the 'auto' profile, the
+# 'fast' profile is used first and the 'accurate' one only if no ISBNs are
+# found. NOTE: with the 'fast' profile, djvu pages are rendered as black and
+# white (only their mask layer) at their own resolution.
+OCR_PROFILE = 'accurate'
+OCR_PROFILES = {
+    'fast': {'dpi': 200, 'device': 'tiffg4', 'interpolate': False, 'psm': 11},
+    'balanced': {'dpi': 300, 'device': 'pnggray', 'interpolate': False, 'psm': 11},
+    'accurate': {'dpi': 300, 'device': 'png16m', 'interpolate': True, 'psm': 12}
+}
 
 # Organize options
 # ================
 SKIP_ARCHIVES = False
 CORRUPTION_CHECK = 'true'
+# File (CSV or JSON lines) where the result of the check of each file is
+# appended when `corruption_check` is 'check_only' (audit), see AuditReport.
+# The files already in the report with the same size and modification time
+# are not checked again.
+AUDIT_REPORT = None
+# Only a random sample of the files is checked in the audit: a number of files
+# (e.g. '500') or a percentage (e.g. '5%')
+AUDIT_SAMPLE = None
+# Number of files checked in parallel in the audit when they are on a
+# rotational disk or a network filesystem (unless `jobs` is given), since
+# parallel reads make the disk seek
+AUDIT_SEEK_BOUND_JOBS = 2
 ORGANIZE_WITHOUT_ISBN = False
 ORGANIZE_WITHOUT_ISBN_SOURCES = ['Goodreads', 'Google', 'Amazon.com']
 PAMPHLET_EXCLUDED_FILES = '\.(chm|epub|cbr|cbz|mobi|lit|pdb)$'
@@ -131,6 +244,16 @@ PAMPHLET_MAX_FILESIZE_KIB = 250
 PAMPHLET_MAX_PDF_PAGES = 50
 TESTED_ARCHIVE_EXTENSIONS = '^(7z|bz2|chm|arj|cab|gz|tgz|gzip|zip|rar|xz|tar|epub|docx|odt|ods|cbr|cbz|maff|iso)$'
 WITHOUT_ISBN_IGNORE = get_without_isbn_ignore()
+# Tokens of the filenames that are ignored when searching for metadata by
+# filename (e.g. 'Some_Book-2nd.ed_(2019)_scan' -> 'some')
+TOKENS_TO_IGNORE = 'ebook|book|novel|series|ed(ition)?|vol(ume)?|[0-9]+(st|nd|rd|th)|scan(ned)?|' \
+                   'retail|ocr|pdf|epub|mobi|azw3?|djvu|' + get_re_year()
+# JSON file where the titles resolved with online metadata are saved between
+# runs, see TitleIndex
+TITLE_INDEX_FILE = None
+# Minimum similarity (Dice coefficient of the trigrams, between 0 and 1) of two
+# titles for the title index
+TITLE_INDEX_MIN_SIMILARITY = 0.8
 OUTPUT_FILENAME_TEMPLATE = "${d[AUTHORS]// & /, } - ${d[SERIES]:+[${d[SERIES]}] " \
                            "- }${d[TITLE]/:/ -}${d[PUBLISHED]:+ (${d[PUBLISHED]%%-*})}" \
                            "${d[ISBN]:+ [${d[ISBN]}]}.${d[EXT]}"
@@ -140,6 +263,17 @@ OUTPUT_FOLDER_UNCERTAIN = None
 # If `keep_metadata` is enabled, this is the extension of the additional
 # metadata file that is saved next to each newly renamed file
 OUTPUT_METADATA_EXTENSION = 'meta'
+# Where the metadata files are saved: 'files' (one file next to each book) or
+# one store per folder, 'jsonl' or 'sqlite' (see MetadataStore)
+METADATA_SINK = 'files'
+# Number of metadata files written to a store at once (one fsync per batch)
+METADATA_SINK_BATCH = 100
+# File (JSON lines, CSV or SQLite) where the per-file results are saved at the
+# end of the organization
+RESULTS_FILE = None
+# JSON lines file where the organization is planned instead of being done (see
+# MovePlan): the plan is applied later with OrganizeEbooks.apply_plan()
+PLAN_FILE = None
 
 
 class Result:
@@ -148,6 +282,9 @@ class Result:
         self.stderr = stderr
         self.returncode = returncode
         self.args = args
+        # ISBNs already searched in `stdout` (e.g. by the 'auto' OCR profile),
+        # None if it wasn't searched
+        self.isbns = None
 
     def __repr__(self):
         return self.__str__()
@@ -158,6 +295,1433 @@ class Result:
                f'returncode={self.returncode}, args={self.args}'
 
 
+# Compact record of the outcome of the organization of a file: `status` is one
+# of 'ok', 'skip' or 'fail' (like the OK/SKIP/ERR log lines), `isbns` is a
+# tuple, `metadata_source` is the online source or method that gave the
+# metadata and `timings` maps the stages to their durations in seconds
+class FileResult:
+    __slots__ = ('path', 'status', 'reason', 'isbns', 'metadata_source',
+                 'new_path', 'timings')
+
+    def __init__(self, path, status=None, reason=None, isbns=(),
+                 metadata_source=None, new_path=None, timings=None):
+        self.path = str(path)
+        self.status = status
+        self.reason = reason
+        self.isbns = isbns
+        self.metadata_source = metadata_source
+        self.new_path = new_path
+        self.timings = {} if timings is None else timings
+
+    def __repr__(self):
+        return f'FileResult({self.to_dict()})'
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def update(self, status, reason=None, new_path=None, metadata_source=None):
+        self.status = status
+        self.reason = reason
+        self.new_path = None if new_path is None else str(new_path)
+        if metadata_source:
+            self.metadata_source = metadata_source
+
+
+# Metadata of a book (e.g. the output of calibre's `fetch-ebook-metadata` or
+# `ebook-meta`) as an ordered mapping of labels to values, parsed in one pass
+# from the `Label               : Value` lines. A line is a new field only if
+# its colon is at column 20 or further: either the label is padded with spaces
+# up to the colon or, like calibre does for the labels of 20 characters or more
+# (e.g. custom columns), it is directly followed by the colon. In this second
+# form, all the words of the label must be capitalized so that a long sentence
+# of a comment is not taken for a label. Any other line continues the value of
+# the previous field (e.g. 'Note: ...' in multi-line comments).
+class BookMetadata:
+    __slots__ = ('fields',)
+
+    def __init__(self, text=''):
+        self.fields = {}
+        label = None
+        for line in text.splitlines() if isinstance(text, str) else []:
+            match = re.match(r'([A-Za-z][\w()&-]*(?: [\w()&-]+)*)( *):(?: |$)', line)
+            if match and match.end(2) >= 20 \
+                    and (match.group(2) or re.fullmatch(r'[A-Z0-9(&][^ ]*(?: [A-Z0-9(&][^ ]*)*',
+                                                        match.group(1))):
+                label = match.group(1)
+                self.fields[label] = line[match.end():].strip()
+            elif label is not None:
+                self.fields[label] += '\n' + line.rstrip()
+
+    def __bool__(self):
+        return bool(self.fields)
+
+    def __contains__(self, label):
+        return label in self.fields
+
+    def __getitem__(self, label):
+        return self.fields[label]
+
+    def __repr__(self):
+        return f'BookMetadata({self.fields})'
+
+    def __setitem__(self, label, value):
+        self.fields[label] = str(value)
+
+    def get(self, label, default=None):
+        return self.fields.get(label, default)
+
+    # Returns the variables of the output filename template, e.g. the value of
+    # 'Author(s)' is d[AUTHORS]. Characters that are not allowed in filenames
+    # are replaced with '_' and only the first 100 characters are kept.
+    def get_template_vars(self):
+        d = {}
+        for label, value in self.fields.items():
+            name = re.sub('[^a-zA-Z0-9_]', '', label.replace(' ', '_')).upper()
+            d[name] = re.sub('[\\/*?<>|\x01-\x1F\x7F"$`]', '_', value)[:100]
+        return d
+
+    # The text in the same format as calibre, e.g. for the metadata file saved
+    # next to an organized ebook
+    def to_text(self):
+        return '\n'.join(f'{label:<19} : {value}' for label, value in self.fields.items())
+
+    # Adds the fields of another BookMetadata, with `prefix` added to their
+    # labels (e.g. 'OF ' for the metadata of the original file)
+    def update(self, other, prefix=''):
+        for label, value in other.fields.items():
+            self.fields[prefix + label] = value
+
+
+# Per-MIME-type statistics (number of tries, number of hits and total time) of
+# the ISBN search steps of search_file_for_isbns() that can be reordered, i.e.
+# `ebook-meta`, archive extraction and conversion to text
+class IsbnSearchStats:
+    STEPS = ['ebook-meta', 'archive', 'convert']
+
+    def __init__(self, stats_file=ISBN_SEARCH_STATS_FILE,
+                 min_tries=ADAPTIVE_ISBN_SEARCH_MIN_TRIES):
+        self.stats_file = stats_file
+        self.min_tries = min_tries
+        # e.g. {'application/pdf': {'convert': [tries, hits, total_time]}}
+        self.stats = {}
+        self._lock = threading.Lock()
+        if stats_file and Path(stats_file).is_file():
+            try:
+                with open(stats_file, 'r') as f:
+                    self.stats = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(red(f"Couldn't load the ISBN search statistics: {e}"))
+
+    # Returns the steps in the order in which they are run for the MIME type.
+    # The default order is kept until the files of this MIME type were searched
+    # `min_tries` times. Then the steps that were rarely reached (because the
+    # previous steps found the ISBNs) are run first until they also have
+    # `min_tries` tries, and finally the steps are sorted by score.
+    def get_order(self, mime_type):
+        steps = self.get_steps(mime_type)
+        mime_stats = self.stats.get(mime_type, {})
+        tries = {step: mime_stats.get(step, [0, 0, 0])[0] for step in steps}
+        if max(tries.values()) < self.min_tries:
+            return steps
+        untried = [step for step in steps if tries[step] < self.min_tries]
+        tried = [step for step in steps if tries[step] >= self.min_tries]
+        return untried + sorted(tried, key=lambda step: self.get_score(mime_type, step),
+                                reverse=True)
+
+    # Expected number of hits per second spent on the step
+    def get_score(self, mime_type, step):
+        tries, hits, total_time = self.stats.get(mime_type, {}).get(step, [0, 0, 0])
+        # Laplace smoothing so that steps without hits are still ranked by cost
+        hit_rate = (hits + 1) / (tries + 2)
+        mean_time = max(total_time / tries if tries else 0, 0.001)
+        return hit_rate / mean_time
+
+    # Returns the steps that apply to the files of the MIME type, in the
+    # default order
+    @classmethod
+    def get_steps(cls, mime_type):
+        # NOTE: epubs are not decompressed with 7z, see README
+        if mime_type and mime_type.startswith('application/epub+zip'):
+            return [step for step in cls.STEPS if step != 'archive']
+        return list(cls.STEPS)
+
+    def get_policy(self):
+        lines = []
+        for mime_type in sorted(self.stats):
+            lines.append(f"{mime_type or 'unknown'}: {' -> '.join(self.get_order(mime_type))}")
+            for step in self.STEPS:
+                tries, hits, total_time = self.stats[mime_type].get(step, [0, 0, 0])
+                if tries:
+                    lines.append(f'  {step:<12} tries={tries:<6} hit rate={hits / tries:6.1%}  '
+                                 f'mean time={total_time / tries:.3f}s')
+        return '\n'.join(lines)
+
+    def record(self, mime_type, step, hit, duration):
+        with self._lock:
+            step_stats = self.stats.setdefault(mime_type, {}).setdefault(step, [0, 0, 0])
+            step_stats[0] += 1
+            step_stats[1] += int(hit)
+            step_stats[2] += duration
+
+    def save(self):
+        if not self.stats_file:
+            return
+        logger.debug('Saving the ISBN search statistics in %s', self.stats_file)
+        with open(self.stats_file, 'w') as f:
+            json.dump(self.stats, f, indent=2)
+
+
+# Memo of the failures of the programs run on the files (`ebook-meta` and the
+# conversion to text), keyed by program, MIME type and error signature (the
+# last line of the error without paths and numbers). Once a program failed
+# `threshold` times with the same error for a MIME type, is_blocked() returns
+# this error and the program is no longer run for this MIME type. Only the
+# failures of the program itself are recorded (see is_tool_failure()), and a
+# success of the program for a MIME type clears its failures for this type.
+class FailureMemo:
+    def __init__(self, memo_file=FAILURE_MEMO_FILE, threshold=FAILURE_MEMO_THRESHOLD):
+        self.memo_file = memo_file
+        self.threshold = threshold
+        # e.g. {'ebook-convert': {'application/x-foo': {'error signature': 3}}}
+        self.failures = {}
+        # Number of runs of each program that were skipped, e.g.
+        # {'ebook-convert': {'application/x-foo': 12}}
+        self.skipped = {}
+        # Programs that were already run once in this run although they are
+        # blocked, e.g. {('ebook-convert', 'application/x-foo')}
+        self.retried = set()
+        self._lock = threading.Lock()
+        if memo_file and Path(memo_file).is_file():
+            try:
+                with open(memo_file, 'r') as f:
+                    self.failures = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(red(f"Couldn't load the failure memo: {e}"))
+
+    @staticmethod
+    def get_signature(error):
+        lines = [line.strip() for line in str(error).splitlines() if line.strip()]
+        signature = lines[-1] if lines else 'unknown error'
+        signature = re.sub(r'\S*[/\\]\S*', '<path>', signature)
+        return re.sub(r'\d+', 'N', signature)[:200]
+
+    def get_summary(self):
+        lines = []
+        for tool in sorted(self.failures):
+            for mime_type, signatures in sorted(self.failures[tool].items()):
+                for signature, count in signatures.items():
+                    if count >= self.threshold:
+                        skipped = self.skipped.get(tool, {}).get(mime_type, 0)
+                        lines.append(f"{tool} failed {count} times for '{mime_type or 'unknown'}' "
+                                     f"files ({skipped} runs skipped): {signature}")
+        return lines
+
+    # A failure is only memoized if the program is missing (exit code 127) or
+    # doesn't support the file format, since any other error (e.g. encrypted or
+    # corrupted file) is specific to the file
+    @staticmethod
+    def is_tool_failure(returncode, error):
+        return returncode == 127 or re.search(FAILURE_MEMO_ERROR_REGEX, str(error)) is not None
+
+    def is_blocked(self, tool, mime_type):
+        with self._lock:
+            signatures = self.failures.get(tool, {}).get(mime_type, {})
+            for signature, count in signatures.items():
+                if count >= self.threshold:
+                    # The program is still run once per run in case it was
+                    # installed or updated since it was blocked (a success
+                    # clears its failures)
+                    if (tool, mime_type) not in self.retried:
+                        self.retried.add((tool, mime_type))
+                        return None
+                    tool_skipped = self.skipped.setdefault(tool, {})
+                    tool_skipped[mime_type] = tool_skipped.get(mime_type, 0) + 1
+                    return signature
+        return None
+
+    def record(self, tool, mime_type, returncode, error):
+        if returncode == 0:
+            self.record_success(tool, mime_type)
+            return
+        if not self.is_tool_failure(returncode, error):
+            return
+        signature = self.get_signature(error)
+        with self._lock:
+            signatures = self.failures.setdefault(tool, {}).setdefault(mime_type, {})
+            signatures[signature] = signatures.get(signature, 0) + 1
+            if signatures[signature] == self.threshold:
+                logger.debug("%s failed %s times for '%s' files with the same error, it "
+                             "won't be run anymore for them: %s", tool, self.threshold,
+                             mime_type or 'unknown', signature)
+
+    def record_success(self, tool, mime_type):
+        with self._lock:
+            if self.failures.get(tool, {}).pop(mime_type, None) is not None:
+                logger.debug("%s succeeded for a '%s' file, its failures for these "
+                             "files are cleared", tool, mime_type or 'unknown')
+
+    def save(self):
+        if not self.memo_file:
+            return
+        logger.debug('Saving the failure memo in %s', self.memo_file)
+        with open(self.memo_file, 'w') as f:
+            json.dump(self.failures, f, indent=2)
+
+
+# Estimates the time needed to organize a file from its extension and size.
+# Until `min_count` files of an extension were organized, the cost is
+# estimated with DEFAULT_COSTS (seconds per file and seconds per MiB, e.g. the
+# conversion of a PDF to text grows with its size). Then the mean time of the
+# files of this extension is used, scaled by the size of the file relative to
+# their mean size.
+class FileCostModel:
+    # Extension -> (seconds per file, seconds per MiB)
+    DEFAULT_COSTS = {
+        'pdf': (1.0, 0.5), 'djvu': (2.0, 1.0), 'epub': (0.5, 0.2),
+        'mobi': (0.5, 0.2), 'azw3': (0.5, 0.2), 'fb2': (0.5, 0.2),
+        '7z': (1.0, 1.0), 'rar': (1.0, 1.0), 'zip': (1.0, 1.0), 'gz': (1.0, 1.0),
+        'png': (0.1, 0), 'jpg': (0.1, 0), 'jpeg': (0.1, 0), 'gif': (0.1, 0)}
+    DEFAULT_COST = (0.5, 0.3)
+
+    def __init__(self, history_file=COST_HISTORY_FILE, min_count=3):
+        self.history_file = history_file
+        self.min_count = min_count
+        # e.g. {'pdf': [count, total_seconds, total_mib]}
+        self.history = {}
+        self._lock = threading.Lock()
+        if history_file and Path(history_file).is_file():
+            try:
+                with open(history_file, 'r') as f:
+                    self.history = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(red(f"Couldn't load the cost history: {e}"))
+
+    def estimate(self, file_path, size=None):
+        ext = Path(file_path).suffix[1:].lower()
+        if size is None:
+            try:
+                size = os.path.getsize(file_path)
+            except OSError:
+                size = 0
+        size_mib = size / 1024 ** 2
+        count, total_seconds, total_mib = self.history.get(ext, [0, 0, 0])
+        if count >= self.min_count:
+            return total_seconds / count * (size_mib + 1) / (total_mib / count + 1)
+        per_file, per_mib = self.DEFAULT_COSTS.get(ext, self.DEFAULT_COST)
+        return per_file + per_mib * size_mib
+
+    def record(self, file_path, size, duration):
+        ext = Path(file_path).suffix[1:].lower()
+        with self._lock:
+            ext_history = self.history.setdefault(ext, [0, 0, 0])
+            ext_history[0] += 1
+            ext_history[1] += duration
+            ext_history[2] += size / 1024 ** 2
+
+    def save(self):
+        if not self.history_file:
+            return
+        logger.debug('Saving the cost history in %s', self.history_file)
+        with open(self.history_file, 'w') as f:
+            json.dump(self.history, f, indent=2)
+
+
+# Report of a corruption audit (see OrganizeEbooks._audit_files()): one row
+# per checked file (path, size, mtime_ns, status, reason and checked_at) is
+# appended in CSV or JSON lines as soon as the file is checked, thus an
+# interrupted audit can be resumed. When the report is loaded, the last row of
+# a file wins and the files whose size and modification time haven't changed
+# since are not checked again.
+class AuditReport:
+    FIELDS = ['path', 'size', 'mtime_ns', 'status', 'reason', 'checked_at']
+
+    def __init__(self, report_file):
+        self.report_file = report_file
+        self.output_format = Path(report_file).suffix[1:].lower()
+        if self.output_format not in ['csv', 'json', 'jsonl']:
+            raise ValueError(f"Unsupported format for the audit report: '{self.output_format}' "
+                             "(choose from 'jsonl', 'json', 'csv')")
+        # Absolute path -> (size, mtime_ns) of the checked files
+        self.audited = {}
+        if Path(report_file).is_file():
+            self._load()
+        new_file = not Path(report_file).is_file() or is_file_empty(report_file)
+        self._file = open(report_file, 'a', newline='')
+        import csv
+        if self.output_format == 'csv':
+            self._writer = csv.writer(self._file)
+            if new_file:
+                self._writer.writerow(self.FIELDS)
+
+    def add(self, file_path, stat, status, reason):
+        row = [os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, status,
+               reason, time.strftime('%Y-%m-%dT%H:%M:%S')]
+        if self.output_format == 'csv':
+            self._writer.writerow(row)
+        else:
+            self._file.write(json.dumps(dict(zip(self.FIELDS, row)), ensure_ascii=False) + '\n')
+        # NOTE: flushed right away so that an interrupted audit can be resumed
+        self._file.flush()
+        self.audited[row[0]] = (stat.st_size, stat.st_mtime_ns)
+
+    def close(self):
+        self._file.close()
+
+    def is_audited(self, file_path, stat):
+        return self.audited.get(os.path.abspath(file_path)) == (stat.st_size, stat.st_mtime_ns)
+
+    def _load(self):
+        import csv
+        with open(self.report_file, 'r', newline='') as f:
+            if self.output_format == 'csv':
+                rows = csv.DictReader(f)
+            else:
+                rows = (json.loads(line) for line in f if line.strip())
+            try:
+                for row in rows:
+                    self.audited[row['path']] = (int(row['size']), int(row['mtime_ns']))
+            except (KeyError, TypeError, ValueError) as e:
+                # e.g. the last line of a report interrupted while it was written
+                logger.warning(yellow(f'The audit report {self.report_file} has an invalid '
+                                      f'row: {e}'))
+        logger.debug('%s files in the audit report', len(self.audited))
+
+
+# Compiled versions of the regular expressions given as options. The registry
+# is built once when the options are applied in OrganizeEbooks._update()
+class PatternRegistry:
+    NAMES = ['isbn_direct_files', 'isbn_ignored_files', 'pamphlet_excluded_files',
+             'pamphlet_included_files', 'tested_archive_extensions',
+             'without_isbn_ignore']
+
+    def __init__(self, **patterns):
+        self.patterns = {name: patterns.get(name) for name in self.NAMES}
+
+    # The regexes are only compiled when they are first used
+    def __getattr__(self, name):
+        if name not in self.NAMES:
+            raise AttributeError(name)
+        pattern = self.patterns[name]
+        regex = re.compile(pattern) if pattern else None
+        setattr(self, name, regex)
+        return regex
+
+    # Classifies a lowercase filename in a single pass against the filename
+    # regexes, in the same order they are checked when organizing a file
+    # without ISBNs. Returns a tuple (classification, pattern) where
+    # classification is one of 'ignored' (matches `without_isbn_ignore`),
+    # 'pamphlet' (matches `pamphlet_included_files`), 'not_pamphlet' (matches
+    # `pamphlet_excluded_files`) or None
+    def classify_filename(self, lowercase_name, check_ignored=True):
+        # NOTE: `without_isbn_ignore` is matched at the beginning of the filename
+        if check_ignored and self.without_isbn_ignore \
+                and self.without_isbn_ignore.match(lowercase_name):
+            return 'ignored', self.without_isbn_ignore
+        if self.pamphlet_included_files and self.pamphlet_included_files.search(lowercase_name):
+            return 'pamphlet', self.pamphlet_included_files
+        if self.pamphlet_excluded_files and self.pamphlet_excluded_files.search(lowercase_name):
+            return 'not_pamphlet', self.pamphlet_excluded_files
+        return None, None
+
+    # Returns all the parts of `text` matching the pattern, separated by ';'
+    # Equivalent to `echo "$text" | grep -oE "$pattern" | paste -sd';'`
+    @staticmethod
+    def get_matches(pattern, text):
+        return ';'.join(match.group() for match in pattern.finditer(text))
+
+
+# Information about a pdf parsed from only one `pdfinfo` run (see probe_pdf())
+# and shared by the corruption check, the pamphlet check and OCR: number of
+# pages, size of the first page (in pts), encryption flag, producer and a hint
+# of whether the pdf has a text layer (`has_text`, only computed on first
+# access since it reads the whole file, i.e. only when OCR is enabled):
+# - True: the file references fonts
+# - False: the file doesn't reference any font and has no object streams,
+#   thus it probably contains only images (e.g. scans). It is only a hint:
+#   OCR is tried first but the file is still converted to text.
+# - None: unknown, the fonts can be hidden in compressed object streams
+class PdfProbe:
+    __slots__ = ('file_path', 'stdout', 'stderr', 'returncode', 'pages', 'page_size',
+                 'encrypted', 'producer', '_has_text')
+    # Value of `_has_text` until the file is checked for fonts
+    NOT_CHECKED = object()
+
+    def __init__(self, file_path, pdfinfo_result):
+        self.stdout = pdfinfo_result.stdout
+        self.stderr = pdfinfo_result.stderr
+        self.returncode = pdfinfo_result.returncode
+        info = {}
+        if self.returncode == 0 and isinstance(self.stdout, str):
+            for line in self.stdout.splitlines():
+                key, sep, val = line.partition(':')
+                if sep:
+                    info.setdefault(key.strip(), val.strip())
+        pages = info.get('Pages', '')
+        self.pages = int(pages) if pages.isdigit() else None
+        match = re.match(r'([0-9.]+) x ([0-9.]+) pts', info.get('Page size', ''))
+        self.page_size = (float(match.group(1)), float(match.group(2))) if match else None
+        self.encrypted = info.get('Encrypted', 'no').startswith('yes')
+        self.producer = info.get('Producer')
+        self.file_path = file_path
+        self._has_text = self.NOT_CHECKED
+
+    def __repr__(self):
+        has_text = 'not checked' if self._has_text is self.NOT_CHECKED else self._has_text
+        return f'PdfProbe(pages={self.pages}, page_size={self.page_size}, ' \
+               f'encrypted={self.encrypted}, producer={self.producer}, ' \
+               f'has_text={has_text}, returncode={self.returncode})'
+
+    @property
+    def has_text(self):
+        if self._has_text is self.NOT_CHECKED:
+            self._has_text = self.get_text_hint(self.file_path)
+        return self._has_text
+
+    @staticmethod
+    def get_text_hint(file_path):
+        import mmap
+        try:
+            with open(file_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b'/Font') != -1:
+                    return True
+                if data.find(b'/ObjStm') == -1:
+                    return False
+        except (OSError, ValueError) as e:
+            # ValueError: empty file
+            logger.debug("Couldn't look for fonts in '%s': %s", file_path, e)
+        return None
+
+
+# Per-run workspace for all the temporary files and folders. They are created
+# in /dev/shm (if available and unless a scratch folder is given) until the
+# quota is reached, then they spill to the default temp folder (on disk). Every
+# allocation is tracked (the file descriptors of the temporary files are closed
+# right away) and everything left is removed by cleanup(), which is called at
+# the end of the organization, at exit and on SIGTERM/SIGHUP.
+class ScratchWorkspace:
+    FAST_DIR = '/dev/shm'
+    # Free space left in FAST_DIR for the other programs
+    FAST_DIR_RESERVE = 64 * 1024 ** 2
+
+    def __init__(self, scratch_dir=SCRATCH_DIR, quota_mib=SCRATCH_QUOTA_MIB):
+        self.scratch_dir = scratch_dir
+        self.quota = quota_mib * 1024 ** 2
+        self.allocations = set()
+        self._roots = {}
+        self._cleanup_installed = False
+        self._lock = threading.Lock()
+
+    def configure(self, scratch_dir=None, quota_mib=None):
+        if scratch_dir != self.scratch_dir:
+            self.cleanup()
+            self.scratch_dir = scratch_dir
+        if quota_mib is not None:
+            self.quota = quota_mib * 1024 ** 2
+
+    def cleanup(self):
+        if self.allocations:
+            logger.debug('Removing %s temporary files/folders left', len(self.allocations))
+        for root in self._roots.values():
+            shutil.rmtree(root, ignore_errors=True)
+        self._roots.clear()
+        self.allocations.clear()
+
+    # The file was moved out of the workspace, e.g. a metadata file saved next
+    # to an organized ebook
+    def forget(self, path):
+        self.allocations.discard(str(path))
+
+    def get_usage(self, root):
+        usage = 0
+        for path, dirs, files in os.walk(root):
+            for name in files:
+                try:
+                    usage += os.lstat(os.path.join(path, name)).st_size
+                except OSError:
+                    pass
+        return usage
+
+    def mkdtemp(self, size_hint=0):
+        import tempfile
+        path = tempfile.mkdtemp(dir=self._choose_root(size_hint))
+        self.allocations.add(path)
+        return path
+
+    def mkstemp(self, suffix='', size_hint=0):
+        import tempfile
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self._choose_root(size_hint))
+        os.close(fd)
+        self.allocations.add(path)
+        return path
+
+    # Removes a temporary file or folder (if it still exists). Returns 0 on
+    # success, 1 otherwise.
+    def release(self, path):
+        path = str(path)
+        self.allocations.discard(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            return remove_tree(path)
+        elif os.path.lexists(path):
+            return remove_file(path)
+        return 0
+
+    def _choose_root(self, size_hint):
+        if self.scratch_dir is None and os.path.isdir(self.FAST_DIR) \
+                and os.access(self.FAST_DIR, os.W_OK):
+            root = self._get_root('fast')
+            if self.get_usage(root) + size_hint <= self.quota \
+                    and shutil.disk_usage(root).free - size_hint > self.FAST_DIR_RESERVE:
+                return root
+            logger.debug('The scratch quota in %s is reached, using the disk', self.FAST_DIR)
+        return self._get_root('disk')
+
+    def _get_root(self, kind):
+        import tempfile
+        with self._lock:
+            if kind not in self._roots:
+                if kind == 'fast':
+                    parent = self.FAST_DIR
+                else:
+                    parent = self.scratch_dir if self.scratch_dir else tempfile.gettempdir()
+                self._roots[kind] = tempfile.mkdtemp(prefix='organize-ebooks-', dir=parent)
+                logger.debug('Created the scratch folder %s', self._roots[kind])
+                self._install_cleanup()
+            return self._roots[kind]
+
+    def _install_cleanup(self):
+        if self._cleanup_installed:
+            return
+        self._cleanup_installed = True
+        atexit.register(self.cleanup)
+        # NOTE: signal handlers can only be set from the main thread and the
+        # handlers set by the application are left untouched
+        if threading.current_thread() is not threading.main_thread():
+            return
+        for signum in [signal.SIGTERM, getattr(signal, 'SIGHUP', None)]:
+            if signum and signal.getsignal(signum) == signal.SIG_DFL:
+                # sys.exit() runs the `finally` clauses and the atexit functions
+                signal.signal(signum, lambda num, frame: sys.exit(128 + num))
+
+
+# Moves and links the organized files:
+# - the folders that were already created (or found) are cached, thus each
+#   output folder is only checked once
+# - on the same filesystem, a file is moved with an atomic os.rename()
+# - across filesystems, the file is copied in the kernel (copy_file_range or
+#   sendfile) to a temporary file next to the destination, the copy is
+#   verified (size and BLAKE2 checksum) and only then renamed to the
+#   destination and the source file removed
+# - hard links can be created instead of moving the files (see link())
+# When files are organized in parallel, `lock` must be held from the choice of
+# a unique filename until the file is moved there.
+class MoveExecutor:
+    CHUNK_SIZE = 64 * 1024 ** 2
+
+    def __init__(self):
+        self.folders = set()
+        self.lock = threading.RLock()
+        # MovePlan where the moves are recorded instead of being done
+        self.plan = None
+        # MetadataStore where the metadata files are saved instead of next to
+        # the books (see save_metadata_file())
+        self.metadata_store = None
+
+    # Forgets the folders that were created, e.g. between two organizations
+    def clear(self):
+        self.folders.clear()
+
+    @classmethod
+    def copy_file(cls, src, dst):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            infd, outfd = fsrc.fileno(), fdst.fileno()
+            size = os.fstat(infd).st_size
+            offset = 0
+            for method in ['copy_file_range', 'sendfile']:
+                func = getattr(os, method, None)
+                if func is None or offset >= size:
+                    continue
+                os.lseek(outfd, offset, os.SEEK_SET)
+                try:
+                    while offset < size:
+                        count = min(size - offset, cls.CHUNK_SIZE)
+                        if method == 'copy_file_range':
+                            copied = func(infd, outfd, count, offset, offset)
+                        else:
+                            copied = func(outfd, infd, offset, count)
+                        if not copied:
+                            break
+                        offset += copied
+                except OSError as e:
+                    # e.g. EXDEV with copy_file_range on old kernels, or
+                    # sendfile not supporting regular files (macOS)
+                    logger.debug('%s failed (%s), trying another copy method', method, e)
+            if offset < size:
+                fsrc.seek(offset)
+                fdst.seek(offset)
+                shutil.copyfileobj(fsrc, fdst, cls.CHUNK_SIZE)
+        shutil.copystat(src, dst)
+
+    def ensure_folder(self, folder):
+        folder = str(folder)
+        if folder not in self.folders:
+            if not os.path.isdir(folder):
+                logger.debug('Creating folder %s', folder)
+                os.makedirs(folder, exist_ok=True)
+            self.folders.add(folder)
+
+    @staticmethod
+    def get_checksum(file_path):
+        import hashlib
+        checksum = hashlib.blake2b()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 ** 2), b''):
+                checksum.update(chunk)
+        return checksum.digest()
+
+    # Creates a hard link (or a symbolic link if `symbolic` is True or if the
+    # files are on different filesystems)
+    def link(self, src, dst, symbolic=False):
+        self.ensure_folder(Path(dst).parent)
+        if not symbolic:
+            try:
+                os.link(src, dst)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                logger.warning(yellow(f"Can't create a hard link to '{src}' on another "
+                                      'filesystem, creating a symbolic link instead'))
+        Path(dst).symlink_to(src)
+
+    def move(self, src, dst, clobber=True):
+        src = Path(src)
+        dst = Path(dst)
+        if dst.exists():
+            logger.debug('%s: file already exists', dst.name)
+            logger.debug("Destination folder path: %s", dst.parent)
+            if not clobber:
+                logger.debug('%s: cannot overwrite existing file', dst.name)
+                logger.debug("Skipping it!")
+                return
+            logger.debug('%s: overwriting the file', dst.name)
+        else:
+            logger.debug("Moving '%s'...", src.name)
+            logger.debug("Destination folder path: %s", dst.parent)
+        self.ensure_folder(dst.parent)
+        try:
+            os.rename(src, dst)
+            logger.debug("File moved!")
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        # The destination is on another filesystem
+        tmp_dst = dst.with_name(f'.{dst.name}.part')
+        start = time.perf_counter()
+        try:
+            self.copy_file(src, tmp_dst)
+            if os.path.getsize(src) != os.path.getsize(tmp_dst) \
+                    or self.get_checksum(src) != self.get_checksum(tmp_dst):
+                raise OSError(f"The copy of '{src}' is different from the original")
+            os.replace(tmp_dst, dst)
+        except BaseException:
+            if tmp_dst.exists():
+                tmp_dst.unlink()
+            raise
+        src.unlink()
+        duration = time.perf_counter() - start
+        size_mib = os.path.getsize(dst) / 1024 ** 2
+        logger.debug('File copied to another filesystem and verified: %.1f MiB in '
+                     '%.2f s (%.1f MiB/s)', size_mib, duration, size_mib / max(duration, 1e-6))
+
+
+# Plan of an organization (see `plan_file`): instead of being moved, each file
+# is recorded in a JSON lines file with its destination, the reason and the
+# confidence of the decision and the metadata files to save next to it. The
+# destinations are reserved (see unique_filename()) thus two files of the plan
+# never get the same destination. The plan is applied later, without any new
+# search, by OrganizeEbooks.apply_plan().
+class MovePlan:
+    def __init__(self, plan_file, mode='move'):
+        self.plan_file = plan_file
+        self.mode = mode
+        self.reserved = set()
+        # Path -> content of the metadata files to save
+        self.sidecars = {}
+        self._lock = threading.Lock()
+        self._file = open(plan_file, 'w')
+
+    def add(self, file_result, confidence, sidecar_extension):
+        try:
+            stat = os.stat(file_result.path)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            size = mtime_ns = None
+        entry = {'source': os.path.abspath(file_result.path),
+                 'destination': None, 'status': file_result.status,
+                 'reason': file_result.reason, 'confidence': confidence,
+                 'metadata_source': file_result.metadata_source, 'mode': self.mode,
+                 'size': size, 'mtime_ns': mtime_ns, 'sidecars': {}}
+        if file_result.new_path:
+            entry['destination'] = os.path.abspath(file_result.new_path)
+            sidecar_path = f'{file_result.new_path}.{sidecar_extension}'
+            with self._lock:
+                sidecar = self.sidecars.pop(sidecar_path, None)
+            if sidecar is not None:
+                entry['sidecars'][os.path.abspath(sidecar_path)] = sidecar
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def add_sidecar(self, path, text):
+        with self._lock:
+            self.sidecars[str(path)] = text
+
+    def close(self):
+        self._file.close()
+
+    def is_reserved(self, path):
+        with self._lock:
+            return str(path) in self.reserved
+
+    # Returns the entries of a plan file
+    @staticmethod
+    def load(plan_file):
+        with open(plan_file, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def reserve(self, path):
+        with self._lock:
+            self.reserved.add(str(path))
+
+
+# Consolidated store of the metadata files of the books of a folder: instead
+# of one small file next to each book (e.g. 'book.pdf.meta'), the metadata of
+# all the books of a folder are saved in one hidden file, in JSON lines
+# (appended, the last record of a file wins) or in a SQLite database. The
+# records are buffered and written in batches of `batch_size` records (or
+# every `max_delay` seconds) with one fsync per batch, and flushed by close().
+# export() rebuilds the metadata files next to the books from the stores.
+class MetadataStore:
+    NAME = '.organize-ebooks-metadata'
+
+    def __init__(self, sink=METADATA_SINK, batch_size=METADATA_SINK_BATCH, max_delay=10):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        # Folder -> list of (name of the metadata file, metadata)
+        self.pending = {}
+        self.num_pending = 0
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, metadata_path, metadata):
+        folder, name = os.path.split(os.path.abspath(metadata_path))
+        with self._lock:
+            self.pending.setdefault(folder, []).append((name, metadata))
+            self.num_pending += 1
+            if self.num_pending >= self.batch_size \
+                    or time.monotonic() - self.last_flush >= self.max_delay:
+                self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+    # Writes the metadata files of the stores found in `folder` (and its
+    # subfolders) next to their books. Returns the number of files written.
+    @classmethod
+    def export(cls, folder, overwrite=False):
+        num_files = 0
+        for store_path in sorted(Path(folder).rglob(f'{cls.NAME}.*')):
+            records = {}
+            if store_path.suffix == '.jsonl':
+                with open(store_path, 'r') as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            records[record['name']] = record['metadata']
+            elif store_path.suffix == '.sqlite':
+                import sqlite3
+                conn = sqlite3.connect(store_path)
+                records = dict(conn.execute('SELECT name, metadata FROM metadata'))
+                conn.close()
+            for name, metadata in records.items():
+                metadata_path = store_path.parent.joinpath(name)
+                if metadata_path.exists() and not overwrite:
+                    logger.debug('File already exists: %s', metadata_path)
+                    continue
+                with open(metadata_path, 'w') as f:
+                    f.write(metadata)
+                num_files += 1
+            logger.info(f'{len(records)} metadata files in {store_path}')
+        return num_files
+
+    def _flush(self):
+        for folder, records in self.pending.items():
+            store_path = os.path.join(folder, f'{self.NAME}.{self.sink}')
+            logger.debug('Saving %s metadata files in %s', len(records), store_path)
+            if self.sink == 'sqlite':
+                import sqlite3
+                conn = sqlite3.connect(store_path)
+                with conn:
+                    conn.execute('CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, '
+                                 'metadata TEXT)')
+                    conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)', records)
+                conn.close()
+            else:
+                with open(store_path, 'a') as f:
+                    f.write(''.join(json.dumps({'name': name, 'metadata': metadata},
+                                               ensure_ascii=False) + '\n'
+                                    for name, metadata in records))
+                    f.flush()
+                    os.fsync(f.fileno())
+        self.pending.clear()
+        self.num_pending = 0
+        self.last_flush = time.monotonic()
+
+
+# Paces the requests sent to each online metadata source with a token bucket
+# (`rate` requests per second, up to `burst` at once; no pacing if `rate` is 0)
+# shared by all the threads, and tracks the health of the sources: after a
+# failure (an error matching `error_regex` or `max_empty` empty responses in a
+# row), the source is skipped for an exponential backoff (with jitter). A
+# successful response resets the backoff of its source.
+class SourceScheduler:
+    def __init__(self, rate=METADATA_SOURCE_RATE, burst=METADATA_SOURCE_BURST,
+                 backoff=METADATA_SOURCE_BACKOFF, max_backoff=METADATA_SOURCE_MAX_BACKOFF,
+                 max_empty=METADATA_SOURCE_MAX_EMPTY,
+                 error_regex=METADATA_SOURCE_ERROR_REGEX):
+        self.configure(rate, burst, backoff, max_backoff, max_empty, error_regex)
+        # Source -> state of its bucket and health
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    # Waits for the next request allowed to the source. Returns False right
+    # away if the source is skipped because it is failing. With `block=False`,
+    # returns None instead of waiting if the source has no token left.
+    def acquire(self, source, block=True):
+        while True:
+            with self._lock:
+                state = self._get_state(source)
+                now = time.monotonic()
+                if now < state['blocked_until']:
+                    state['skipped'] += 1
+                    return False
+                if not self.rate:
+                    state['requests'] += 1
+                    return True
+                state['tokens'] = min(self.burst,
+                                      state['tokens'] + (now - state['updated']) * self.rate)
+                state['updated'] = now
+                if state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    state['requests'] += 1
+                    return True
+                if not block:
+                    return None
+                wait_time = (1 - state['tokens']) / self.rate
+            time.sleep(wait_time)
+
+    def clear(self):
+        with self._lock:
+            self.sources.clear()
+
+    def configure(self, rate=METADATA_SOURCE_RATE, burst=METADATA_SOURCE_BURST,
+                  backoff=METADATA_SOURCE_BACKOFF, max_backoff=METADATA_SOURCE_MAX_BACKOFF,
+                  max_empty=METADATA_SOURCE_MAX_EMPTY,
+                  error_regex=METADATA_SOURCE_ERROR_REGEX):
+        # A rate of 0 (or less) disables the pacing
+        self.rate = rate if rate and rate > 0 else None
+        self.burst = max(burst, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_empty = max_empty
+        # NOTE: compiled (and cached by `re`) on the first report, not at import
+        self.error_regex = error_regex
+
+    # Returns the lines of the summary of the sources that failed
+    def get_summary(self):
+        lines = []
+        with self._lock:
+            for source, state in sorted(self.sources.items()):
+                if state['failures_total']:
+                    lines.append(f"Metadata source '{source}': {state['requests']} requests, "
+                                 f"{state['failures_total']} failures, skipped "
+                                 f"{state['skipped']} times")
+        return lines
+
+    # Returns False if the source is skipped because it is failing
+    def is_available(self, source):
+        with self._lock:
+            state = self._get_state(source)
+            if time.monotonic() < state['blocked_until']:
+                state['skipped'] += 1
+                return False
+            return True
+
+    # Updates the health of the source with the Result of a request (its
+    # `stderr` must only be the log of this source, see
+    # CalibreMetadataBackend.get_source_log())
+    def report(self, source, result):
+        if self.error_regex and re.search(self.error_regex, str(result.stderr)):
+            outcome = 'error'
+        elif result.returncode == 0 and str(result.stdout).strip():
+            outcome = 'ok'
+        else:
+            outcome = 'empty'
+        with self._lock:
+            state = self._get_state(source)
+            if outcome == 'ok':
+                state['failures'] = state['empty'] = 0
+                return
+            if time.monotonic() < state['blocked_until']:
+                # NOTE: the request was sent before the source was blocked
+                return
+            if outcome == 'empty':
+                state['empty'] += 1
+                if state['empty'] < self.max_empty:
+                    return
+            state['empty'] = 0
+            state['failures'] += 1
+            state['failures_total'] += 1
+            delay = min(self.backoff * 2 ** (state['failures'] - 1), self.max_backoff)
+            import random
+            delay *= random.uniform(0.8, 1.2)
+            state['blocked_until'] = time.monotonic() + delay
+        logger.warning(yellow(f"Metadata source '{source}' is failing ({outcome}), it is "
+                              f"skipped for {delay:.0f} seconds"))
+
+    def _get_state(self, source):
+        if source not in self.sources:
+            self.sources[source] = {
+                'tokens': self.burst, 'updated': time.monotonic(), 'blocked_until': 0,
+                'failures': 0, 'empty': 0, 'requests': 0, 'failures_total': 0,
+                'skipped': 0}
+        return self.sources[source]
+
+
+# Metadata backends: each backend has a `name` and a fetch() method that
+# returns a Result whose `stdout` is the metadata of the book (found by ISBN or
+# by title and author) in the format of calibre's `fetch-ebook-metadata`, e.g.
+# 'Title               : A nice ebook'. Other backends (with the same
+# interface) can be given to OrganizeEbooks with `metadata_backends`.
+
+# Fetches the metadata from online sources with calibre's `fetch-ebook-metadata`
+# (or `command`). With a `scheduler` (see SourceScheduler), the failing sources
+# are left out and the sources that have a request available are queried
+# together in one call (thus calibre merges their results), each source's
+# health being updated with its own part of the log. Only if they don't find
+# the book, the throttled sources are then requested one at a time (in order,
+# until one of them finds the book) once they are allowed to.
+class CalibreMetadataBackend:
+    def __init__(self, sources, command=FETCH_METADATA_COMMAND, scheduler=None):
+        if isinstance(sources, str):
+            sources = sources.split(',')
+        # Remove whitespaces around the sources
+        self.sources = [source.strip() for source in sources]
+        self.name = ','.join(self.sources)
+        self.command = command
+        self.scheduler = scheduler
+
+    def fetch(self, isbn=None, title=None, author=None):
+        if isbn:
+            options = f'--verbose --isbn={isbn}'
+        else:
+            options = f'--verbose --title="{title}"'
+            if author:
+                options += f' --author="{author}"'
+        if not self.scheduler:
+            return fetch_metadata(self._quote(self.sources), options, self.command)
+        ready, throttled = [], []
+        for source in self.sources:
+            acquired = self.scheduler.acquire(source, block=False)
+            if acquired:
+                ready.append(source)
+            elif acquired is None:
+                throttled.append(source)
+        result = None
+        if ready:
+            result = fetch_metadata(self._quote(ready), options, self.command)
+            for source in ready:
+                self.scheduler.report(source, Result(
+                    stdout=result.stdout, returncode=result.returncode,
+                    stderr=self.get_source_log(result.stderr, source, ready)))
+            if result.returncode == 0 and str(result.stdout).strip():
+                return result
+        for source in throttled:
+            if not self.scheduler.acquire(source):
+                continue
+            result = fetch_metadata(self._quote([source]), options, self.command)
+            self.scheduler.report(source, result)
+            if result.returncode == 0 and str(result.stdout).strip():
+                return result
+        if result is None:
+            return Result(stderr=f"Metadata sources skipped since they are failing: "
+                                 f"{self.name}", returncode=1)
+        return result
+
+    # Returns the part of the log of `fetch-ebook-metadata` written by the
+    # source. In its verbose log, calibre starts the log of each source with a
+    # header such as '****** Google (1, 0, 1) ******'. The whole log is
+    # returned if there is only one source or no header for this source.
+    @staticmethod
+    def get_source_log(log, source, sources):
+        if len(sources) == 1:
+            return log
+        source_log = None
+        current = None
+        for line in str(log).splitlines():
+            header = re.fullmatch(r'\s*\*{10,}\s*(.+?)\s*\*{10,}\s*', line)
+            if header:
+                current = next((s for s in sources if header.group(1).startswith(s)), None)
+                if current == source and source_log is None:
+                    source_log = []
+            elif current == source:
+                source_log.append(line)
+        return log if source_log is None else '\n'.join(source_log)
+
+    # Check if there are spaces in the sources, and if it is the case enclose
+    # them in quotation marks, e.g. WorldCat xISBN --> "WorldCat xISBN"
+    @staticmethod
+    def _quote(sources):
+        return [f'"{source}"' if ' ' in source else source for source in sources]
+
+
+# Local catalog of book metadata in a SQLite database, e.g. imported from a
+# bulk dump of OpenLibrary or from our own CSV/JSON-lines exports (see
+# import_file()). The books are found by ISBN (primary key) or by the words of
+# their title and authors (FTS5 full-text index, or LIKE queries if the SQLite
+# library doesn't support FTS5). Each book has a unique key (see
+# get_book_key()), thus importing a file again updates its books.
+class LocalMetadataCatalog:
+    FIELDS = ['title', 'authors', 'publisher', 'published', 'series', 'languages']
+    # Labels of the fields in the format of calibre's `fetch-ebook-metadata`
+    LABELS = {'title': 'Title', 'authors': 'Author(s)', 'publisher': 'Publisher',
+              'series': 'Series', 'languages': 'Languages', 'published': 'Published'}
+
+    def __init__(self, catalog_file):
+        import sqlite3
+        self.catalog_file = catalog_file
+        self.name = 'local catalog'
+        self.conn = sqlite3.connect(catalog_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS books (id INTEGER PRIMARY KEY, key TEXT, '
+                              + ', '.join(f'{field} TEXT' for field in self.FIELDS) + ')')
+            # NOTE: the catalogs created before the keys were added get the column
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(books)')]
+            if 'key' not in columns:
+                self.conn.execute('ALTER TABLE books ADD COLUMN key TEXT')
+            self.conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS books_key ON books (key)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS isbns (isbn TEXT PRIMARY KEY, '
+                              'book_id INTEGER NOT NULL) WITHOUT ROWID')
+            # Names of the OpenLibrary authors, see _read_openlibrary()
+            self.conn.execute('CREATE TABLE IF NOT EXISTS authors (key TEXT PRIMARY KEY, '
+                              'name TEXT) WITHOUT ROWID')
+            try:
+                self.conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING '
+                                  "fts5(title, authors, content='books', content_rowid='id')")
+                self.has_fts = True
+            except sqlite3.OperationalError:
+                logger.debug('FTS5 is not supported by SQLite, the titles will be searched '
+                             'with LIKE queries')
+                self.has_fts = False
+
+    def close(self):
+        self.conn.close()
+
+    def fetch(self, isbn=None, title=None, author=None):
+        book = self.find_by_isbn(isbn) if isbn else self.search(title, author)
+        if book is None:
+            return Result(stderr='Not found in the local catalog', returncode=1)
+        lines = [f'{self.LABELS[field]:<20}: {book[field]}'
+                 for field in self.FIELDS if book.get(field)]
+        if isbn:
+            lines.append(f"{'Identifiers':<20}: isbn:{isbn}")
+        return Result(stdout='\n'.join(lines) + '\n', returncode=0)
+
+    def find_by_isbn(self, isbn):
+        isbn = re.sub('[^0-9X]', '', isbn.upper())
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.FIELDS)} FROM books JOIN isbns ON books.id = "
+                f"isbns.book_id WHERE isbn = ?", (isbn,)).fetchone()
+        return dict(zip(self.FIELDS, row)) if row else None
+
+    # Returns the key of a book: its first ISBN (as ISBN-13) or, for the books
+    # without ISBN, its title and authors
+    @staticmethod
+    def get_book_key(book, isbns):
+        if isbns:
+            return f'isbn:{isbn10_to_isbn13(isbns[0])}'
+        return f"title:{book['title'].lower()}|{(book.get('authors') or '').lower()}"
+
+    # Imports the books of the given file: JSON lines or CSV (with the columns
+    # title, authors, isbns, publisher, published, series and languages; lists
+    # can be separated by ';') or a dump of OpenLibrary (authors or editions,
+    # optionally gzipped; import the authors first for their names). The books
+    # already in the catalog (same key or one of their ISBNs) are updated.
+    # Returns the number of imported books.
+    def import_file(self, file_path, file_format=None):
+        file_format = file_format if file_format else self._guess_format(file_path)
+        reader = {'csv': self._read_csv, 'jsonl': self._read_jsonl,
+                  'openlibrary': self._read_openlibrary}[file_format]
+        logger.info(f"Importing the {file_format} file '{file_path}' in the local catalog...")
+        num_books = 0
+        num_updated = 0
+        with self._lock, self.conn:
+            self.conn.execute('PRAGMA synchronous = OFF')
+            for book in reader(file_path):
+                isbns = [re.sub('[^0-9X]', '', isbn.upper()) for isbn in book.pop('isbns', [])]
+                isbns = [isbn for isbn in isbns if len(isbn) in [10, 13]]
+                if not book.get('title') or (not isbns and not book.get('authors')):
+                    continue
+                key = self.get_book_key(book, isbns)
+                values = [book.get(field) for field in self.FIELDS]
+                book_id = self._find_book_id(key, isbns)
+                if book_id is None:
+                    book_id = self.conn.execute(
+                        f"INSERT INTO books (key, {', '.join(self.FIELDS)}) VALUES "
+                        f"({', '.join('?' * (len(self.FIELDS) + 1))})", [key] + values).lastrowid
+                else:
+                    self.conn.execute(
+                        f"UPDATE books SET key = COALESCE(key, ?), "
+                        f"{', '.join(f'{field} = ?' for field in self.FIELDS)} WHERE id = ?",
+                        [key] + values + [book_id])
+                    num_updated += 1
+                self.conn.executemany('INSERT OR REPLACE INTO isbns VALUES (?, ?)',
+                                      [(isbn, book_id) for isbn in isbns])
+                num_books += 1
+            if self.has_fts:
+                self.conn.execute("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+        logger.info(f'{num_books} books imported ({num_updated} already in the catalog '
+                    f'were updated)')
+        return num_books
+
+    # Returns the book whose title (and authors if given) contain all the words
+    # of `title` (and `author`), the best match first
+    def search(self, title, author=None):
+        title_words = re.findall(r'\w+', title.lower()) if title else []
+        author_words = re.findall(r'\w+', author.lower()) if author else []
+        if not title_words:
+            return None
+        columns = ', '.join(f'books.{field}' for field in self.FIELDS)
+        if self.has_fts:
+            query = 'title : ({})'.format(' '.join(f'"{word}"' for word in title_words))
+            if author_words:
+                query += ' AND authors : ({})'.format(' '.join(f'"{word}"' for word in author_words))
+            sql = f'SELECT {columns} FROM books_fts JOIN books ON books.id = books_fts.rowid ' \
+                  f'WHERE books_fts MATCH ? ORDER BY rank LIMIT 1'
+            params = [query]
+        else:
+            conditions = ['title LIKE ?'] * len(title_words) + ['authors LIKE ?'] * len(author_words)
+            sql = f"SELECT {columns} FROM books WHERE {' AND '.join(conditions)} " \
+                  f"ORDER BY length(title) LIMIT 1"
+            params = [f'%{word}%' for word in title_words + author_words]
+        with self._lock:
+            row = self.conn.execute(sql, params).fetchone()
+        return dict(zip(self.FIELDS, row)) if row else None
+
+    def _find_book_id(self, key, isbns):
+        row = self.conn.execute('SELECT id FROM books WHERE key = ?', (key,)).fetchone()
+        if row is None and isbns:
+            row = self.conn.execute(
+                f"SELECT book_id FROM isbns WHERE isbn IN ({', '.join('?' * len(isbns))})",
+                isbns).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _guess_format(file_path):
+        name = str(file_path).lower()
+        if name.endswith('.gz'):
+            name = name[:-3]
+        if name.endswith('.csv'):
+            return 'csv'
+        elif name.endswith(('.jsonl', '.json', '.ndjson')):
+            return 'jsonl'
+        return 'openlibrary'
+
+    @staticmethod
+    def _open(file_path):
+        if str(file_path).endswith('.gz'):
+            import gzip
+            return gzip.open(file_path, 'rt', encoding='utf8', errors='ignore')
+        return open(file_path, 'r', encoding='utf8', errors='ignore', newline='')
+
+    @staticmethod
+    def _to_book(record):
+        def to_list(value):
+            if not value:
+                return []
+            if isinstance(value, str):
+                return [v.strip() for v in re.split(r';|\s&\s', value) if v.strip()]
+            return [str(v) for v in value]
+        isbns = [isbn for value in to_list(record.get('isbns', record.get('isbn')))
+                 for isbn in re.split(r'[,\s]+', value) if isbn]
+        return {'title': record.get('title'),
+                'authors': ' & '.join(to_list(record.get('authors', record.get('author')))),
+                'isbns': isbns,
+                'publisher': record.get('publisher'),
+                'published': record.get('published', record.get('publish_date')),
+                'series': record.get('series'),
+                'languages': ', '.join(to_list(record.get('languages')))}
+
+    def _read_csv(self, file_path):
+        import csv
+        with self._open(file_path) as f:
+            for record in csv.DictReader(f):
+                yield self._to_book(record)
+
+    def _read_jsonl(self, file_path):
+        with self._open(file_path) as f:
+            for line in f:
+                if line.strip():
+                    yield self._to_book(json.loads(line))
+
+    # Reads a dump of OpenLibrary: one record per line with the columns type,
+    # key, revision, last modified and JSON. The authors are saved for the
+    # editions imported afterwards (which only reference the authors by key)
+    # and the editions without ISBN are skipped.
+    def _read_openlibrary(self, file_path):
+        with self._open(file_path) as f:
+            for line in f:
+                columns = line.rstrip('\n').split('\t')
+                if len(columns) != 5:
+                    continue
+                record_type, key, record = columns[0], columns[1], columns[4]
+                if record_type == '/type/author':
+                    name = json.loads(record).get('name')
+                    if name:
+                        self.conn.execute('INSERT OR REPLACE INTO authors VALUES (?, ?)',
+                                          (key, name))
+                elif record_type == '/type/edition':
+                    edition = json.loads(record)
+                    isbns = edition.get('isbn_13', []) + edition.get('isbn_10', [])
+                    if not isbns:
+                        continue
+                    authors = []
+                    for author in edition.get('authors', []):
+                        row = self.conn.execute('SELECT name FROM authors WHERE key = ?',
+                                                (author.get('key'),)).fetchone()
+                        if row:
+                            authors.append(row[0])
+                    if not authors and edition.get('by_statement'):
+                        authors = [edition['by_statement'].strip(' .')]
+                    yield {'title': edition.get('title'),
+                           'authors': ' & '.join(authors),
+                           'isbns': isbns,
+                           'publisher': ', '.join(edition.get('publishers', [])),
+                           'published': edition.get('publish_date'),
+                           'series': ', '.join(edition.get('series', [])),
+                           'languages': ', '.join(language.get('key', '').split('/')[-1]
+                                                  for language in edition.get('languages', []))}
+
+
+# In-memory index of the titles resolved (with their metadata) during this run
+# and the previous ones (if saved in `index_file`). The titles are tokenized
+# (see tokenize()) and indexed by character trigrams, thus a near-duplicate
+# title (e.g. from the filename of another copy of a book) is resolved
+# locally. It is a metadata backend (see CalibreMetadataBackend) that only
+# searches by title.
+class TitleIndex:
+    # The shorter titles are too ambiguous
+    MIN_TITLE_LENGTH = 5
+
+    def __init__(self, index_file=TITLE_INDEX_FILE,
+                 min_similarity=TITLE_INDEX_MIN_SIMILARITY,
+                 tokens_to_ignore=TOKENS_TO_IGNORE):
+        self.name = 'title index'
+        self.index_file = index_file
+        self.min_similarity = min_similarity
+        self.tokens_to_ignore = tokens_to_ignore
+        # Tokenized title -> metadata
+        self.entries = {}
+        # Trigram -> ids of the titles (index in `titles`)
+        self.postings = {}
+        self.titles = []
+        self.num_trigrams = []
+        self._lock = threading.Lock()
+        if index_file and Path(index_file).is_file():
+            try:
+                with open(index_file, 'r') as f:
+                    for title, metadata in json.load(f).items():
+                        self._add(title, metadata)
+            except (OSError, ValueError) as e:
+                logger.error(red(f"Couldn't load the title index: {e}"))
+
+    @staticmethod
+    def get_trigrams(title):
+        title = f'  {title} '
+        return {title[i:i + 3] for i in range(len(title) - 2)}
+
+    def add(self, title, metadata):
+        title = ' '.join(tokenize(title, self.tokens_to_ignore)) if title else ''
+        if len(title) >= self.MIN_TITLE_LENGTH:
+            with self._lock:
+                self._add(title, metadata)
+
+    def fetch(self, isbn=None, title=None, author=None):
+        metadata = None if isbn else self.search(title)
+        if metadata is None:
+            return Result(stderr='Not found in the title index', returncode=1)
+        return Result(stdout=metadata, returncode=0)
+
+    def save(self):
+        if not self.index_file:
+            return
+        logger.debug('Saving the title index in %s', self.index_file)
+        with open(self.index_file, 'w') as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+
+    # Returns the metadata of the most similar title (None if no title is
+    # similar enough)
+    def search(self, title):
+        title = ' '.join(tokenize(title, self.tokens_to_ignore)) if title else ''
+        if len(title) < self.MIN_TITLE_LENGTH:
+            return None
+        trigrams = self.get_trigrams(title)
+        counts = {}
+        with self._lock:
+            if title in self.entries:
+                return self.entries[title]
+            for trigram in trigrams:
+                for title_id in self.postings.get(trigram, ()):
+                    counts[title_id] = counts.get(title_id, 0) + 1
+            best_id, best_similarity = None, 0
+            for title_id, count in counts.items():
+                similarity = 2 * count / (len(trigrams) + self.num_trigrams[title_id])
+                if similarity > best_similarity:
+                    best_id, best_similarity = title_id, similarity
+            if best_similarity < self.min_similarity:
+                return None
+            logger.debug("'%s' is similar to the indexed title '%s' (%.2f)", title,
+                         self.titles[best_id], best_similarity)
+            return self.entries[self.titles[best_id]]
+
+    def _add(self, title, metadata):
+        if title not in self.entries:
+            trigrams = self.get_trigrams(title)
+            for trigram in trigrams:
+                self.postings.setdefault(trigram, set()).add(len(self.titles))
+            self.titles.append(title)
+            self.num_trigrams.append(len(trigrams))
+        self.entries[title] = metadata
+
+
+# Formats the log records as JSON lines, e.g. for the logs of high-volume runs
+# that are saved in a file (see setup_log()) and processed by other tools
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'time': record.created,
+                 'logger': record.name,
+                 'level': record.levelname,
+                 'message': _ANSI_ESCAPE_REGEX.sub('', record.getMessage())}
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
 # ------
 # Colors
 # ------
@@ -178,16 +1742,23 @@ _COLOR_TO_CODE = {
     'v': COLORS['VIOLET'],
     'bold': COLORS['BOLD']
 }
+# Reset sequence followed by the color code, used for restoring the color
+# after any colored text nested in the message
+_COLOR_TO_RESET = {k: COLORS['NC'] + v for k, v in _COLOR_TO_CODE.items()}
+# Matches the ANSI escape sequences used by the colors, e.g. for removing them
+# from the messages saved in the JSON-lines logs
+_ANSI_ESCAPE_REGEX = re.compile('\033\\[[0-9;]*m')
 
 
 def color(msg, msg_color='y', bold_msg=False):
     msg_color = msg_color.lower()
-    colors = list(_COLOR_TO_CODE.keys())
-    assert msg_color in colors, f'Wrong color: {msg_color}. Only these ' \
-                                f'colors are supported: {msg_color}'
+    code = _COLOR_TO_CODE.get(msg_color)
+    assert code, f'Wrong color: {msg_color}. Only these colors are ' \
+                 f'supported: {list(_COLOR_TO_CODE.keys())}'
     msg = bold(msg) if bold_msg else msg
-    msg = msg.replace(COLORS['NC'], COLORS['NC']+_COLOR_TO_CODE[msg_color])
-    return f"{_COLOR_TO_CODE[msg_color]}{msg}{COLORS['NC']}"
+    if COLORS['NC'] in msg:
+        msg = msg.replace(COLORS['NC'], _COLOR_TO_RESET[msg_color])
+    return code + msg + COLORS['NC']
 
 
 def blue(msg):
@@ -214,18 +1785,21 @@ def yellow(msg):
     return color(msg)
 
 
-def catdoc(input_file, output_file):
+# If `output_file` is None, the text is only returned in `result.stdout`
+# If `output_file` is given, the text is streamed into it (and not returned)
+def catdoc(input_file, output_file=None):
     cmd = f'catdoc "{input_file}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    # Everything on the stdout must be copied to the output file
-    if result.returncode == 0:
-        with open(output_file, 'w') as f:
-            f.write(result.stdout)
-    return convert_result_from_shell_cmd(result)
+    if output_file:
+        with open(output_file, 'wb') as f:
+            result = run_command(args, stdout=f)
+    else:
+        result = run_command(args)
+    return convert_text_result_from_shell_cmd(result)
 
 
-# Checks the supplied file for different kinds of corruption:
+# Checks the supplied file for different kinds of corruption
+# (`tested_archive_extensions` can be a string or a compiled regex):
 #  - If it's zero-sized or contains only \0
 #  - If it has a pdf extension but different mime type
 #  - If it's a pdf and `pdfinfo` returns an error
@@ -234,8 +1808,8 @@ def catdoc(input_file, output_file):
 def check_file_for_corruption(
         file_path, tested_archive_extensions=TESTED_ARCHIVE_EXTENSIONS):
     file_err = ''
-    logger.debug(f"Testing '{Path(file_path).name}' for corruption...")
-    logger.debug(f"Full path: {file_path}")
+    logger.debug("Testing '%s' for corruption...", Path(file_path).name)
+    logger.debug("Full path: %s", file_path)
 
     # TODO: test that it is the same as
     # if [[ "$(tr -d '\0' < "$file_path" | head -c 1)" == "" ]]; then
@@ -260,18 +1834,19 @@ def check_file_for_corruption(
             logger.debug(file_err)
             return file_err
         else:
-            pdfinfo_output = pdfinfo(file_path)
+            pdfinfo_output = probe_pdf(file_path)
             if pdfinfo_output.stderr:
                 logger.debug('pdfinfo returned an error!')
-                logger.debug(f'Error:\n{pdfinfo_output.stderr}')
+                logger.debug('Error:\n%s', pdfinfo_output.stderr)
                 file_err = 'Has pdf MIME type or extension, but pdfinfo ' \
                            'returned an error!'
                 logger.debug(file_err)
                 return file_err
             else:
                 logger.debug('pdfinfo returned successfully')
-                logger.debug(f'Output of pdfinfo:\n{pdfinfo_output.stdout}')
-                if re.search('^Page size:\s*0 x 0 pts$', pdfinfo_output.stdout):
+                logger.debug('Output of pdfinfo:\n%s', pdfinfo_output.stdout)
+                logger.debug('pdf probe: %s', pdfinfo_output)
+                if pdfinfo_output.page_size == (0, 0):
                     logger.debug('pdf is corrupt anyway, page size property is '
                                  'empty!')
                     file_err = 'pdf can be parsed, but page size is 0 x 0 pts!'
@@ -279,7 +1854,7 @@ def check_file_for_corruption(
                     return file_err
 
     if re.match(tested_archive_extensions, ext):
-        logger.debug(f"The file has a '{ext}' extension, testing with 7z...")
+        logger.debug("The file has a '%s' extension, testing with 7z...", ext)
         log = test_archive(file_path)
         if log.stderr:
             logger.debug('Test failed!')
@@ -293,8 +1868,8 @@ def check_file_for_corruption(
     if file_err == '':
         logger.debug('Corruption not detected!')
     else:
-        logger.debug(f'We are at the end of the function and '
-                     f'file_err="{file_err}"; it should be empty!')
+        logger.debug('We are at the end of the function and '
+                     'file_err="%s"; it should be empty!', file_err)
     return file_err
 
 
@@ -350,7 +1925,7 @@ def convert_result_from_shell_cmd(old_result):
     new_result = Result()
 
     for attr_name, new_val in new_result.__dict__.items():
-        old_val = getattr(old_result, attr_name)
+        old_val = getattr(old_result, attr_name, None)
         if old_val is None:
             shell_args = getattr(old_result, 'args', None)
             # logger.debug(f'result.{attr_name} is None. Shell args: {shell_args}')
@@ -368,6 +1943,7 @@ def convert_result_from_shell_cmd(old_result):
                         # logger.debug(e.__repr__())
                         # logger.debug('Value already a string. No decoding necessary')
                         new_val = old_val
+                import ast
                 try:
                     new_val = ast.literal_eval(new_val)
                 except (SyntaxError, ValueError) as e:
@@ -383,23 +1959,41 @@ def convert_result_from_shell_cmd(old_result):
     return new_result
 
 
+# Same as convert_result_from_shell_cmd() but `stdout` is treated as the text
+# output of a conversion tool: it is decoded (undecodable bytes are ignored)
+# and never evaluated as a Python literal
+def convert_text_result_from_shell_cmd(old_result):
+    stdout = old_result.stdout
+    old_result.stdout = None
+    new_result = convert_result_from_shell_cmd(old_result)
+    if isinstance(stdout, bytes):
+        stdout = stdout.decode('UTF-8', errors='ignore')
+    new_result.stdout = stdout if stdout else ''
+    return new_result
+
+
 # Tries to convert the supplied ebook file into .txt. It uses calibre's
 # ebook-convert tool. For optimization, if present, it will use pdftotext
 # for pdfs, catdoc for word files and djvutxt for djvu files.
+# If `output_file` is None, nothing is written to disk by the conversion tools
+# that can write to stdout: the text is returned in `result.stdout`.
 # Ref.: https://bit.ly/2HXdf2I
 def convert_to_txt(input_file, output_file, mime_type,
                    djvu_convert_method=DJVU_CONVERT_METHOD,
                    epub_convert_method=EPUB_CONVERT_METHOD,
                    msword_convert_method=MSWORD_CONVERT_METHOD,
-                   pdf_convert_method=PDF_CONVERT_METHOD, **kwargs):
+                   pdf_convert_method=PDF_CONVERT_METHOD, failure_memo=None,
+                   **kwargs):
+    # NOTE: with 'djvused', the page windows are searched first in
+    # search_file_for_isbns() and djvutxt is used for the whole document
     if mime_type.startswith('image/vnd.djvu') \
-         and djvu_convert_method == 'djvutxt' and command_exists('djvutxt'):
+         and djvu_convert_method in ['djvused', 'djvutxt'] and command_exists('djvutxt'):
         logger.debug('The file looks like a djvu, using djvutxt to extract the text')
-        result = djvutxt(input_file, output_file)
+        tool, convert = 'djvutxt', djvutxt
     elif mime_type.startswith('application/epub+zip') \
             and epub_convert_method == 'epubtxt' and command_exists('unzip'):
         logger.debug('The file looks like an epub, using epubtxt to extract the text')
-        result = epubtxt(input_file, output_file)
+        tool, convert = 'epubtxt', epubtxt
     elif mime_type == 'application/msword' \
             and msword_convert_method in ['catdoc', 'textutil'] \
             and (command_exists('catdoc') or command_exists('textutil')):
@@ -409,14 +2003,14 @@ def convert_to_txt(input_file, output_file, mime_type,
         # 'catdoc' will be used
         if command_exists('catdoc'):
             logger.debug(msg.format('catdoc'))
-            result = catdoc(input_file, output_file)
+            tool, convert = 'catdoc', catdoc
         else:
             logger.debug(msg.format('textutil'))
-            result = textutil(input_file, output_file)
+            tool, convert = 'textutil', textutil
     elif mime_type == 'application/pdf' and pdf_convert_method == 'pdftotext' \
             and command_exists('pdftotext'):
         logger.debug('The file looks like a pdf, using pdftotext to extract the text')
-        result = pdftotext(input_file, output_file)
+        tool, convert = 'pdftotext', pdftotext
     elif (not mime_type.startswith('image/vnd.djvu')) \
             and mime_type.startswith('image/'):
         msg = f'The file looks like a normal image ({mime_type}), skipping ' \
@@ -424,42 +2018,140 @@ def convert_to_txt(input_file, output_file, mime_type,
         # logger.debug(msg)
         return convert_result_from_shell_cmd(Result(stderr=msg, returncode=1))
     else:
-        logger.debug(f"Trying to use calibre's ebook-convert to convert the {mime_type} file to .txt")
-        result = ebook_convert(input_file, output_file)
+        logger.debug("Trying to use calibre's ebook-convert to convert the %s file to .txt", mime_type)
+        tool, convert = 'ebook-convert', ebook_convert
+    error = failure_memo.is_blocked(tool, mime_type) if failure_memo else None
+    if error:
+        return convert_result_from_shell_cmd(
+            Result(stderr=f"{tool} is skipped since it keeps failing for "
+                          f"'{mime_type or 'unknown'}' files: {error}", returncode=1))
+    try:
+        result = convert(input_file, output_file)
+    except FileNotFoundError as e:
+        # The program is not installed
+        result = convert_result_from_shell_cmd(Result(stderr=str(e), returncode=127))
+    if failure_memo:
+        failure_memo.record(tool, mime_type, result.returncode, result.stderr)
     return result
 
 
-def djvutxt(input_file, output_file, pages=None):
+# Removes the ISBNs that are equivalent to a previous one (e.g. the ISBN-10 and
+# the ISBN-13 of the same book), see isbn10_to_isbn13(). The order is kept.
+def dedupe_isbns(isbns):
+    unique_isbns = {}
+    for isbn in isbns:
+        key = isbn10_to_isbn13(isbn)
+        if key in unique_isbns:
+            logger.debug('ISBN %s is the same as %s', isbn, unique_isbns[key])
+        else:
+            unique_isbns[key] = isbn
+    return list(unique_isbns.values())
+
+
+# Extracts the text layer of the given pages of a djvu document with only one
+# djvused call (`select N; size; print-pure-txt` for each page). The `size`
+# line of each page is used to split the output. Returns a Result whose
+# `stdout` maps each page to its text ('' if the page has no text layer).
+def djvused_txt(input_file, pages):
+    script = ' '.join(f'select {page}; size; print-pure-txt;' for page in pages)
+    args = ['djvused', str(input_file), '-e', script]
+    result = run_command(args)
+    result = convert_text_result_from_shell_cmd(result)
+    if result.returncode == 0:
+        texts = re.split(r'^width=\d+ height=\d+.*\n', result.stdout,
+                         flags=re.MULTILINE)[1:]
+        if len(texts) != len(pages):
+            result.stderr = f'Expected the text of {len(pages)} pages but ' \
+                            f'got {len(texts)}'
+            result.returncode = 1
+        else:
+            result.stdout = dict(zip(pages, texts))
+    return result
+
+
+# If `output_file` is None, djvutxt writes the text to stdout
+def djvutxt(input_file, output_file=None, pages=None):
     pages = f'--page={pages}' if pages else ''
-    cmd = f'djvutxt "{input_file}" "{output_file}" {pages}'
+    output_file = f'"{output_file}"' if output_file else ''
+    cmd = f'djvutxt "{input_file}" {output_file} {pages}'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return convert_result_from_shell_cmd(result)
+    result = run_command(args)
+    return convert_text_result_from_shell_cmd(result)
 
 
-def ebook_convert(input_file, output_file):
+# NOTE: ebook-convert can't write to stdout, thus if `output_file` is None the
+# text goes through a temporary file which is read once and then removed
+def ebook_convert(input_file, output_file=None):
+    tmp_file_txt = None
+    if not output_file:
+        tmp_file_txt = scratch.mkstemp(suffix='.txt')
+        output_file = tmp_file_txt
     cmd = f'ebook-convert "{input_file}" "{output_file}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return convert_result_from_shell_cmd(result)
+    result = run_command(args)
+    result = convert_result_from_shell_cmd(result)
+    if tmp_file_txt:
+        # `stdout` only contains the log of ebook-convert, replace it with the text
+        with open(tmp_file_txt, 'r', encoding="utf8", errors='ignore') as f:
+            result.stdout = f.read()
+        scratch.release(tmp_file_txt)
+    return result
 
 
-def epubtxt(input_file, output_file):
+# If `output_file` is None, the text is only returned in `result.stdout`.
+# Otherwise, it is streamed into `output_file` (and not returned).
+def epubtxt(input_file, output_file=None):
     cmd = f'unzip -c "{input_file}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if not result.stderr:
-        text = str(result.stdout)
+    if output_file:
+        with open(output_file, 'wb') as f:
+            result = run_command(args, stdout=f)
+    else:
+        result = run_command(args)
+    return convert_text_result_from_shell_cmd(result)
+
+
+# Saves the per-file results (FileResult) of the organization in a JSON-lines,
+# CSV or SQLite file. If `output_format` is None, the format is guessed from the
+# extension of the output file ('jsonl', 'csv', 'sqlite' or 'db').
+def export_results(results, output_file, output_format=None):
+    if output_format is None:
+        output_format = Path(output_file).suffix[1:].lower()
+    fields = FileResult.__slots__
+    if output_format in ['json', 'jsonl']:
         with open(output_file, 'w') as f:
-            f.write(text)
-        result.stdout = text
-    return convert_result_from_shell_cmd(result)
+            for result in results:
+                f.write(json.dumps(result.to_dict(), ensure_ascii=False) + '\n')
+    elif output_format == 'csv':
+        with open(output_file, 'w', newline='') as f:
+            import csv
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for result in results:
+                row = result.to_dict()
+                row['isbns'] = ' '.join(row['isbns'])
+                row['timings'] = json.dumps(row['timings'])
+                writer.writerow([row[k] for k in fields])
+    elif output_format in ['sqlite', 'db']:
+        import sqlite3
+        conn = sqlite3.connect(output_file)
+        with conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS results ({', '.join(fields)})")
+            conn.executemany(
+                f"INSERT INTO results VALUES ({', '.join('?' * len(fields))})",
+                ((r.path, r.status, r.reason, ' '.join(r.isbns), r.metadata_source,
+                  r.new_path, json.dumps(r.timings)) for r in results))
+        conn.close()
+    else:
+        raise ValueError(f"Unsupported format for the results file: '{output_format}' "
+                         "(choose from 'jsonl', 'json', 'csv', 'sqlite', 'db')")
+    logger.debug('Results saved in %s', output_file)
 
 
 def extract_archive(input_file, output_file):
     cmd = f'7z x -o"{output_file}" "{input_file}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(args)
     return convert_result_from_shell_cmd(result)
 
 
@@ -486,15 +2178,15 @@ def fail_file(old_path, reason, new_path=None):
 # Returns the ebook metadata as a string; if no metadata found, an empty string
 # is returned
 # Ref.: https://bit.ly/2HS0iXQ
-def fetch_metadata(isbn_sources, options=''):
-    args = f'fetch-ebook-metadata {options}'
+def fetch_metadata(isbn_sources, options='', cmd=FETCH_METADATA_COMMAND):
+    args = f'{cmd} {options}'
     if isinstance(isbn_sources, str):
         isbn_sources = isbn_sources.split(',')
     for isbn_source in isbn_sources:
         args += f' --allowed-plugin={isbn_source} '
     # Remove trailing whitespace
     args = args.strip()
-    logger.debug(f'Calling `{args}`')
+    logger.debug('Calling `%s`', args)
     args = shlex.split(args)
     # NOTE: `stderr` contains the whole log from running the fetch-data query
     # from the specified online sources. Thus, `stderr` is a superset of
@@ -502,13 +2194,45 @@ def fetch_metadata(isbn_sources, options=''):
     # have the pattern '[a-zA-Z()]+ +: .*'
     # TODO: make sure that you are getting only the fields that match the pattern
     # '[a-zA-Z()]+ +: .*' since you are not using a regex on the result
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(args)
     return convert_result_from_shell_cmd(result)
 
 
+# Validates many ISBN candidates at once (e.g. all the candidates found in a
+# document, only made of [0-9xX]) and returns the set of the valid ones. Each
+# distinct candidate is only validated once.
+# The checksums are computed on the ASCII codes of the digits (the digit d has
+# the code 48 + d) with the built-in sum() instead of converting each digit:
+# - ISBN-10: the sum of the running sums of the codes is the sum of the codes
+#   weighted by 10, 9, ..., 1 and 48 * (10 + 9 + ... + 1) = 48 * 55 is a
+#   multiple of 11. The final 'X' (10) is replaced with ':' (48 + 10).
+# - ISBN-13: the codes are weighted by 1, 3, 1, ... and 48 * (7 + 3 * 6) is a
+#   multiple of 10.
+def filter_valid_isbns(candidates):
+    valid_isbns = set()
+    for isbn in set(candidates):
+        if len(isbn) == 13:
+            if isbn.isdigit() and isbn[:3] in ('978', '979'):
+                data = isbn.encode('ascii')
+                if (sum(data[0::2]) + 3 * sum(data[1::2])) % 10 == 0:
+                    valid_isbns.add(isbn)
+        elif len(isbn) == 10:
+            if isbn[9] in 'xX':
+                if not isbn[:9].isdigit():
+                    continue
+                data = isbn[:9].encode('ascii') + b':'
+            elif isbn.isdigit():
+                data = isbn.encode('ascii')
+            else:
+                continue
+            if sum(accumulate(data)) % 11 == 0:
+                valid_isbns.add(isbn)
+    return valid_isbns
+
+
 # Searches the input string for ISBN-like sequences and removes duplicates and
-# finally validates them using is_isbn_valid() and returns them separated by
-# `isbn_ret_separator`
+# finally validates them in batch using filter_valid_isbns() and returns them
+# separated by `isbn_ret_separator`
 # Ref.: https://bit.ly/2HyLoSQ
 def find_isbns(input_str, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
                isbn_regex=ISBN_REGEX, isbn_ret_separator=ISBN_RET_SEPARATOR,
@@ -518,57 +2242,109 @@ def find_isbns(input_str, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
     duplicate_isbns = []
     check_more = True
     input_str_copy = copy(input_str)
+    # NOTE: re.compile() returns the pattern as is if it is already compiled
+    isbn_regex = re.compile(isbn_regex)
+    isbn_blacklist_regex = re.compile(isbn_blacklist_regex)
+    # Remove everything except numbers [0-9], 'x', and 'X'
+    del_tab = string.printable[10:].replace('x', '').replace('X', '')
+    tran_tab = str.maketrans('', '', del_tab)
+    # NOTE: the candidates of both passes are validated only once
+    valid_isbns = set()
+    checked = set()
     while True:
         # TODO: they are using grep -oP
         # Ref.: https://bit.ly/2HUbnIs
         # Remove spaces
         # input_str = input_str.replace(' ', '')
-        matches = re.finditer(isbn_regex, input_str_copy)
-        for i, match in enumerate(matches):
-            match = match.group()
-            # Remove everything except numbers [0-9], 'x', and 'X'
-            # NOTE: equivalent to UNIX command `tr -c -d '0-9xX'`
-            # TODO 1: they don't remove \n in their code
-            # TODO 2: put the following in a function
-            del_tab = string.printable[10:].replace('x', '').replace('X', '')
-            tran_tab = str.maketrans('', '', del_tab)
-            match = match.translate(tran_tab)
+        # NOTE: equivalent to UNIX command `tr -c -d '0-9xX'`
+        # TODO 1: they don't remove \n in their code
+        matches = [match.group().translate(tran_tab)
+                   for match in isbn_regex.finditer(input_str_copy)]
+        new_matches = set(matches) - checked
+        valid_isbns |= filter_valid_isbns(new_matches)
+        checked |= new_matches
+        for match in matches:
             # Only keep unique ISBNs
             if match not in isbns:
                 # Validate ISBN
-                if is_isbn_valid(match):
-                    if re.match(isbn_blacklist_regex, match):
-                        logger.debug(f'Wrong ISBN (blacklisted): {match}')
+                if match in valid_isbns:
+                    if isbn_blacklist_regex.match(match):
+                        logger.debug('Wrong ISBN (blacklisted): %s', match)
                     else:
-                        logger.debug(f'Valid ISBN found: {match}')
+                        logger.debug('Valid ISBN found: %s', match)
                         isbns.append(match)
                 else:
                     if match not in invalid_isbns:
-                        logger.debug(f'Invalid ISBN found: {match}')
+                        logger.debug('Invalid ISBN found: %s', match)
                         invalid_isbns.append(match)
             else:
                 if match not in duplicate_isbns:
-                    logger.debug(f'Non-unique ISBN found: {match}')
+                    logger.debug('Non-unique ISBN found: %s', match)
                     duplicate_isbns.append(match)
         if isbns or not check_more:
             break
         # NOTE: remove it since we are using a longer regex that covers many cases of dashes
         input_str_copy = input_str_copy.replace('–', '').replace('—', '').replace('-', '').replace('·', ''). \
             replace('.', '').replace(' ', '')
-        input_str_no_newlines = input_str_copy.replace('\n', '')[:100]
-        logger.debug('Trying to find ISBNs with modified input string (showing only first 100 characters): '
-                     f'{input_str_no_newlines}')
+        # NOTE: only the first characters are shown, no need to process the
+        # whole (possibly huge) input string if they are not logged
+        if logger.isEnabledFor(logging.DEBUG):
+            input_str_no_newlines = input_str_copy[:1000].replace('\n', '')[:100]
+            logger.debug('Trying to find ISBNs with modified input string (showing only first 100 characters): '
+                         '%s', input_str_no_newlines)
         check_more = False
-    if not isbns:
-        input_str_no_newlines = input_str.replace('\n', '')[:100]
+    if not isbns and logger.isEnabledFor(logging.DEBUG):
+        input_str_no_newlines = input_str[:1000].replace('\n', '')[:100]
         # msg (next line) not used anymore
         # msg = f'"{input_str_no_newlines}"' if len(input_str_no_newlines) < 100 else ''
-        logger.debug(f'No ISBN found in the input string (showing only first 100 characters): {input_str_no_newlines}')
+        logger.debug('No ISBN found in the input string (showing only first 100 characters): %s', input_str_no_newlines)
     # NOTE: if isbns = [], it returns ''
     # ' - '.join([]) => ''
     return isbn_ret_separator.join(isbns)
 
 
+# Same as find_isbns(reorder_file_content(file_path)) but for big text files:
+# only the first and last lines (see `isbn_reorder_files`) and one chunk of
+# `chunk_lines` lines of the middle part are in memory at a time. The first and
+# last lines are searched first, then the middle part chunk by chunk until
+# ISBNs are found (thus the ISBNs further in the file are not returned).
+# Returns the ISBNs and whether the file contains any text.
+def find_isbns_in_file(file_path, isbn_reorder_files=ISBN_REORDER_FILES,
+                       chunk_lines=10000, **kwargs):
+
+    def search(lines):
+        return find_isbns(repr(''.join(lines)).replace('\\uf73', ''), **kwargs)
+
+    scan_first, reverse_last = isbn_reorder_files if isbn_reorder_files else (0, 0)
+    text_regex = re.compile('[A-Za-z0-9]+')
+    with open(file_path, 'r', encoding="utf8", errors='ignore') as f:
+        first_part = list(islice(f, scan_first))
+        last_part = deque(maxlen=reverse_last)
+        num_middle_lines = -reverse_last
+        has_text = any(text_regex.search(line) for line in first_part)
+        for line in f:
+            if not has_text and text_regex.search(line):
+                has_text = True
+            last_part.append(line)
+            num_middle_lines += 1
+    if not has_text:
+        return '', False
+    if isbn_reorder_files:
+        logger.debug('Searching the first %s lines and the last %s lines in reverse '
+                     'of the file', scan_first, reverse_last)
+        isbns = search(first_part + list(reversed(last_part)))
+        if isbns:
+            return isbns, True
+    del first_part, last_part
+    with open(file_path, 'r', encoding="utf8", errors='ignore') as f:
+        middle_part = islice(f, scan_first, scan_first + max(num_middle_lines, 0))
+        for chunk in iter(lambda: list(islice(middle_part, chunk_lines)), []):
+            isbns = search(chunk)
+            if isbns:
+                return isbns, True
+    return '', True
+
+
 def get_all_isbns_from_archive(
         file_path, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
         isbn_direct_files=ISBN_DIRECT_FILES,
@@ -576,23 +2352,25 @@ def get_all_isbns_from_archive(
         isbn_ignored_files=ISBN_IGNORED_FILES, isbn_regex=ISBN_REGEX,
         isbn_ret_separator=ISBN_RET_SEPARATOR, ocr_command=OCR_COMMAND,
         ocr_enabled=OCR_ENABLED,
-        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, **kwargs):
+        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES,
+        ocr_profile=OCR_PROFILE, failure_memo=None,
+        heavy_file_size_mib=HEAVY_FILE_SIZE_MIB, **kwargs):
     func_params = locals().copy()
     func_params.pop('file_path')
     all_isbns = []
-    tmpdir = tempfile.mkdtemp()
-    logger.debug(f"Trying to decompress '{os.path.basename(file_path)}' and "
-                 "recursively scan the contents")
-    logger.debug(f"Decompressing '{file_path}' into tmp folder '{tmpdir}'")
+    tmpdir = scratch.mkdtemp(size_hint=os.path.getsize(file_path))
+    logger.debug("Trying to decompress '%s' and "
+                 "recursively scan the contents", os.path.basename(file_path))
+    logger.debug("Decompressing '%s' into tmp folder '%s'", file_path, tmpdir)
     result = extract_archive(file_path, tmpdir)
     if result.stderr:
         logger.debug('Error extracting the file (probably not an archive)! '
                      'Removing tmp dir...')
         logger.debug(result.stderr)
-        remove_tree(tmpdir)
+        scratch.release(tmpdir)
         return ''
-    logger.debug(f"Archive extracted successfully in '{tmpdir}', scanning "
-                 f"contents recursively...")
+    logger.debug("Archive extracted successfully in '%s', scanning "
+                 "contents recursively...", tmpdir)
     # TODO: Ref.: https://stackoverflow.com/a/2759553
     # TODO: ignore .DS_Store
     for path, dirs, files in os.walk(tmpdir, topdown=False):
@@ -603,22 +2381,21 @@ def get_all_isbns_from_archive(
             file_to_check = os.path.join(path, file_to_check)
             isbns = search_file_for_isbns(file_to_check, **func_params)
             if isbns:
-                logger.debug(f"Found ISBNs\n{isbns}")
+                logger.debug("Found ISBNs\n%s", isbns)
                 # TODO: two prints, one for stderror and the other for stdout
                 logger.debug(isbns.replace(isbn_ret_separator, '\n'))
                 for isbn in isbns.split(isbn_ret_separator):
                     if isbn not in all_isbns:
                         all_isbns.append(isbn)
-            logger.debug(f'Removing {file_to_check}...')
+            logger.debug('Removing %s...', file_to_check)
             remove_file(file_to_check)
         if len(os.listdir(path)) == 0 and path != tmpdir:
             os.rmdir(path)
         elif path == tmpdir:
             if len(os.listdir(tmpdir)) == 1 and '.DS_Store' in tmpdir:
                 remove_file(os.path.join(tmpdir, '.DS_Store'))
-    logger.debug(f"Removing temporary folder '{tmpdir}' (should be empty)...")
-    if is_dir_empty(tmpdir):
-        remove_tree(tmpdir)
+    logger.debug("Removing temporary folder '%s' (should be empty)...", tmpdir)
+    scratch.release(tmpdir)
     return isbn_ret_separator.join(all_isbns)
 
 
@@ -626,7 +2403,7 @@ def get_ebook_metadata(file_path):
     # TODO: add `ebook-meta` in PATH
     cmd = f'ebook-meta "{file_path}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(args)
     return convert_result_from_shell_cmd(result)
 
 
@@ -658,6 +2435,7 @@ def get_mime_type(file_path):
         # NOTE: on Ubuntu (docker, python 3.6.9) file_path is PosixPath and they expect str
         # On python 3.7, they don't care that file_path is PosixPath
         file_path = str(file_path)
+        import mimetypes
         mime_type = mimetypes.guess_type(file_path)[0]
     except TypeError as e:
         logger.error(red(f"Couldn't get the mime type: {file_path}"))
@@ -666,35 +2444,60 @@ def get_mime_type(file_path):
     return mime_type if mime_type else ''
 
 
+# Returns the `pages_to_process` first and last pages (`first_last_pages` is
+# the tuple (n, m)) of a document with `num_pages` pages, without duplicates.
+# If `first_last_pages` is False, all the pages are returned.
+def get_first_last_pages(num_pages, first_last_pages):
+    if not first_last_pages:
+        return list(range(1, num_pages + 1))
+    first_pages = int(first_last_pages[0])
+    last_pages = int(first_last_pages[1])
+    pages = list(range(1, min(first_pages, num_pages) + 1))
+    pages.extend(range(max(num_pages + 1 - last_pages, 1), num_pages + 1))
+    return list(dict.fromkeys(pages))
+
+
 # Return number of pages in a djvu document
+# NOTE: the number of pages is cached per file (path, size and modification
+# time) since it is needed by both the extraction of the text with djvused and
+# OCR
 def get_pages_in_djvu(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        return Result(stderr=str(e), returncode=1)
+    return Result(*get_pages_in_djvu_cached(str(file_path), stat.st_size, stat.st_mtime_ns))
+
+
+@functools.lru_cache(maxsize=256)
+def get_pages_in_djvu_cached(file_path, file_size, file_mtime):
     cmd = f'djvused -e "n" "{file_path}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return convert_result_from_shell_cmd(result)
+    result = run_command(args)
+    result = convert_result_from_shell_cmd(result)
+    # NOTE: `stdout` is already evaluated as an int if djvused succeeded
+    if result.returncode == 0 and not isinstance(result.stdout, int):
+        result.returncode = 1
+    return result.stdout, result.stderr, result.returncode
 
 
 # Return number of pages in a pdf document
-def get_pages_in_pdf(file_path, cmd='mdls'):
+# NOTE: with pdfinfo, the number of pages comes from the cached pdf probe (see
+# probe_pdf()). mdls is only used if pdfinfo is not found.
+def get_pages_in_pdf(file_path, cmd='pdfinfo'):
     assert cmd in ['mdls', 'pdfinfo']
+    if cmd == 'pdfinfo' and not command_exists('pdfinfo'):
+        cmd = 'mdls'
     if command_exists(cmd) and cmd == 'mdls':
         cmd = f'mdls -raw -name kMDItemNumberOfPages "{file_path}"'
         args = shlex.split(cmd)
-        result = subprocess.run(args, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        if '(null)' in str(result.stdout):
-            return get_pages_in_pdf(file_path, cmd='pdfinfo')
+        result = run_command(args)
     else:
-        cmd = f'pdfinfo "{file_path}"'
-        args = shlex.split(cmd)
-        result = subprocess.run(args, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
-        if result.returncode == 0:
-            result = convert_result_from_shell_cmd(result)
-            result.stdout = int(re.findall('^Pages:\s+([0-9]+)',
-                                           result.stdout,
-                                           flags=re.MULTILINE)[0])
-            return result
+        probe = probe_pdf(file_path)
+        if probe.pages is not None:
+            return Result(stdout=probe.pages, stderr=probe.stderr, returncode=0)
+        return Result(stdout=probe.stdout, stderr=probe.stderr,
+                      returncode=probe.returncode or 1)
     return convert_result_from_shell_cmd(result)
 
 
@@ -706,6 +2509,72 @@ def get_parts_from_path(path):
     return f'{anchor}'.join(path.parts[-2:])
 
 
+# Returns the kind of storage of the given path: 'network' (e.g. NFS, SMB),
+# 'rotational' (hard disk), 'ssd' or None if unknown (e.g. not on Linux)
+def get_storage_kind(path):
+    path = os.path.realpath(path)
+    mount_point, fs_type = '', None
+    try:
+        with open('/proc/mounts') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                # NOTE: the spaces in the mount points are escaped as \040
+                mp = fields[1].replace('\\040', ' ')
+                if (path == mp or path.startswith(mp.rstrip('/') + '/')) \
+                        and len(mp) >= len(mount_point):
+                    mount_point, fs_type = mp, fields[2]
+    except OSError:
+        return None
+    if fs_type and re.match('(nfs|cifs|smb|afp|fuse.sshfs|9p)', fs_type):
+        return 'network'
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    sys_path = f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}'
+    # NOTE: a partition has no queue, its disk has
+    for queue in [f'{sys_path}/queue/rotational', f'{sys_path}/../queue/rotational']:
+        try:
+            with open(queue) as f:
+                return 'rotational' if f.read().strip() == '1' else 'ssd'
+        except OSError:
+            continue
+    return None
+
+
+# Guesses the title and the author of a book from a filename (without
+# extension), e.g. 'Ursula Le Guin - The Dispossessed (2003)' or 'The
+# Dispossessed by Ursula Le Guin'. The text in brackets is dropped. Without an
+# author (e.g. 'the-pragmatic-programmer'), the whole filename is the title.
+# Returns the tokenized title and author (None if not found), see tokenize().
+def guess_title_and_author(filename, tokens_to_ignore=TOKENS_TO_IGNORE):
+    text = re.sub(r'[(\[{][^)\]}]*[)\]}]', ' ', filename).replace('_', ' ')
+    title, author = text, None
+    match = re.match(r'(.+?)\s+by\s+(.+)$', text, re.IGNORECASE)
+    if match:
+        title, author = match.groups()
+    else:
+        # e.g. 'Authors - Title' or 'Authors - [Series] - Title' (see
+        # OUTPUT_FILENAME_TEMPLATE). Without spaces in the filename, a single
+        # dash is a separator only between words joined by underscores (e.g.
+        # 'Author_Name-Some_Title' but not 'Python-Crash-Course').
+        if ' ' in filename or re.fullmatch(r'[^-]*_[^-]*-[^-]*_[^-]*', filename) is None:
+            separator = r'\s+-+\s+|--+'
+        else:
+            separator = '-'
+        parts = [part for part in re.split(separator, text) if part.strip()]
+        if len(parts) > 1 and 1 <= len(parts[0].split()) <= 4:
+            author, title = parts[0], parts[-1]
+    title = ' '.join(tokenize(title, tokens_to_ignore))
+    author = ' '.join(tokenize(author, tokens_to_ignore)) if author else ''
+    if not title and author:
+        # e.g. 'Title - 2nd edition'
+        return author, None
+    return title, author if author else None
+
+
 # Checks if directory is empty
 # Ref.: https://stackoverflow.com/a/47363995
 def is_dir_empty(path):
@@ -724,7 +2593,7 @@ def is_file_empty(file_path):
         return False
 
 
-# Validates ISBN-10 and ISBN-13 numbers
+# Validates ISBN-10 and ISBN-13 numbers, see filter_valid_isbns()
 # Ref.: https://bit.ly/2HO2lMD
 def is_isbn_valid(isbn):
     # TODO: there is also a Python package for validating ISBNs (but dependency)
@@ -733,28 +2602,34 @@ def is_isbn_valid(isbn):
     isbn = ''.join(isbn.split())
     isbn = isbn.replace('-', '')
     isbn = isbn.upper()
-
-    sum = 0
-    # Case 1: ISBN-10
+    return bool(filter_valid_isbns([isbn]))
+
+
+# Returns the ISBN-13 of an ISBN-10 (other ISBNs are returned as is, without
+# dashes), e.g. '0-306-40615-2' -> '9780306406157'
+def isbn10_to_isbn13(isbn):
+    isbn = isbn.replace('-', '').upper()
+    if len(isbn) != 10:
+        return isbn
+    isbn = '978' + isbn[:9]
+    # NOTE: with a '0' as check digit, the checksum gives the missing amount
+    data = f'{isbn}0'.encode('ascii')
+    check = -(sum(data[0::2]) + 3 * sum(data[1::2])) % 10
+    return f'{isbn}{check}'
+
+
+# Returns the ISBN-10 of an ISBN-13 starting with 978 or None (e.g. the ISBN-13
+# starting with 979 have no ISBN-10), e.g. '9780306406157' -> '0306406152'
+def isbn13_to_isbn10(isbn):
+    isbn = isbn.replace('-', '').upper()
     if len(isbn) == 10:
-        for i in range(len(isbn)):
-            if i == 9 and isbn[i] == 'X':
-                number = 10
-            else:
-                number = int(isbn[i])
-            sum += (number * (10 - i))
-        if sum % 11 == 0:
-            return True
-    # Case 2: ISBN-13
-    elif len(isbn) == 13:
-        if isbn[0:3] in ['978', '979']:
-            for i in range(0, len(isbn), 2):
-                sum += int(isbn[i])
-            for i in range(1, len(isbn), 2):
-                sum += (int(isbn[i])*3)
-            if sum % 10 == 0:
-                return True
-    return False
+        return isbn
+    if len(isbn) != 13 or not isbn.startswith('978'):
+        return None
+    isbn = isbn[3:12]
+    # NOTE: with a '0' as check digit, the checksum gives the missing amount
+    check = -sum(accumulate(f'{isbn}0'.encode('ascii'))) % 11
+    return f"{isbn}{'X' if check == 10 else check}"
 
 
 def move(src, dst, clobber=True):
@@ -762,118 +2637,75 @@ def move(src, dst, clobber=True):
     # Since path can be relative to the cwd
     # src = os.path.abspath(src)
     # filename = os.path.basename(src)
-    src = Path(src)
-    dst = Path(dst)
-    if dst.exists():
-        logger.debug(f'{dst.name}: file already exists')
-        logger.debug(f"Destination folder path: {dst.parent}")
-        if clobber:
-            logger.debug(f'{dst.name}: overwriting the file')
-            shutil.move(src, dst)
-            logger.debug("File moved!")
-        else:
-            logger.debug(f'{dst.name}: cannot overwrite existing file')
-            logger.debug(f"Skipping it!")
-    else:
-        logger.debug(f"Moving '{src.name}'...")
-        logger.debug(f"Destination folder path: {dst.parent}")
-        shutil.move(src, dst)
-        logger.debug("File moved!")
+    move_executor.move(src, dst, clobber)
 
 
 # Ref.: https://bit.ly/2HxYEaw
+# Moves (or links) the ebook file to `new_folder` with a new filename built from
+# its metadata (BookMetadata) and, if `keep_metadata` is enabled, saves the
+# metadata next to it
 def move_or_link_ebook_file_and_metadata(
-        new_folder, current_ebook_path, current_metadata_path, dry_run=DRY_RUN,
+        new_folder, current_ebook_path, metadata, dry_run=DRY_RUN,
         keep_metadata=KEEP_METADATA,
         output_filename_template=OUTPUT_FILENAME_TEMPLATE,
         output_metadata_extension=OUTPUT_METADATA_EXTENSION,
-        symlink_only=SYMLINK_ONLY, **kwargs):
+        symlink_only=SYMLINK_ONLY, hardlink_only=HARDLINK_ONLY, **kwargs):
     # Get ebook's file extension
     ext = Path(current_ebook_path).suffix
     ext = ext[1:] if ext[0] == '.' else ext
     d = {'EXT': ext}
+    d.update(metadata.get_template_vars())
 
-    # Extract fields from metadata file
-    with open(current_metadata_path, 'r') as f:
-        for line in f:
-            # Get field name and value separately, e.g.
-            # 'Title  : A nice ebook' ---> field_name = 'Title  ' and field_value = ' A nice ebook'
-            # Find the first colon and split on its position
-            pos = line.find(':')
-            field_name, field_value = line[:pos], line[pos+1:]
-
-            # TODO: try to use subprocess.run instead of subprocess.Popen and
-            # creating two processes
-            # OR try to do it without subprocess, only with Python regex
-
-            # Process field name
-            # TODO: converting characters to upper case with `-e 's/\(.*\)/\\U\1/'`
-            # doesn't work on mac, \\U is not supported
-            result = substitute_with_sed(regex='[ \t]*$', replacement='',
-                                         text=field_name, use_global=False)
-            result = substitute_with_sed(regex=' ', replacement='_', text=result)
-            field_name = substitute_with_sed(regex='[^a-zA-Z0-9_]', replacement='', text=result).upper()
-
-            # Process field value
-            # Get only the first 100 characters
-            d[field_name] = substitute_with_sed(
-                regex='[\\/\*\?<>\|\x01-\x1F\x7F\x22\x24\x60]', replacement='_',
-                text=field_value)[:100]
-
-    logger.debug('Variables that will be used for the new filename construction:')
-    for k, v in d.items():
-        # TODO: important, encode('utf-8')? like in rename?
-        logger.debug(f'{k}: {v}')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Variables that will be used for the new filename construction:')
+        for k, v in d.items():
+            # TODO: important, encode('utf-8')? like in rename?
+            logger.debug('%s: %s', k, v)
 
     new_name = substitute_params(d, output_filename_template)
-    logger.debug(f"The new file name of the book file/link '{current_ebook_path}' "
-                 f'will be: {new_name}')
+    logger.debug("The new file name of the book file/link '%s' "
+                 'will be: %s', current_ebook_path, new_name)
 
-    new_path = unique_filename(new_folder, new_name)
-    logger.debug(f'Full path: {new_path}')
-    move_or_link_file(current_ebook_path, new_path, dry_run, symlink_only)
+    with move_executor.lock:
+        new_path = unique_filename(new_folder, new_name)
+        logger.debug('Full path: %s', new_path)
+        move_or_link_file(current_ebook_path, new_path, dry_run, symlink_only, hardlink_only)
 
     if keep_metadata:
         new_metadata_path = f'{new_path}.{output_metadata_extension}'
-        logger.debug(f"Moving metadata file '{current_metadata_path}' to "
-                     f"'{new_metadata_path}'....")
-        if dry_run:
-            logger.debug('Removing current metadata file: '
-                         f'{current_metadata_path}')
-            remove_file(current_metadata_path)
+        logger.debug("Saving the metadata in '%s'....", new_metadata_path)
+        if move_executor.plan is not None:
+            move_executor.plan.add_sidecar(new_metadata_path, metadata.to_text())
+        elif dry_run:
+            logger.debug('DRY RUN! The metadata file is not saved')
+        elif Path(new_metadata_path).is_file():
+            logger.debug('File already exists: %s', new_metadata_path)
         else:
-            if Path(new_metadata_path).is_file():
-                logger.debug(f'File already exists: {new_metadata_path}')
-            else:
-                shutil.move(current_metadata_path, new_metadata_path)
-    else:
-        logger.debug(f'Removing metadata file {current_metadata_path}...')
-        remove_file(current_metadata_path)
+            save_metadata_file(new_metadata_path, metadata.to_text())
     return new_path
 
 
 def move_or_link_file(current_path, new_path, dry_run=DRY_RUN,
-                      symlink_only=SYMLINK_ONLY):
-    new_folder = Path(new_path).parent
+                      symlink_only=SYMLINK_ONLY, hardlink_only=HARDLINK_ONLY):
+    if move_executor.plan is not None:
+        logger.debug("PLAN! '%s' will be moved to '%s'", current_path, new_path)
+        move_executor.plan.reserve(new_path)
+        return
     if dry_run:
         logger.debug('DRY RUN! No file rename/move/symlink/etc. operations '
                      'will actually be executed')
+        return
 
-    # Create folder
-    if not new_folder.exists():
-        logger.debug(f'Creating folder {new_folder}')
-        if not dry_run:
-            new_folder.mkdir()
-
-    # Symlink or move file
+    # Symlink, hardlink or move file (the folder is created if necessary)
     if symlink_only:
-        logger.debug(f"Symlinking file '{current_path}' to '{new_path}'...")
-        if not dry_run:
-            Path(new_path).symlink_to(current_path)
+        logger.debug("Symlinking file '%s' to '%s'...", current_path, new_path)
+        move_executor.link(current_path, new_path, symbolic=True)
+    elif hardlink_only:
+        logger.debug("Hardlinking file '%s' to '%s'...", current_path, new_path)
+        move_executor.link(current_path, new_path)
     else:
-        logger.debug(f"Moving file '{current_path}' to '{new_path}'...")
-        if not dry_run:
-            move(current_path, new_path, clobber=False)
+        logger.debug("Moving file '%s' to '%s'...", current_path, new_path)
+        move(current_path, new_path, clobber=False)
 
 
 def namespace_to_dict(ns):
@@ -896,99 +2728,185 @@ def namespace_to_dict(ns):
 
 # OCR on a pdf, djvu document or image
 # NOTE: If pdf or djvu document, then first needs to be converted to image and then OCR
+# The text is saved in `output_file`. Returns 0 on success, 1 otherwise.
 def ocr_file(file_path, output_file, mime_type,
              ocr_command=OCR_COMMAND,
              ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, **kwargs):
+    result = ocr_to_text(file_path, mime_type, ocr_command, ocr_only_first_last_pages, **kwargs)
+    if result.returncode == 0:
+        # Everything on the stdout must be copied to the output file
+        logger.debug('Saving the text content')
+        with open(output_file, 'w') as f:
+            f.write(result.stdout)
+    return result.returncode
+
+
+# Same as ocr_file() but the OCR-ed text is returned in `result.stdout` instead
+# of being saved in a file. If `pages` is given, only these pages are OCR-ed.
+# With the 'auto' profile, the ISBNs found in the text of the fast pass are
+# returned in `result.isbns`, thus the text isn't searched again.
+def ocr_to_text(file_path, mime_type,
+                ocr_command=OCR_COMMAND,
+                ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, pages=None,
+                ocr_profile=OCR_PROFILE, **kwargs):
+    if ocr_profile == 'auto':
+        result = ocr_to_text(file_path, mime_type, ocr_command,
+                             ocr_only_first_last_pages, pages, 'fast', **kwargs)
+        if result.returncode == 0:
+            result.isbns = find_isbns(reorder_text(result.stdout, **kwargs), **kwargs)
+            if result.isbns:
+                return result
+        logger.debug("No ISBNs found with the 'fast' OCR profile, retrying with "
+                     "the 'accurate' one...")
+        return ocr_to_text(file_path, mime_type, ocr_command,
+                           ocr_only_first_last_pages, pages, 'accurate', **kwargs)
+    profile = OCR_PROFILES[ocr_profile]
+    logger.debug("OCR profile '%s': %s", ocr_profile, profile)
+    gs_options = f"-r{profile['dpi']} -sDEVICE={profile['device']}"
+    if profile['interpolate']:
+        gs_options += ' -dINTERPOLATE'
+    image_ext = 'tif' if profile['device'].startswith('tiff') else 'png'
+    ddjvu_options = '-mode=black' if ocr_profile == 'fast' else ''
+
     # Convert pdf to png image
     def convert_pdf_page(page, input_file, output_file):
-        cmd = f'gs -dSAFER -q -r300 -dFirstPage={page} -dLastPage={page} ' \
-              '-dNOPAUSE -dINTERPOLATE -sDEVICE=png16m ' \
+        cmd = f'gs -dSAFER -q {gs_options} -dFirstPage={page} -dLastPage={page} ' \
+              '-dNOPAUSE ' \
               f'-sOutputFile="{output_file}" "{input_file}" -c quit'
         args = shlex.split(cmd)
-        result = subprocess.run(args, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
+        result = run_command(args)
         return convert_result_from_shell_cmd(result)
 
     # Convert djvu to tif image
     def convert_djvu_page(page, input_file, output_file):
-        cmd = f'ddjvu -page={page} -format=tif "{input_file}" "{output_file}"'
+        cmd = f'ddjvu {ddjvu_options} -page={page} -format=tif "{input_file}" "{output_file}"'
         args = shlex.split(cmd)
-        result = subprocess.run(args, stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE)
+        result = run_command(args)
         return convert_result_from_shell_cmd(result)
 
+    # Convert the pages of a pdf to images with only one gs call. Returns
+    # the list of images (same order as `pages`) in `result.stdout`.
+    def convert_pdf_pages(pages, input_file, output_dir):
+        page_list = ','.join(map(str, pages))
+        output_file = os.path.join(output_dir, f'page-%04d.{image_ext}')
+        cmd = f'gs -dSAFER -q {gs_options} -sPageList={page_list} ' \
+              '-dNOPAUSE -dBATCH ' \
+              f'-sOutputFile="{output_file}" "{input_file}"'
+        args = shlex.split(cmd)
+        result = run_command(args)
+        result = convert_result_from_shell_cmd(result)
+        result.stdout = [output_file % i for i in range(1, len(pages) + 1)]
+        return result
+
+    # Convert the pages of a djvu to one multi-page tif image with only one
+    # ddjvu call
+    def convert_djvu_pages(pages, input_file, output_dir):
+        output_file = os.path.join(output_dir, 'pages.tif')
+        page_list = ','.join(map(str, pages))
+        cmd = f'ddjvu {ddjvu_options} -page={page_list} -format=tiff "{input_file}" "{output_file}"'
+        args = shlex.split(cmd)
+        result = run_command(args)
+        result = convert_result_from_shell_cmd(result)
+        result.stdout = [output_file]
+        return result
+
+    if ocr_command not in globals():
+        msg = red(f"Function '{ocr_command}' doesn't exit.")
+        logger.error(f'{msg}')
+        return Result(stderr=msg, returncode=1)
+    ocr_func = globals()[ocr_command]
+
     if mime_type.startswith('application/pdf'):
         result = get_pages_in_pdf(file_path)
         num_pages = result.stdout
-        logger.debug(f"Result of '{get_pages_in_pdf.__name__}()' on '{file_path}':\n{result}")
+        logger.debug("Result of '%s()' on '%s':\n%s", get_pages_in_pdf.__name__, file_path, result)
         page_convert_cmd = convert_pdf_page
     elif mime_type.startswith('image/vnd.djvu'):
         result = get_pages_in_djvu(file_path)
         num_pages = result.stdout
-        logger.debug(f"Result of '{get_pages_in_djvu.__name__}()' on '{file_path}':\n{result}")
+        logger.debug("Result of '%s()' on '%s':\n%s", get_pages_in_djvu.__name__, file_path, result)
         page_convert_cmd = convert_djvu_page
     elif mime_type.startswith('image/'):
-        logger.debug(f"Running OCR on file '{file_path}' and with mime type '{mime_type}'...")
-        if ocr_command in globals():
-            result = eval(f'{ocr_command}("{file_path}", "{output_file}")')
-            logger.debug(f"Result of '{ocr_command}':\n{result}")
-            return 0
+        logger.debug("Running OCR on file '%s' and with mime type '%s'...", file_path, mime_type)
+        if ocr_command == 'tesseract_batch':
+            result = ocr_func([file_path], psm=profile['psm'])
+            result.stdout = ''.join(result.stdout) if result.returncode == 0 else ''
         else:
-            msg = red("Function '{ocr_command}' doesn't exit.")
-            logger.error(f'{msg}')
-            return 1
+            result = ocr_func(file_path, psm=profile['psm'])
+        logger.debug("Result of '%s':\n%s", ocr_command, result)
+        return Result(stdout=result.stdout, returncode=0)
     else:
-        logger.error(f"{red('Unsupported mime type')} '{mime_type}'!")
-        return 1
+        msg = f"{red('Unsupported mime type')} '{mime_type}'!"
+        logger.error(msg)
+        return Result(stderr=msg, returncode=1)
 
-    if result.returncode == 1:
+    if result.returncode != 0:
         err_msg = result.stdout if result.stdout else result.stderr
         msg = "Couldn't get number of pages:"
         logger.error(f"{red(msg)} '{str(err_msg).strip()}'")
-        return 1
-
-    if ocr_command not in globals():
-        msg = red("Function '{ocr_command}' doesn't exit.")
-        logger.error(f'{msg}')
-        return 1
+        return Result(stderr=str(err_msg), returncode=1)
 
-    logger.debug(f"The file '{file_path}' has {num_pages} page{'s' if num_pages > 1 else ''}")
-    logger.debug(f'mime type: {mime_type}')
+    logger.debug("The file '%s' has %s page%s", file_path, num_pages, 's' if num_pages > 1 else '')
+    logger.debug('mime type: %s', mime_type)
 
     # Pre-compute the list of pages to process based on ocr_only_first_last_pages
-    if ocr_only_first_last_pages:
-        ocr_first_pages = int(ocr_only_first_last_pages[0])
-        ocr_last_pages = int(ocr_only_first_last_pages[1])
-        pages_to_process = [i for i in range(1, ocr_first_pages + 1)]
-        pages_to_process.extend([i for i in range(num_pages + 1 - ocr_last_pages, num_pages + 1)])
+    if pages:
+        pages_to_process = pages
+    elif ocr_only_first_last_pages:
+        pages_to_process = get_first_last_pages(num_pages, ocr_only_first_last_pages)
     else:
         # ocr_only_first_last_pages is False
         logger.debug('ocr_only_first_last_pages is False')
-        logger.warning(f"{yellow('OCR will be applied to all ({pages}) pages of the document')}")
-        pages_to_process = [i for i in range(1, num_pages+1)]
-    logger.debug(f'Pages to process: {pages_to_process}')
+        logger.warning(f"{yellow(f'OCR will be applied to all ({num_pages}) pages of the document')}")
+        pages_to_process = get_first_last_pages(num_pages, False)
+    logger.debug('Pages to process: %s', pages_to_process)
+
+    if ocr_command == 'tesseract_batch':
+        # All the pages are rasterized with one call and OCR-ed by only one
+        # tesseract process
+        # NOTE: gs and ddjvu output the pages in increasing order
+        pages_to_process = sorted(pages_to_process)
+        tmp_dir = scratch.mkdtemp()
+        logger.debug("Rasterizing the %s pages in '%s'...", len(pages_to_process), tmp_dir)
+        if page_convert_cmd == convert_pdf_page:
+            result = convert_pdf_pages(pages_to_process, file_path, tmp_dir)
+        else:
+            result = convert_djvu_pages(pages_to_process, file_path, tmp_dir)
+        if result.returncode == 0:
+            logger.debug("Running the '%s'...", ocr_command)
+            result = ocr_func(result.stdout, psm=profile['psm'])
+        logger.debug('Cleaning up tmp folder')
+        scratch.release(tmp_dir)
+        if result.returncode != 0:
+            msg = red(f"The pages couldn't be converted to text: {result}")
+            logger.error(f'{msg}')
+            return Result(stderr=result.stderr, returncode=1)
+        logger.debug("Result of '%s':\n%s", ocr_command, result)
+        if len(result.stdout) == len(pages_to_process):
+            return Result(stdout=''.join(result.stdout), returncode=0)
+        # The text can't be attributed to the pages, e.g. a page was skipped
+        logger.warning(yellow(f'Got the text of {len(result.stdout)} pages instead of '
+                              f'{len(pages_to_process)}, the pages are OCR-ed one by one'))
+        ocr_command = 'tesseract_wrapper'
+        ocr_func = tesseract_wrapper
 
     text = ''
     for i, page in enumerate(pages_to_process, start=1):
-        logger.debug(f'Processing page {i} of {len(pages_to_process)}')
-        # Make temporary files
-        tmp_file = tempfile.mkstemp()[1]
-        tmp_file_txt = tempfile.mkstemp(suffix='.txt')[1]
-        logger.debug(f'Running OCR of page {page}...')
-        logger.debug(f'Using tmp files {tmp_file} and {tmp_file_txt}')
+        logger.debug('Processing page %s of %s', i, len(pages_to_process))
+        # Make temporary file for the page image
+        tmp_file = scratch.mkstemp()
+        logger.debug('Running OCR of page %s...', page)
+        logger.debug('Using tmp file %s', tmp_file)
         # doc(pdf, djvu) --> image(png, tiff)
         result = page_convert_cmd(page, file_path, tmp_file)
         if result.returncode == 0:
-            logger.debug(f"Result of {page_convert_cmd.__name__}():\n{result}")
+            logger.debug("Result of %s():\n%s", page_convert_cmd.__name__, result)
             # image --> text
-            logger.debug(f"Running the '{ocr_command}'...")
-            result = eval(f'{ocr_command}("{tmp_file}", "{tmp_file_txt}")')
+            logger.debug("Running the '%s'...", ocr_command)
+            result = ocr_func(tmp_file, psm=profile['psm'])
             if result.returncode == 0:
-                logger.debug(f"Result of '{ocr_command}':\n{result}")
-                with open(tmp_file_txt, 'r') as f:
-                    data = f.read()
-                    # logger.debug(f"Text content of page {page}:\n{data}")
-                text += data
+                logger.debug("Result of '%s':\n%s", ocr_command, result)
+                text += result.stdout
             else:
                 msg = red(f"Image couldn't be converted to text: {result}")
                 logger.error(f'{msg}')
@@ -997,15 +2915,10 @@ def ocr_file(file_path, output_file, mime_type,
             msg = red(f"Document couldn't be converted to image: {result}")
             logger.error(f'{msg}')
             logger.error(f'Skipping current page ({page})')
-        # Remove temporary files
-        logger.debug('Cleaning up tmp files')
-        remove_file(tmp_file)
-        remove_file(tmp_file_txt)
-    # Everything on the stdout must be copied to the output file
-    logger.debug('Saving the text content')
-    with open(output_file, 'w') as f:
-        f.write(text)
-    return 0
+        # Remove temporary file
+        logger.debug('Cleaning up tmp file')
+        scratch.release(tmp_file)
+    return Result(stdout=text, returncode=0)
 
 
 def ok_file(old_path, new_path):
@@ -1019,18 +2932,36 @@ def ok_file(old_path, new_path):
 def pdfinfo(file_path):
     cmd = 'pdfinfo "{}"'.format(file_path)
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(args)
     return convert_result_from_shell_cmd(result)
 
 
-def pdftotext(input_file, output_file, first_page_to_convert=None, last_page_to_convert=None):
+# If `output_file` is None, pdftotext writes the text to stdout ('-')
+def pdftotext(input_file, output_file=None, first_page_to_convert=None, last_page_to_convert=None):
     first_page = f'-f {first_page_to_convert}' if first_page_to_convert else ''
     last_page = f'-l {last_page_to_convert}' if last_page_to_convert else ''
     pages = f'{first_page} {last_page}'.strip()
-    cmd = f'pdftotext "{input_file}" "{output_file}" {pages}'
+    output_file = output_file if output_file else '-'
+    cmd = f'pdftotext {pages} "{input_file}" "{output_file}"'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return convert_result_from_shell_cmd(result)
+    result = run_command(args)
+    return convert_text_result_from_shell_cmd(result)
+
+
+# Returns the PdfProbe of a pdf from only one `pdfinfo` run. The probes are
+# cached per file (path, size and modification time) since they are needed by
+# the corruption check, the pamphlet check, the search of ISBNs and OCR.
+def probe_pdf(file_path):
+    try:
+        stat = os.stat(file_path)
+    except OSError as e:
+        return PdfProbe(file_path, Result(stderr=str(e), returncode=1))
+    return probe_pdf_cached(str(file_path), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=256)
+def probe_pdf_cached(file_path, file_size, file_mtime):
+    return PdfProbe(file_path, pdfinfo(file_path))
 
 
 def remove_file(file_path):
@@ -1062,52 +2993,77 @@ def remove_tree(file_path):
 def reorder_file_content(
         file_path,
         isbn_reorder_files=ISBN_REORDER_FILES, **kwargs):
+    # Problem: UnicodeDecodeError: 'utf-8' codec can't decode byte 0xa9 in position 1475: invalid start byte
+    # Solution: encoding="utf8", errors='ignore'
+    with open(file_path, 'r', encoding="utf8", errors='ignore') as f:
+        # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
+        # Read whole content of file as a string
+        data = f.read()
+    return reorder_text(data, isbn_reorder_files)
+
+
+# Same as reorder_file_content() but on text that is already in memory, e.g.
+# the output of convert_to_txt()
+def reorder_text(text, isbn_reorder_files=ISBN_REORDER_FILES, **kwargs):
     if isbn_reorder_files:
         isbn_rf_scan_first = isbn_reorder_files[0]
         isbn_rf_reverse_last = isbn_reorder_files[1]
         logger.debug('Reordering input file (if possible), read first '
-                     f'{isbn_rf_scan_first} lines normally, then read '
-                     f'last {isbn_rf_reverse_last} lines in reverse and '
-                     'then read the rest')
+                     '%s lines normally, then read '
+                     'last %s lines in reverse and '
+                     'then read the rest', isbn_rf_scan_first, isbn_rf_reverse_last)
         # TODO: try out with big file, more than 800 pages (approx. 73k lines)
-        # TODO: see alternatives for reading big file @
-        # https://stackoverflow.com/a/4999741 (mmap),
-        # https://stackoverflow.com/a/24809292 (linecache),
-        # https://stackoverflow.com/a/42733235 (buffer)
-        # Problem: UnicodeDecodeError: 'utf-8' codec can't decode byte 0xa9 in position 1475: invalid start byte
-        # Solution: encoding="utf8", errors='ignore'
-        with open(file_path, 'r', encoding="utf8", errors='ignore') as f:
-            # Read whole file as a list of lines
-            # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
-            data = f.readlines()
-            # Read the first ISBN_GREP_RF_SCAN_FIRST lines of the file text
-            first_part = data[:isbn_rf_scan_first]
-            del data[:isbn_rf_scan_first]
-            # Read the last part and reverse it
-            last_part = data[-isbn_rf_reverse_last:]
-            if last_part:
-                last_part.reverse()
-                del data[-isbn_rf_reverse_last:]
-            # Read the middle part of the file text
-            middle_part = data
-            # TODO: try out with large lists, if efficiency is a concern then
-            # check itertools.chain
-            # ref.: https://stackoverflow.com/a/4344735
-            # Concatenate the three parts: first, last part (reversed), and
-            # middle part
-            data = first_part + last_part + middle_part
-            data = "".join(data)
+        # NOTE: StringIO with universal newlines splits the lines exactly like
+        # reading a text file with readlines()
+        data = io.StringIO(text, newline=None).readlines()
+        # Read the first ISBN_GREP_RF_SCAN_FIRST lines of the file text
+        first_part = data[:isbn_rf_scan_first]
+        del data[:isbn_rf_scan_first]
+        # Read the last part and reverse it
+        last_part = data[-isbn_rf_reverse_last:]
+        if last_part:
+            last_part.reverse()
+            del data[-isbn_rf_reverse_last:]
+        # Read the middle part of the file text
+        middle_part = data
+        # TODO: try out with large lists, if efficiency is a concern then
+        # check itertools.chain
+        # ref.: https://stackoverflow.com/a/4344735
+        # Concatenate the three parts: first, last part (reversed), and
+        # middle part
+        data = first_part + last_part + middle_part
+        data = "".join(data)
     else:
         logger.debug('Since `isbn_reorder_file`s is False, input file will '
                      'not be reordered')
-        with open(file_path, 'r') as f:
-            # TODO: do we remove newlines? e.g. with f.read().rstrip("\n")
-            # Read whole content of file as a string
-            data = f.read()
+        data = text
     data = repr(data).replace('\\uf73', '')
     return data
 
 
+# Runs the given command (list of arguments) and returns the CompletedProcess
+# with its stderr (and its stdout, unless `stdout` is a file). The programs run
+# for a heavy file (see OrganizeEbooks._organize_one()) are limited to
+# `worker_lane.memory_limit_mib` MiB of address space.
+# NOTE: the limit is set by a small Python launcher (that execs the program)
+# since `preexec_fn` is not safe when files are organized in parallel threads
+def run_command(args, stdout=subprocess.PIPE):
+    limit_mib = getattr(worker_lane, 'memory_limit_mib', None)
+    if limit_mib and resource is not None:
+        executable = shutil.which(args[0])
+        if executable is None:
+            raise FileNotFoundError(f"No such file or directory: '{args[0]}'")
+        launcher = 'import os, resource, sys; ' \
+                   'soft, hard = resource.getrlimit(resource.RLIMIT_AS); ' \
+                   'limit = int(sys.argv[1]); ' \
+                   'limit = limit if hard == resource.RLIM_INFINITY else min(limit, hard); ' \
+                   'resource.setrlimit(resource.RLIMIT_AS, (limit, hard)); ' \
+                   'os.execv(sys.argv[2], sys.argv[2:])'
+        args = [sys.executable, '-S', '-c', launcher, str(limit_mib * 1024 ** 2),
+                executable] + list(args[1:])
+    return subprocess.run(args, stdout=stdout, stderr=subprocess.PIPE)
+
+
 # Tries to find ISBN numbers in the given ebook file by using progressively
 # more "expensive" tactics.
 # These are the steps:
@@ -1124,6 +3080,12 @@ def reorder_file_content(
 # 7. If OCR is enabled and convert_to_txt() fails or its result is empty,
 #    try OCR-ing the file. If the result is non-empty but does not contain
 #    ISBNs and OCR_ENABLED is set to "always", run OCR as well.
+# The text of the files bigger than `heavy_file_size_mib` is never loaded in
+# memory as a whole: it is searched line by line with find_isbns_in_file().
+# If `adaptive_isbn_search` is enabled, steps 4-6 are instead run in the order
+# learned from `isbn_search_stats` for the MIME type of the file.
+# The programs of steps 4 and 6 that keep failing for the MIME type of the file
+# (see `failure_memo`) are skipped.
 # Ref.: https://bit.ly/2r28US2
 def search_file_for_isbns(
         file_path, isbn_blacklist_regex=ISBN_BLACKLIST_REGEX,
@@ -1135,12 +3097,18 @@ def search_file_for_isbns(
         epub_convert_method=EPUB_CONVERT_METHOD,
         pdf_convert_method=PDF_CONVERT_METHOD,
         ocr_enabled=OCR_ENABLED,
-        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES, **kwargs):
+        ocr_only_first_last_pages=OCR_ONLY_FIRST_LAST_PAGES,
+        ocr_profile=OCR_PROFILE,
+        adaptive_isbn_search=ADAPTIVE_ISBN_SEARCH, isbn_search_stats=None,
+        failure_memo=None, heavy_file_size_mib=HEAVY_FILE_SIZE_MIB, **kwargs):
     func_params = locals().copy()
     # NOTE: pop('file_path'), the convert_to_txt() has file_path as first parameter
     func_params.pop('file_path')
+    # NOTE: the search statistics are only gathered for the top-level file, not
+    # for the files extracted from archives
+    func_params.pop('isbn_search_stats')
     basename = os.path.basename(file_path)
-    logger.debug(f"Searching file '{basename[:100]}' for ISBN numbers...")
+    logger.debug("Searching file '%s' for ISBN numbers...", basename[:100])
     # Step 1: check the filename for ISBNs
     # TODO: make sure that we return an empty string when we can't find ISBNs
     logger.debug('check the filename for ISBNs')
@@ -1153,12 +3121,17 @@ def search_file_for_isbns(
     # Steps 2-3: (2) if valid MIME type, search file contents for ISBNs and
     # (3) if invalid MIME type, exit without results
     mime_type = get_mime_type(file_path)
+    file_size = os.path.getsize(file_path)
+    heavy = bool(heavy_file_size_mib) and file_size >= heavy_file_size_mib * 1024 ** 2
     if mime_type and re.match(isbn_direct_files, mime_type):
         logger.debug('Ebook is in text format, trying to find ISBN directly')
-        data = reorder_file_content(file_path, **func_params)
-        isbns = find_isbns(data, **func_params)
+        if heavy:
+            isbns = find_isbns_in_file(file_path, **func_params)[0]
+        else:
+            data = reorder_file_content(file_path, **func_params)
+            isbns = find_isbns(data, **func_params)
         if isbns:
-            logger.debug(f"Extracted ISBNs from the text file contents:\n{isbns}")
+            logger.debug("Extracted ISBNs from the text file contents:\n%s", isbns)
         else:
             logger.debug('Did not find any ISBNs')
         return isbns
@@ -1167,109 +3140,243 @@ def search_file_for_isbns(
         return isbns
 
     # Step 4: check the file metadata from calibre's `ebook-meta` for ISBNs
-    logger.debug("check the file metadata from calibre's `ebook-meta` for ISBNs")
-    if command_exists('ebook-meta'):
-        ebookmeta = get_ebook_metadata(file_path)
-        logger.debug(f'Ebook metadata:\n{ebookmeta.stdout}')
-        isbns = find_isbns(ebookmeta.stdout, **func_params)
-        if isbns:
-            logger.debug(f"Extracted ISBNs from calibre ebook metadata:\n{isbns}'")
+    def search_ebook_meta():
+        logger.debug("check the file metadata from calibre's `ebook-meta` for ISBNs")
+        error = failure_memo.is_blocked('ebook-meta', mime_type) if failure_memo else None
+        if error:
+            logger.debug("`ebook-meta` is skipped since it keeps failing for '%s' files: %s",
+                         mime_type or 'unknown', error)
+            return ''
+        if command_exists('ebook-meta'):
+            ebookmeta = get_ebook_metadata(file_path)
+            if failure_memo:
+                failure_memo.record('ebook-meta', mime_type, ebookmeta.returncode,
+                                    ebookmeta.stderr)
+            logger.debug('Ebook metadata:\n%s', ebookmeta.stdout)
+            isbns = find_isbns(ebookmeta.stdout, **func_params)
+            if isbns:
+                logger.debug("Extracted ISBNs from calibre ebook metadata:\n%s'", isbns)
             return isbns
-    else:
-        logger.debug("`ebook-meta` is not found!")
+        else:
+            logger.debug("`ebook-meta` is not found!")
+            return ''
 
     # Step 5: decompress with 7z
-    logger.debug('decompress with 7z')
-    if not mime_type.startswith('application/epub+zip'):
+    def search_archive():
+        logger.debug('decompress with 7z')
         isbns = get_all_isbns_from_archive(file_path, **func_params)
         if isbns:
-            logger.debug(f"Extracted ISBNs from the archive file:\n{isbns}")
-            return isbns
+            logger.debug("Extracted ISBNs from the archive file:\n%s", isbns)
+        return isbns
 
     # Step 6: convert file to .txt
-    try_ocr = False
-    tmp_file_txt = tempfile.mkstemp(suffix='.txt')[1]
-    logger.debug(f"Converting ebook to text format...")
-    logger.debug(f"Temp file: {tmp_file_txt}")
+    # NOTE: the text is handed over in memory, no temporary file is involved
+    # Only the text layer of the first and last pages of a djvu document is
+    # extracted (with one djvused call) and the pages without text layer are
+    # OCR-ed (if enabled)
+    def search_djvu_pages():
+        isbns = ''
+        result = get_pages_in_djvu(file_path)
+        if result.returncode != 0:
+            logger.debug("Couldn't get the number of pages of the djvu: %s", result.stderr)
+            return isbns
+        pages = get_first_last_pages(result.stdout, ocr_only_first_last_pages)
+        logger.debug('Extracting the text of the pages %s with djvused...', pages)
+        result = djvused_txt(file_path, pages)
+        if result.returncode != 0:
+            logger.debug('djvused failed: %s', result.stderr)
+            return isbns
+        pages_text = result.stdout
+        pages_without_text = [p for p, text in pages_text.items()
+                              if not re.search('[A-Za-z0-9]+', text)]
+        if pages_without_text and ocr_enabled != 'false':
+            logger.debug('Running OCR on the pages without text layer: %s', pages_without_text)
+            result = ocr_to_text(file_path, mime_type, pages=pages_without_text, **func_params)
+            if result.returncode == 0:
+                ocr_done_pages.extend(pages_without_text)
+                # The OCR-ed text of all these pages takes the place of the first one
+                pages_text[pages_without_text[0]] = result.stdout
+        data = reorder_text(''.join(pages_text.values()), **func_params)
+        isbns = find_isbns(data, **func_params)
+        if isbns:
+            logger.debug("The first and last pages contain ISBNs:\n%s", isbns)
+        return isbns
 
-    # NOTE: important, takes a long time for pdfs (not djvu)
-    result = convert_to_txt(file_path, tmp_file_txt, mime_type, **func_params)
-    if result.returncode == 0:
-        logger.debug('Conversion to text was successful, checking the result...')
-        # Problem: UnicodeDecodeError: 'utf-8' codec can't decode byte 0xa9 in position 1475: invalid start byte
-        # Solution: encoding="utf8", errors='ignore'
-        with open(tmp_file_txt, 'r', encoding="utf8", errors='ignore') as f:
-            data = f.read()
-        if not re.search('[A-Za-z0-9]+', data):
-            logger.debug('The converted txt with size '
-                         f'{os.stat(tmp_file_txt).st_size} bytes does not seem '
-                         'to contain text')
-            logger.debug(f'First 1000 characters:\n{data[:1000].strip()}')
-            try_ocr = True
+    def search_ocr():
+        nonlocal ocr_done
+        ocr_done = True
+        isbns = ''
+        logger.debug('Trying to run OCR on the file...')
+        pages = None
+        if ocr_done_pages:
+            # The djvu pages without text layer were already OCR-ed
+            pages = [p for p in get_first_last_pages(get_pages_in_djvu(file_path).stdout,
+                                                     ocr_only_first_last_pages)
+                     if p not in ocr_done_pages]
+        if pages == []:
+            logger.debug('All the pages were already OCR-ed')
         else:
-            data = reorder_file_content(tmp_file_txt, **func_params)
-            # ipdb.set_trace()
-            isbns = find_isbns(data, **func_params)
+            result = ocr_to_text(file_path, mime_type, pages=pages, **func_params)
+            if result.returncode == 0:
+                logger.debug('OCR was successful, checking the result...')
+                isbns = result.isbns
+                if isbns is None:
+                    data = reorder_text(result.stdout, **func_params)
+                    # ipdb.set_trace()
+                    isbns = find_isbns(data, **func_params)
+                if isbns:
+                    logger.debug("Text output contains ISBNs %s!", isbns)
+                else:
+                    logger.debug('Did not find any ISBNs in the OCR output')
+            else:
+                # TODO: show error!
+                logger.info('There was an error while running OCR!')
+        return isbns
+
+    def search_converted_text():
+        nonlocal try_ocr
+        isbns = ''
+        if djvu_convert_method == 'djvused' and mime_type.startswith('image/vnd.djvu') \
+                and command_exists('djvused'):
+            isbns = search_djvu_pages()
             if isbns:
-                logger.debug(f"Text output contains ISBNs:\n{isbns}")
+                return isbns
+            logger.debug('No ISBNs found in the first and last pages of the djvu, '
+                         'converting the whole document...')
+        # NOTE: the probe is only a hint (the fonts can be missed), thus the
+        # pdf is still converted to text if OCR finds nothing
+        if mime_type == 'application/pdf' and ocr_enabled != 'false' \
+                and probe_pdf(file_path).has_text is False:
+            logger.debug("The pdf doesn't seem to reference any font, thus it probably "
+                         'has no text layer: running OCR before the conversion to text')
+            isbns = search_ocr()
+            if isbns:
+                return isbns
+        logger.debug("Converting ebook to text format...")
+        # NOTE: important, takes a long time for pdfs (not djvu)
+        has_text = False
+        if heavy:
+            logger.debug('The file is big (%s MiB), converting it into a temporary '
+                         'text file that is searched line by line', file_size // 1024 ** 2)
+            tmp_file_txt = scratch.mkstemp(suffix='.txt', size_hint=file_size)
+            result = convert_to_txt(file_path, tmp_file_txt, mime_type, **func_params)
+            if result.returncode == 0:
+                isbns, has_text = find_isbns_in_file(tmp_file_txt, **func_params)
+                if not has_text:
+                    logger.debug('The converted txt does not seem to contain text')
+            scratch.release(tmp_file_txt)
+        else:
+            result = convert_to_txt(file_path, None, mime_type, **func_params)
+            if result.returncode == 0:
+                data = result.stdout
+                has_text = bool(re.search('[A-Za-z0-9]+', data))
+                if has_text:
+                    data = reorder_text(data, **func_params)
+                    # ipdb.set_trace()
+                    isbns = find_isbns(data, **func_params)
+                else:
+                    logger.debug('The converted txt with %s characters does '
+                                 'not seem to contain text', len(data))
+                    logger.debug('First 1000 characters:\n%s', data[:1000].strip())
+        if result.returncode == 0:
+            logger.debug('Conversion to text was successful, checking the result...')
+            if not has_text:
+                try_ocr = True
+            elif isbns:
+                logger.debug("Text output contains ISBNs:\n%s", isbns)
             elif ocr_enabled == 'always':
                 logger.debug('We will try OCR because the successfully converted '
                              'text did not have any ISBNs')
                 try_ocr = True
             else:
                 logger.debug('Did not find any ISBNs and will NOT try OCR')
-    else:
-        logger.error(red('There was an error converting the ebook to txt format:'))
-        logger.error(red(result.stderr))
-        try_ocr = True
-
-    # Step 7: OCR the file
-    if not isbns and ocr_enabled != 'false' and try_ocr:
-        logger.debug('Trying to run OCR on the file...')
-        if ocr_file(file_path, tmp_file_txt, mime_type, **func_params) == 0:
-            logger.debug('OCR was successful, checking the result...')
-            data = reorder_file_content(tmp_file_txt, **func_params)
-            # ipdb.set_trace()
-            isbns = find_isbns(data, **func_params)
-            if isbns:
-                logger.debug(f"Text output contains ISBNs {isbns}!")
-            else:
-                logger.debug('Did not find any ISBNs in the OCR output')
         else:
-            # TODO: show error!
-            logger.info('There was an error while running OCR!')
+            logger.error(red('There was an error converting the ebook to txt format:'))
+            logger.error(red(result.stderr))
+            try_ocr = True
+        return isbns
+
+    # Steps 4-6 are run in the default order unless the adaptive search is
+    # enabled, in which case the order learned for this MIME type is used
+    try_ocr = False
+    ocr_done = False
+    ocr_done_pages = []
+    steps = {'ebook-meta': search_ebook_meta,
+             'archive': search_archive,
+             'convert': search_converted_text}
+    if adaptive_isbn_search and isbn_search_stats:
+        steps_order = isbn_search_stats.get_order(mime_type)
+        logger.debug("Adaptive search order for '%s': %s", mime_type, ' -> '.join(steps_order))
+    else:
+        steps_order = IsbnSearchStats.get_steps(mime_type)
+    for step in steps_order:
+        start = time.perf_counter()
+        isbns = steps[step]()
+        if isbn_search_stats:
+            isbn_search_stats.record(mime_type, step, bool(isbns),
+                                     time.perf_counter() - start)
+        if isbns:
+            break
 
-    logger.debug(f"Removing tmp file '{tmp_file_txt}'...")
-    remove_file(tmp_file_txt)
+    # Step 7: OCR the file (unless it was already OCR-ed in step 6)
+    if not isbns and ocr_enabled != 'false' and try_ocr and not ocr_done:
+        isbns = search_ocr()
 
     if isbns:
-        logger.debug(f"Returning the found ISBNs:\n{isbns}")
+        logger.debug("Returning the found ISBNs:\n%s", isbns)
     else:
-        logger.debug(f'Could not find any ISBNs in {file_path} :(')
+        logger.debug('Could not find any ISBNs in %s :(', file_path)
 
     return isbns
 
 
-# Returns a single value by key by parsing the calibre-style text metadata
-# hashmap that is passed as argument
+# Saves a metadata file next to its book or, if a metadata sink is used, in
+# the MetadataStore of its folder
+def save_metadata_file(metadata_path, metadata):
+    if move_executor.metadata_store is not None:
+        move_executor.metadata_store.add(metadata_path, metadata)
+    else:
+        with open(metadata_path, 'w') as f:
+            f.write(metadata)
+
+
+# Returns a single value by key of the calibre-style text metadata that is
+# passed as argument (None if the key is missing), see BookMetadata
 # Ref.: https://bit.ly/2rIUHZM
 def search_meta_val(ebookmeta, key):
-    val = None
-    lines = ebookmeta.splitlines()
-    for line in lines:
-        if line.startswith(key):
-            return line.split(':')[-1].strip()
-    return val
+    return BookMetadata(ebookmeta).get(key)
 
 
 def setup_log(quiet=False, verbose=False, logging_level=LOGGING_LEVEL,
-              logging_formatter=LOGGING_FORMATTER, logger_names=None):
+              logging_formatter=LOGGING_FORMATTER, logger_names=None,
+              log_file=None):
     if logger_names is None:
         logger_names = ['script', 'lib']
     max_width = 0
     for name in logger_names:
         max_width = max(max_width, len(name))
     if not quiet:
+        if log_file:
+            # NOTE: the same handler is shared by all the loggers
+            ch = logging.FileHandler(log_file)
+        else:
+            # Create console handler and set level
+            ch = logging.StreamHandler()
+        ch.setLevel(logging.DEBUG)
+        # Create formatter
+        if logging_formatter == 'jsonl':
+            ch.setFormatter(JsonLinesFormatter())
+        elif logging_formatter:
+            formatters = {
+                'console': f'%(name)-{max_width}s | %(levelname)-8s | %(message)s',
+                # 'console': '%(asctime)s | %(levelname)-8s | %(message)s',
+                'only_msg': '%(message)s',
+                'simple': '%(levelname)-8s %(message)s',
+                'verbose': '%(asctime)s | %(name)-10s | %(levelname)-8s | %(message)s'
+            }
+            formatter = logging.Formatter(formatters[logging_formatter])
+            # Add formatter to ch
+            ch.setFormatter(formatter)
         for logger_name in logger_names:
             logger_ = logging.getLogger(logger_name)
             if verbose:
@@ -1277,28 +3384,13 @@ def setup_log(quiet=False, verbose=False, logging_level=LOGGING_LEVEL,
             else:
                 logging_level = logging_level.upper()
                 logger_.setLevel(logging_level)
-            # Create console handler and set level
-            ch = logging.StreamHandler()
-            ch.setLevel(logging.DEBUG)
-            # Create formatter
-            if logging_formatter:
-                formatters = {
-                    'console': f'%(name)-{max_width}s | %(levelname)-8s | %(message)s',
-                    # 'console': '%(asctime)s | %(levelname)-8s | %(message)s',
-                    'only_msg': '%(message)s',
-                    'simple': '%(levelname)-8s %(message)s',
-                    'verbose': '%(asctime)s | %(name)-10s | %(levelname)-8s | %(message)s'
-                }
-                formatter = logging.Formatter(formatters[logging_formatter])
-                # Add formatter to ch
-                ch.setFormatter(formatter)
             # Add ch to logger
             logger_.addHandler(ch)
         # =============
         # Start logging
         # =============
-        logger.debug("Running {} v{}".format(__file__, __version__))
-        logger.debug("Verbose option {}".format("enabled" if verbose else "disabled"))
+        logger.debug("Running %s v%s", __file__, __version__)
+        logger.debug("Verbose option %s", "enabled" if verbose else "disabled")
 
 
 def skip_file(old_path, new_path):
@@ -1349,47 +3441,93 @@ def substitute_with_sed(regex, replacement, text, use_global=True):
     return p2.communicate()[0].decode('UTF-8').strip()
 
 
+# Runs only one tesseract process on all the given images, thus the OCR model
+# is loaded only once. A list file is given to tesseract if there are many
+# images (a multi-page tif can also be given alone). Returns a Result whose
+# `stdout` is the list of the texts of the pages (in the same order as the
+# images).
+def tesseract_batch(input_files, psm=12):
+    list_file = None
+    if len(input_files) == 1:
+        input_file = input_files[0]
+    else:
+        list_file = scratch.mkstemp(suffix='.txt')
+        with open(list_file, 'w') as f:
+            f.write('\n'.join(map(str, input_files)) + '\n')
+        input_file = list_file
+    cmd = f'tesseract "{input_file}" stdout --psm {psm}'
+    args = shlex.split(cmd)
+    result = run_command(args)
+    result = convert_text_result_from_shell_cmd(result)
+    if list_file:
+        scratch.release(list_file)
+    if result.returncode == 0:
+        # NOTE: tesseract ends the text of each page with a form feed
+        pages_text = result.stdout.split('\f')
+        if pages_text and not pages_text[-1].strip():
+            pages_text.pop()
+        result.stdout = pages_text
+    return result
+
+
 # OCR: convert image to text
-def tesseract_wrapper(input_file, output_file):
-    cmd = f'tesseract "{input_file}" stdout --psm 12'
+# If `output_file` is None, the text is only returned in `result.stdout`
+def tesseract_wrapper(input_file, output_file=None, psm=12):
+    cmd = f'tesseract "{input_file}" stdout --psm {psm}'
     args = shlex.split(cmd)
-    result = subprocess.run(args,
-                            stdout=open(output_file, 'w'),
-                            stderr=subprocess.PIPE,
-                            encoding='utf-8',
-                            bufsize=4096)
-    return convert_result_from_shell_cmd(result)
+    result = run_command(args)
+    result = convert_text_result_from_shell_cmd(result)
+    if output_file:
+        with open(output_file, 'w') as f:
+            f.write(result.stdout)
+    return result
 
 
 def test_archive(file_path):
     cmd = '7z t "{}"'.format(file_path)
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(args)
     return convert_result_from_shell_cmd(result)
 
 
 # macOS equivalent for catdoc
 # See https://stackoverflow.com/a/44003923/14664104
-def textutil(input_file, output_file):
-    cmd = f'textutil -convert txt "{input_file}" -output "{output_file}"'
+# If `output_file` is None, textutil writes the text to stdout
+def textutil(input_file, output_file=None):
+    output = f'-output "{output_file}"' if output_file else '-stdout'
+    cmd = f'textutil -convert txt "{input_file}" {output}'
     args = shlex.split(cmd)
-    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return convert_result_from_shell_cmd(result)
-
-
-# Return "folder_path/basename" if no file exists at this path. Otherwise,
-# sequentially insert " ($n)" before the extension of `basename` and return the
-# first path for which no file is present.
+    result = run_command(args)
+    return convert_text_result_from_shell_cmd(result)
+
+
+# Splits the given text into lowercase tokens (letters and digits) and removes
+# the tokens that match `tokens_to_ignore`, e.g. 'Some_Book-2nd.ed_(2019)'
+# -> ['some']
+# Ref.: https://github.com/na--/ebook-tools/blob/master/lib.sh (tokenize)
+def tokenize(text, tokens_to_ignore=TOKENS_TO_IGNORE):
+    tokens = [token for token in re.split(r'[\W_]+', text.lower()) if token]
+    if tokens_to_ignore:
+        ignored = re.compile(f'(?:{tokens_to_ignore})')
+        tokens = [token for token in tokens if not ignored.fullmatch(token)]
+    return tokens
+
+
+# Return "folder_path/basename" if no file exists at this path (and it is not
+# reserved by the MovePlan). Otherwise, sequentially insert " ($n)" before the
+# extension of `basename` and return the first path for which no file is
+# present.
 # ref.: https://bit.ly/3n1JNuk
 def unique_filename(folder_path, basename):
     stem = Path(basename).stem
     ext = Path(basename).suffix
     new_path = Path(Path(folder_path).joinpath(basename))
     counter = 0
-    while new_path.is_file():
+    plan = move_executor.plan
+    while new_path.is_file() or (plan is not None and plan.is_reserved(new_path.as_posix())):
         counter += 1
-        logger.debug(f"File '{new_path.name}' already exists in destination "
-                     f"'{folder_path}', trying with counter {counter}!")
+        logger.debug("File '%s' already exists in destination "
+                     "'%s', trying with counter %s!", new_path.name, folder_path, counter)
         new_stem = f'{stem} {counter}'
         new_path = Path(Path(folder_path).joinpath(new_stem + ext))
     return new_path.as_posix()
@@ -1402,8 +3540,21 @@ class OrganizeEbooks:
         # ===============
         self.dry_run = DRY_RUN
         self.symlink_only = SYMLINK_ONLY
+        self.hardlink_only = HARDLINK_ONLY
         self.keep_metadata = KEEP_METADATA
+        self.scratch_dir = SCRATCH_DIR
+        self.scratch_quota_mib = SCRATCH_QUOTA_MIB
+        self.jobs = JOBS
+        self.heavy_jobs = HEAVY_JOBS
+        self.heavy_file_size_mib = HEAVY_FILE_SIZE_MIB
+        self.heavy_memory_limit_mib = HEAVY_MEMORY_LIMIT_MIB
         self.reverse = REVERSE
+        self.file_order = FILE_ORDER
+        self.cost_history_file = COST_HISTORY_FILE
+        self.cost_model = None
+        self.time_budget = TIME_BUDGET
+        # Time (time.monotonic()) after which no new file is started
+        self.deadline = None
         # ======================
         # Convert-to-txt options
         # ======================
@@ -1422,21 +3573,41 @@ class OrganizeEbooks:
         self.isbn_reorder_files = ISBN_REORDER_FILES
         self.isbn_ret_separator = ISBN_RET_SEPARATOR
         self.isbn_metadata_fetch_order = ISBN_METADATA_FETCH_ORDER
+        self.metadata_catalog = METADATA_CATALOG
+        self.fetch_metadata_command = FETCH_METADATA_COMMAND
+        self.metadata_source_rate = METADATA_SOURCE_RATE
+        self.metadata_source_burst = METADATA_SOURCE_BURST
+        # Metadata backends (e.g. LocalMetadataCatalog) tried before the online
+        # sources, see _setup()
+        self.metadata_backends = []
+        self.local_backends = []
+        self.isbn_search_stats_file = ISBN_SEARCH_STATS_FILE
+        self.adaptive_isbn_search = ADAPTIVE_ISBN_SEARCH
+        self.isbn_search_stats = None
+        self.failure_memo_file = FAILURE_MEMO_FILE
+        self.failure_memo_threshold = FAILURE_MEMO_THRESHOLD
+        self.failure_memo = None
         # ===========
         # OCR options
         # ===========
         self.ocr_enabled = OCR_ENABLED
         self.ocr_only_first_last_pages = OCR_ONLY_FIRST_LAST_PAGES
         self.ocr_command = OCR_COMMAND
+        self.ocr_profile = OCR_PROFILE
         # ================
         # Organize options
         # ================
         self.skip_archives = SKIP_ARCHIVES
         self.corruption_check = CORRUPTION_CHECK
+        self.audit_report = AUDIT_REPORT
+        self.audit_sample = AUDIT_SAMPLE
         self.tested_archive_extensions = TESTED_ARCHIVE_EXTENSIONS
         self.organize_without_isbn = ORGANIZE_WITHOUT_ISBN
         self.organize_without_isbn_sources = ORGANIZE_WITHOUT_ISBN_SOURCES
         self.without_isbn_ignore = WITHOUT_ISBN_IGNORE
+        self.tokens_to_ignore = TOKENS_TO_IGNORE
+        self.title_index_file = TITLE_INDEX_FILE
+        self.title_index = None
         self.pamphlet_included_files = PAMPHLET_INCLUDED_FILES
         self.pamphlet_excluded_files = PAMPHLET_EXCLUDED_FILES
         self.pamphlet_max_pdf_pages = PAMPHLET_MAX_PDF_PAGES
@@ -1451,45 +3622,65 @@ class OrganizeEbooks:
         self.output_folder_pamphlets = OUTPUT_FOLDER_PAMPHLETS
         self.output_filename_template = OUTPUT_FILENAME_TEMPLATE
         self.output_metadata_extension = OUTPUT_METADATA_EXTENSION
-
-    def _is_pamphlet(self, file_path):
-        logger.debug(f"Checking whether '{file_path}' looks like a pamphlet...")
+        self.metadata_sink = METADATA_SINK
+        self.metadata_sink_batch = METADATA_SINK_BATCH
+        self.results_file = RESULTS_FILE
+        self.plan_file = PLAN_FILE
+        # Per-file results (FileResult) of the last organization
+        self.results = []
+        # Compiled regexes, see _update()
+        self.patterns = PatternRegistry(**self.__dict__)
+
+    # The following three methods log the outcome of the organization of a
+    # file and save it in its FileResult
+    @staticmethod
+    def _fail_file(file_result, old_path, reason, new_path=None):
+        fail_file(old_path, reason, new_path)
+        file_result.update('fail', reason, new_path)
+
+    @staticmethod
+    def _ok_file(file_result, old_path, new_path, metadata_source=None):
+        ok_file(old_path, new_path)
+        file_result.update('ok', new_path=new_path, metadata_source=metadata_source)
+
+    @staticmethod
+    def _skip_file(file_result, old_path, reason):
+        skip_file(old_path, reason)
+        file_result.update('skip', reason)
+
+    # `filename_class` is the result of PatternRegistry.classify_filename() if
+    # it was already computed for this file
+    def _is_pamphlet(self, file_path, filename_class=None):
+        logger.debug("Checking whether '%s' looks like a pamphlet...", file_path)
         # TODO: check that it does the same as to_lower() @ https://bit.ly/2w0O5LN
         lowercase_name = os.path.basename(file_path).lower()
+        if filename_class is None:
+            filename_class = self.patterns.classify_filename(lowercase_name,
+                                                             check_ignored=False)
+        classification, pattern = filename_class
+        debug = logger.isEnabledFor(logging.DEBUG)
         # TODO: check that it does the same as
         # `if [[ "$lowercase_name" =~ $PAMPHLET_INCLUDED_FILES ]];`
         # Ref.: https://bit.ly/2I5nvFW
-        if re.search(self.pamphlet_included_files, lowercase_name):
-            parts = []
-            # TODO: check that it does the same as
-            # `matches="[$(echo "$lowercase_name" |
-            # grep -oE "$PAMPHLET_INCLUDED_FILES" | paste -sd';')]"`
-            # TODO: they are using grep -oE
+        if classification == 'pamphlet':
+            # NOTE: the matched parts are only needed for debugging
             # Ref.: https://bit.ly/2w2PeCo
-            matches = re.finditer(self.pamphlet_included_files, lowercase_name)
-            for i, match in enumerate(matches):
-                parts.append(match.group())
-            matches = ';'.join(parts)
-            logger.debug('Parts of the filename match the pamphlet include '
-                         f'regex: [{matches}]')
+            if debug:
+                matches = self.patterns.get_matches(pattern, lowercase_name)
+                logger.debug('Parts of the filename match the pamphlet include '
+                             'regex: [%s]', matches)
             return True
         logger.debug('The file does not match the pamphlet include regex, '
                      'continuing...')
         # TODO: check that it does the same as
         # `if [[ "$lowercase_name" =~ $PAMPHLET_EXCLUDED_FILES ]]; then`
         # Ref.: https://bit.ly/2KscBZj
-        if re.search(self.pamphlet_excluded_files, lowercase_name):
-            parts = []
-            # TODO: check that it does the same as
-            # `matches="[$(echo "$lowercase_name" | grep -oE "$PAMPHLET_EXCLUDED_FILES" | paste -sd';')]"`
-            # NOTE: they are using grep -oE
+        if classification == 'not_pamphlet':
             # Ref.: https://bit.ly/2JHhlZJ
-            matches = re.finditer(self.pamphlet_excluded_files, lowercase_name)
-            for i, match in enumerate(matches):
-                parts.append(match.group())
-            matches = ';'.join(parts)
-            logger.debug('Parts of the filename match the pamphlet ignore '
-                         f'regex: [{matches}]')
+            if debug:
+                matches = self.patterns.get_matches(pattern, lowercase_name)
+                logger.debug('Parts of the filename match the pamphlet ignore '
+                             'regex: [%s]', matches)
             return False
         logger.debug('The file does not match the pamphlet exclude regex, '
                      'continuing...')
@@ -1499,125 +3690,130 @@ class OrganizeEbooks:
             logger.error(f'Could not get the file size (KiB) for {file_path}')
             return None
         if mime_type == 'application/pdf':
-            logger.debug('The file looks like a pdf, checking if the number of '
-                         f'pages is larger than {self.pamphlet_max_pdf_pages}...')
+            logger.debug("The file looks like a pdf, checking if the number of "
+                         'pages is larger than %s...', self.pamphlet_max_pdf_pages)
             result = get_pages_in_pdf(file_path)
-            pages = result.stdout
+            pages = result.stdout if result.returncode == 0 else None
             if pages is None:
                 logger.error(f'Could not get the number of pages for {file_path}')
                 return None
             elif pages > self.pamphlet_max_pdf_pages:
-                logger.debug(f'The file has {pages} pages, too many for a '
-                             'pamphlet')
+                logger.debug('The file has %s pages, too many for a '
+                             'pamphlet', pages)
                 return False
             else:
-                logger.debug(f'The file has only {pages} pages, looks like a '
-                             'pamphlet')
+                logger.debug('The file has only %s pages, looks like a '
+                             'pamphlet', pages)
                 return True
         elif file_size_KiB < self.pamphlet_max_filesize_kib:
-            logger.debug(f"The file has a type '{mime_type}' and a small size "
-                         f'({file_size_KiB} KiB), looks like a pamphlet')
+            logger.debug("The file has a type '%s' and a small size "
+                         '(%s KiB), looks like a pamphlet', mime_type, file_size_KiB)
             return True
         else:
-            logger.debug(f"The file has a type '{mime_type}' and a large size "
-                         f'({file_size_KiB} KB), does NOT look like a pamphlet')
+            logger.debug("The file has a type '%s' and a large size "
+                         '(%s KB), does NOT look like a pamphlet', mime_type, file_size_KiB)
             return False
 
-    def _organize_by_filename_and_meta(self, old_path, prev_reason):
+    # Fetches the metadata by title (and author) from the local backends and
+    # then from the `organize_without_isbn_sources` online sources. Returns the
+    # Result and the name of the local backend that found the metadata (None if
+    # it comes from the online sources).
+    def _fetch_metadata(self, title, author=None):
+        for backend in self.local_backends:
+            result = backend.fetch(title=title, author=author)
+            if result.returncode == 0:
+                logger.debug("Found metadata in '%s'", backend.name)
+                return result, backend.name
+        backend = CalibreMetadataBackend(self.organize_without_isbn_sources,
+                                         self.fetch_metadata_command, source_scheduler)
+        return backend.fetch(title=title, author=author), None
+
+    def _organize_by_filename_and_meta(self, old_path, prev_reason, file_result):
         # TODO: important, return nothing?
         prev_reason = f'{prev_reason}; '
-        logger.debug(f"Organizing '{old_path}' by non-ISBN metadata and "
-                     "filename...")
+        logger.debug("Organizing '%s' by non-ISBN metadata and "
+                     "filename...", old_path)
         # TODO: check that it does the same as to_lower() @ https://bit.ly/2w0O5LN
         lowercase_name = os.path.basename(old_path).lower()
+        filename_class = self.patterns.classify_filename(lowercase_name)
         # TODO: check that it does the same as
         # `if [[ "$WITHOUT_ISBN_IGNORE" != "" &&
         # "$lowercase_name" =~ $WITHOUT_ISBN_IGNORE ]]`
         # Ref.: https://bit.ly/2HJTzfg
-        if self.without_isbn_ignore and re.match(self.without_isbn_ignore,
-                                                 lowercase_name):
-            parts = []
-            # TODO: check that it does the same as
-            # `matches="[$(echo "$lowercase_name" |
-            # grep -oE "$WITHOUT_ISBN_IGNORE" | paste -sd';')]`
+        if filename_class[0] == 'ignored':
             # NOTE: they are using grep -oE
             # Ref.: https://bit.ly/2jj2Vnz
-            matches = re.finditer(self.without_isbn_ignore, lowercase_name)
-            for i, match in enumerate(matches):
-                parts.append(match.group())
-            matches = ';'.join(parts)
+            matches = self.patterns.get_matches(filename_class[1], lowercase_name)
             logger.debug('Parts of the filename match the ignore regex: '
-                         f'[{matches}]')
-            skip_file(old_path,
-                      f'{prev_reason}File matches the ignore regex ({matches})')
+                         '[%s]', matches)
+            self._skip_file(file_result, old_path,
+                            f'{prev_reason}File matches the ignore regex ({matches})')
             return
         else:
             logger.debug('File does not match the ignore regex, continuing...')
-        is_p = self._is_pamphlet(file_path=old_path)
+        is_p = self._is_pamphlet(file_path=old_path, filename_class=filename_class)
         if is_p is True:
-            logger.debug(f"File '{old_path}' looks like a pamphlet!")
+            logger.debug("File '%s' looks like a pamphlet!", old_path)
             if self.output_folder_pamphlets:
-                new_path = unique_filename(self.output_folder_pamphlets,
-                                           os.path.basename(old_path))
-                logger.debug(f"Moving file '{old_path}' to '{new_path}'!")
-                ok_file(old_path, new_path)
-                move_or_link_file(old_path, new_path, self.dry_run, self.symlink_only)
+                with move_executor.lock:
+                    new_path = unique_filename(self.output_folder_pamphlets,
+                                               os.path.basename(old_path))
+                    logger.debug("Moving file '%s' to '%s'!", old_path, new_path)
+                    move_or_link_file(old_path, new_path, self.dry_run, self.symlink_only,
+                                      self.hardlink_only)
+                self._ok_file(file_result, old_path, new_path, 'pamphlet')
             else:
                 logger.debug('Output folder for pamphlet files is not set, '
                              'skipping...')
-                skip_file(old_path, 'No pamphlet folder specified')
+                self._skip_file(file_result, old_path, 'No pamphlet folder specified')
             return
         elif is_p is False:
-            logger.debug(f"File '{old_path}' doesn't look like a pamphlet")
+            logger.debug("File '%s' doesn't look like a pamphlet", old_path)
         else:
-            logger.debug(f"Couldn't determine if file '{old_path}' is a pamphlet")
+            logger.debug("Couldn't determine if file '%s' is a pamphlet", old_path)
         if not self.output_folder_uncertain:
             # logger.debug('No uncertain folder specified, skipping...')
-            skip_file(old_path, 'No uncertain folder specified')
+            self._skip_file(file_result, old_path, 'No uncertain folder specified')
             return
         result = get_ebook_metadata(old_path)
         if result.stderr:
             logger.error(f'`ebook-meta` returns an error: {result.stderr}')
-        ebookmeta = result.stdout
         logger.debug('Ebook metadata:')
-        logger.debug(ebookmeta)
-        tmpmfile = tempfile.mkstemp(suffix='.txt')[1]
-        logger.debug(f'Created temporary file for metadata downloads {tmpmfile}')
-
-        # NOTE: tmp file is removed in move_or_link_ebook_file_and_metadata()
-        def finisher(fetch_method, ebookmeta, metadata):
+        logger.debug(result.stdout)
+        ebookmeta = BookMetadata(result.stdout)
+        # Ref.: https://bit.ly/2jlyBIR
+        filename = os.path.splitext(os.path.basename(old_path))[0]
+        filename_title, filename_author = guess_title_and_author(filename, self.tokens_to_ignore)
+
+        def finisher(fetch_method, metadata, source=None):
+            if source:
+                # The metadata was found by a local backend
+                fetch_method = f'{fetch_method} ({source})'
+            if self.title_index and source != self.title_index.name:
+                self.title_index.add(BookMetadata(metadata).get('Title'), metadata)
+                self.title_index.add(filename_title, metadata)
             logger.debug('Successfully fetched metadata: ')
-            logger.debug('Adding additional metadata to the end of the metadata '
-                         'file...')
-            more_metadata = '\nOld file path       : {}\n' \
-                            'Meta fetch method   : {}\n'.format(old_path,
-                                                                fetch_method)
-            lines = []
-            for line in ebookmeta.splitlines():
-                # TODO: remove next line if simpler version does the same thing
-                # lines.append(re.sub('^(.+[^ ]) ([ ]+):', 'OF \1 \2', line))
-                lines.append(re.sub(r'^(.+):', r'OF \1:', line))
-            ebookmeta = '\n'.join(lines)
-            with open(tmpmfile, 'a') as f:
-                f.write(more_metadata)
-                f.write(ebookmeta)
-            isbns = find_isbns(metadata + ebookmeta, **self.__dict__)
+            logger.debug('Adding additional metadata to the fetched metadata...')
+            # The ISBN is searched in all the fetched metadata and the metadata
+            # of the original file
+            isbns = find_isbns(f'{metadata}\n{result.stdout}', **self.__dict__)
+            metadata = BookMetadata(metadata)
+            metadata['Old file path'] = old_path
+            metadata['Meta fetch method'] = fetch_method
+            metadata.update(ebookmeta, prefix='OF ')
             if isbns:
                 # TODO: important, there can be more than one isbn
-                isbn = isbns.split(self.isbn_ret_separator)[0]
-                with open(tmpmfile, 'a') as f:
-                    f.write(f'\nISBN                : {isbn}')
+                metadata['ISBN'] = isbns.split(self.isbn_ret_separator)[0]
             else:
-                logger.debug(f'No isbn found for file {old_path}')
-            logger.debug(f"Organizing '{old_path}' (with '{tmpmfile}')...")
+                logger.debug('No isbn found for file %s', old_path)
+            logger.debug("Organizing '%s'...", old_path)
             new_path = move_or_link_ebook_file_and_metadata(
                 new_folder=self.output_folder_uncertain,
-                current_ebook_path=old_path,
-                current_metadata_path=tmpmfile, **self.__dict__)
-            ok_file(old_path, new_path)
+                current_ebook_path=old_path, metadata=metadata, **self.__dict__)
+            self._ok_file(file_result, old_path, new_path, fetch_method)
 
-        title = search_meta_val(ebookmeta, 'Title')
-        author = search_meta_val(ebookmeta, 'Author(s)')
+        title = ebookmeta.get('Title', '')
+        author = ebookmeta.get('Author(s)', '')
         # Equivalent to (in bash):
         # if [[ "${title//[^[:alpha:]]/}" != "" && "$title" != "unknown" ]]
         # Ref.: https://bit.ly/2HDHZGm
@@ -1626,188 +3822,191 @@ class OrganizeEbooks:
             logger.debug('There is a relatively normal-looking title, '
                          'searching for metadata...')
             if re.sub(r'\s', '', author) != '' and author != 'unknown':
-                logger.debug(f'Trying to fetch metadata by title "{title}" '
-                             f'and author "{author}"...')
-                options = f'--verbose --title="{title}" --author="{author}"'
+                logger.debug('Trying to fetch metadata by title "%s" '
+                             'and author "%s"...', title, author)
                 # TODO: check that fetch_metadata() can also return an empty string
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                metadata, source = self._fetch_metadata(title=title, author=author)
                 if metadata.returncode == 0:
-                    # TODO: they are writing outside the if, https://bit.ly/2FyIiwh
-                    with open(tmpmfile, 'a') as f:
-                        # TODO: do we write even if metadata can be empty?
-                        # TODO: important, stdout (only one 1 result) or stderr (all results)
-                        f.write(metadata.stdout)
-                    finisher('title&author', ebookmeta, metadata.stdout)
+                    # TODO: important, stdout (only one 1 result) or stderr (all results)
+                    finisher('title&author', metadata.stdout, source)
                     return
-                logger.debug(f"Trying to swap places - author '{title}' and "
-                             f"title '{author}'...")
-                options = f'--verbose --title="{author}" --author="{title}"'
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                logger.debug("Trying to swap places - author '%s' and "
+                             "title '%s'...", title, author)
+                metadata, source = self._fetch_metadata(title=author, author=title)
                 if metadata.returncode == 0:
-                    # NOTE: they are writing outside the if, https://bit.ly/2Kt78kX
-                    with open(tmpmfile, 'a') as f:
-                        # TODO: do we write even if metadata can be empty?
-                        f.write(metadata.stdout)
-                    finisher('rev-title&author', ebookmeta, metadata.stdout)
+                    finisher('rev-title&author', metadata.stdout, source)
                     return
-                logger.debug(f'Trying to fetch metadata only by title {title}...')
-                options = f'--verbose --title="{title}"'
-                metadata = fetch_metadata(self.organize_without_isbn_sources,
-                                          options)
+                logger.debug('Trying to fetch metadata only by title %s...', title)
+                metadata, source = self._fetch_metadata(title=title)
                 if metadata.returncode == 0:
-                    # NOTE: they are writing outside the if, https://bit.ly/2vZeFES
-                    with open(tmpmfile, 'a') as f:
-                        # TODO: do we write even if metadata can be empty?
-                        f.write(metadata.stdout)
-                    finisher('title', ebookmeta, metadata.stdout)
+                    finisher('title', metadata.stdout, source)
                     return
-        # TODO: tokenize basename
-        # filename="$(basename "${old_path%.*}" | tokenize)"
-        # Ref.: https://bit.ly/2jlyBIR
-        filename = os.path.splitext(os.path.basename(old_path))[0]
-        logger.debug(f'Trying to fetch metadata only by filename {filename}...')
-        options = f'--verbose --title="{filename}"'
-        metadata = fetch_metadata(self.organize_without_isbn_sources, options)
+        metadata, source = Result(returncode=1), None
+        if filename_title:
+            logger.debug('Trying to fetch metadata only by filename %s (title "%s" and '
+                         'author "%s")...', filename, filename_title, filename_author)
+            metadata, source = self._fetch_metadata(title=filename_title,
+                                                    author=filename_author)
+        if metadata.returncode != 0 and filename_title != filename:
+            logger.debug('Trying to fetch metadata only by filename %s...', filename)
+            metadata, source = self._fetch_metadata(title=filename)
         if metadata.returncode == 0:
-            # TODO: they are writing outside the if, https://bit.ly/2I3GH6X
-            with open(tmpmfile, 'a') as f:
-                # TODO: do we write even if metadata can be empty?
-                f.write(filename)
-            finisher('title', ebookmeta, filename)
+            finisher('title', metadata.stdout, source)
             return
-        logger.debug('Could not find anything, removing the temp file '
-                     f'{tmpmfile}...')
-        remove_file(tmpmfile)
-        skip_file(old_path, f'{prev_reason}Insufficient or wrong: 1) filename or 2) metadata')
+        logger.debug('Could not find anything')
+        self._skip_file(file_result, old_path,
+                        f'{prev_reason}Insufficient or wrong: 1) filename or 2) metadata')
 
-    def _organize_by_isbns(self, file_path, isbns):
+    def _organize_by_isbns(self, file_path, isbns, file_result):
         # TODO: important, returns nothing?
         isbn_sources = self.isbn_metadata_fetch_order
         if not isbn_sources:
             # NOTE: If you use Calibre versions that are older than 2.84, it's
             # required to manually set the following option to an empty string.
             isbn_sources = []
-        for i, isbn in enumerate(isbns.split(self.isbn_ret_separator), start=1):
+        file_result.isbns = tuple(isbns.split(self.isbn_ret_separator))
+        # NOTE: the ISBN-10 and ISBN-13 of the same book are only fetched once
+        for i, isbn in enumerate(dedupe_isbns(file_result.isbns), start=1):
             if i > self.max_isbns:
-                logger.debug(f"Only testing the first {self.max_isbns} ISBNs")
+                logger.debug("Only testing the first %s ISBNs", self.max_isbns)
                 break
-            tmp_file = tempfile.mkstemp(suffix='.txt')[1]
-            logger.debug(f"Trying to fetch metadata for ISBN '{isbn}' into "
-                         f"temp file '{tmp_file}'...")
+            logger.debug("Trying to fetch metadata for ISBN '%s'...", isbn)
 
             # IMPORTANT: as soon as we find metadata from one source, we return
-            for isbn_source in isbn_sources:
-                # Remove whitespaces around the isbn source
-                isbn_source = isbn_source.strip()
-                # Check if there are spaces in the arguments, and if it is the
-                # case enclose the arguments in quotation marks
-                # e.g. WorldCat xISBN --> "WorldCat xISBN"
-                if ' ' in isbn_source:
-                    isbn_source = f'"{isbn_source}"'
-                logger.debug(f"Fetching metadata from '{isbn_source}' sources...")
-                options = f'--verbose --isbn={isbn}'
-                result = fetch_metadata(isbn_source, options)
-                metadata = result.stdout
+            # NOTE: the local backends (e.g. the local catalog) are tried first
+            backends = self.local_backends + \
+                [CalibreMetadataBackend(isbn_source, self.fetch_metadata_command,
+                                        source_scheduler)
+                 for isbn_source in isbn_sources if source_scheduler.is_available(isbn_source)]
+            for backend in backends:
+                isbn_source = backend.name
+                logger.debug("Fetching metadata from '%s' sources...", isbn_source)
+                result = backend.fetch(isbn=isbn)
+                metadata = BookMetadata(result.stdout)
                 if metadata:
-                    with open(tmp_file, 'w') as f:
-                        f.write(metadata)
-
-                    # NOTE: is it necessary to sleep after fetching the
-                    # metadata from online sources like they do? The rest of the
-                    # code here is executed once fetch_metadata() is done
+                    # NOTE: they sleep after fetching the metadata from online
+                    # sources, the requests are now paced by `source_scheduler`
                     # Ref.: https://bit.ly/2vV9MfU
-                    time.sleep(0.1)
                     logger.debug('Successfully fetched metadata')
-                    logger.debug(f'Fetched metadata:{metadata}')
-
-                    logger.debug('Adding additional metadata to the end of the '
-                                 'metadata file...')
-                    more_metadata = 'ISBN                : {}\n' \
-                                    'All found ISBNs     : {}\n' \
-                                    'Old file path       : {}\n' \
-                                    'Metadata source     : {}'.format(
-                        isbn, isbns.replace('\n', ','), file_path, isbn_source)
-                    logger.debug(more_metadata)
-                    with open(tmp_file, 'a') as f:
-                        f.write(more_metadata)
-
-                    logger.debug(f"Organizing '{file_path}' (with {tmp_file})...")
+                    logger.debug('Fetched metadata:%s', result.stdout)
+
+                    logger.debug('Adding additional metadata to the fetched metadata...')
+                    metadata['ISBN'] = isbn
+                    metadata['All found ISBNs'] = isbns.replace('\n', ',')
+                    metadata['Old file path'] = file_path
+                    metadata['Metadata source'] = isbn_source
+
+                    if self.title_index and backend is not self.title_index:
+                        self.title_index.add(metadata.get('Title'), result.stdout)
+                        filename = os.path.splitext(os.path.basename(file_path))[0]
+                        self.title_index.add(guess_title_and_author(
+                            filename, self.tokens_to_ignore)[0], result.stdout)
+                    logger.debug("Organizing '%s'...", file_path)
                     new_path = move_or_link_ebook_file_and_metadata(
                         new_folder=self.output_folder,
-                        current_ebook_path=file_path,
-                        current_metadata_path=tmp_file, **self.__dict__)
+                        current_ebook_path=file_path, metadata=metadata,
+                        **self.__dict__)
 
-                    ok_file(file_path, new_path)
-                    # NOTE: `tmp_file` was already removed in
-                    # move_or_link_ebook_file_and_metadata()
+                    self._ok_file(file_result, file_path, new_path, isbn_source)
                     return
 
-            logger.debug(f'Removing temp file {tmp_file}...')
-            remove_file(tmp_file)
-
         isbns = isbns.replace('\n', ' - ')
         if self.organize_without_isbn:
             logger.debug('Could not organize via the found ISBNs, organizing '
                          'by filename and metadata instead...')
             self._organize_by_filename_and_meta(
                 old_path=file_path,
-                prev_reason=f"Could not fetch metadata for ISBNs: {isbns}")
+                prev_reason=f"Could not fetch metadata for ISBNs: {isbns}",
+                file_result=file_result)
         else:
             logger.debug('Organization by filename and metadata is not turned '
                          'on, giving up...')
-            skip_file(file_path, f'Could not fetch metadata for ISBNs: {isbns}; '
-                                 f'Non-ISBN organization disabled')
+            self._skip_file(file_result, file_path,
+                            f'Could not fetch metadata for ISBNs: {isbns}; '
+                            f'Non-ISBN organization disabled')
+
+    # Moves a corrupt file to `output_folder_corrupt` (if given) along with a
+    # metadata file that has the reason of the corruption
+    def _handle_corrupt_file(self, file_path, file_err, file_result):
+        logger.debug("File '%s' is corrupt with error: %s", file_path, file_err)
+        if self.output_folder_corrupt:
+            with move_executor.lock:
+                new_path = unique_filename(self.output_folder_corrupt,
+                                           file_path.name)
+                move_or_link_file(file_path, new_path, self.dry_run,
+                                  self.symlink_only, self.hardlink_only)
+            # NOTE: do we add the meta extension directly to new_path (which
+            # already has an extension); thus if new_path='/test/path/book.pdf'
+            # then new_metadata_path='/test/path/book.pdf.meta' or should it be
+            # new_metadata_path='/test/path/book.meta'
+            # Ref.: https://bit.ly/2I6K3pW
+            """
+            new_metadata_path = f'{os.path.splitext(new_path)[0]}.' \
+                                f'{self.output_metadata_extension}'
+            """
+            # NOTE: no unique name for matadata path (and other places)
+            new_metadata_path = f'{new_path}.{self.output_metadata_extension}'
+            logger.debug('Saving original filename to %s...', new_metadata_path)
+            metadata = f'Corruption reason   : {file_err}\n' \
+                       f'Old file path       : {file_path}'
+            if move_executor.plan is not None:
+                move_executor.plan.add_sidecar(new_metadata_path, metadata)
+            elif not self.dry_run:
+                save_metadata_file(new_metadata_path, metadata)
+            self._fail_file(file_result, file_path,
+                            f'File is corrupt: {file_err}', new_path)
+        else:
+            logger.debug('Output folder for corrupt files is not set, doing '
+                         'nothing')
+            self._fail_file(file_result, file_path, f'File is corrupt: {file_err}')
+
+    # Routes a file before its ISBN search with cheap facts only (filename and
+    # MIME type, no subprocess). Returns why the ISBN search can be skipped,
+    # i.e. the file is handled like a file without ISBNs, or None if the file
+    # needs to be searched:
+    # - its MIME type matches `isbn_ignored_files` (nothing is searched
+    #   anyway besides the filename)
+    # - its filename matches `without_isbn_ignore` (e.g. periodicals)
+    # - its filename matches `pamphlet_included_files` (e.g. images) and OCR
+    #   is disabled
+    # The files with ISBNs in their filenames are never routed.
+    def _route_file(self, file_path):
+        basename = os.path.basename(file_path)
+        if find_isbns(basename, **self.__dict__):
+            return None
+        mime_type = get_mime_type(file_path)
+        if mime_type and self.patterns.isbn_ignored_files \
+                and self.patterns.isbn_ignored_files.match(mime_type):
+            return f"The file type '{mime_type}' is ignored"
+        classification, _ = self.patterns.classify_filename(basename.lower())
+        if classification == 'ignored':
+            return 'The filename matches the ignore regex'
+        if classification == 'pamphlet' and self.ocr_enabled == 'false':
+            return 'The filename matches the pamphlet include regex'
+        return None
 
+    # Returns the FileResult of the organization of the given file along with
+    # the time taken by its main stages
     def _organize_file(self, file_path):
+        file_result = FileResult(file_path)
         suffix = f' [{Path(file_path).suffix}] ' if len(Path(file_path).name) > 100 else ' '
         fp = normalize("NFKC", str(file_path))
         logger.info(f'Processing{suffix}{fp[:100]}...')
         ext = Path(file_path).suffix[1:]  # Remove the dot from extension
-        if self.skip_archives and ext != 'epub' and re.match(self.tested_archive_extensions, ext):
-            logger.debug(f"The file has a '{ext}' extension, skipping it since it is an archive!")
-            skip_file(file_path, 'File is an archive!')
-            return 0
+        if self.skip_archives and ext != 'epub' and self.patterns.tested_archive_extensions.match(ext):
+            logger.debug("The file has a '%s' extension, skipping it since it is an archive!", ext)
+            self._skip_file(file_result, file_path, 'File is an archive!')
+            return file_result
         if self.corruption_check != 'false':
+            start = time.perf_counter()
             file_err = check_file_for_corruption(file_path,
-                                                 self.tested_archive_extensions)
+                                                 self.patterns.tested_archive_extensions)
+            file_result.timings['corruption_check'] = time.perf_counter() - start
         else:
             file_err = None
             logger.debug('Skipping corruption check')
         if file_err:
-            logger.debug(f"File '{file_path}' is corrupt with error: {file_err}")
-            if self.output_folder_corrupt:
-                new_path = unique_filename(self.output_folder_corrupt,
-                                           file_path.name)
-                move_or_link_file(file_path, new_path, self.dry_run,
-                                  self.symlink_only)
-                # NOTE: do we add the meta extension directly to new_path (which
-                # already has an extension); thus if new_path='/test/path/book.pdf'
-                # then new_metadata_path='/test/path/book.pdf.meta' or should it be
-                # new_metadata_path='/test/path/book.meta'
-                # Ref.: https://bit.ly/2I6K3pW
-                """
-                new_metadata_path = f'{os.path.splitext(new_path)[0]}.' \
-                                    f'{self.output_metadata_extension}'
-                """
-                # NOTE: no unique name for matadata path (and other places)
-                new_metadata_path = f'{new_path}.{self.output_metadata_extension}'
-                logger.debug(f'Saving original filename to {new_metadata_path}...')
-                if not self.dry_run:
-                    metadata = f'Corruption reason   : {file_err}\n' \
-                               f'Old file path       : {file_path}'
-                    with open(new_metadata_path, 'w') as f:
-                        f.write(metadata)
-                fail_file(file_path, f'File is corrupt: {file_err}', new_path)
-            else:
-                logger.debug('Output folder for corrupt files is not set, doing '
-                             'nothing')
-                fail_file(file_path, f'File is corrupt: {file_err}')
-        elif self.corruption_check == 'check_only':
-            logger.debug('We are only checking for corruption, do not continue '
-                         'organising...')
-            skip_file(file_path, 'File appears OK')
+            self._handle_corrupt_file(file_path, file_err, file_result)
         else:
             # NOTE: important, if html has ISBN it will be considered as an ebook
             # self._is_pamphlet() needs to be called before search...()
@@ -1815,30 +4014,42 @@ class OrganizeEbooks:
                 logger.debug('File passed the corruption test, looking for ISBNs...')
             else:
                 logger.debug('Looking for ISBNs...')
-            isbns = search_file_for_isbns(file_path, **self.__dict__)
+            route = self._route_file(file_path)
+            if route:
+                logger.debug('%s, skipping the ISBN search', route)
+                isbns, no_isbn_reason = '', 'ISBN search skipped'
+            else:
+                start = time.perf_counter()
+                isbns = search_file_for_isbns(file_path, **self.__dict__)
+                file_result.timings['isbn_search'] = time.perf_counter() - start
+                no_isbn_reason = 'No ISBNs found'
+            start = time.perf_counter()
             if isbns:
-                logger.debug(f"Organizing '{file_path}' by ISBNs\n{isbns}")
-                self._organize_by_isbns(file_path, isbns)
+                logger.debug("Organizing '%s' by ISBNs\n%s", file_path, isbns)
+                self._organize_by_isbns(file_path, isbns, file_result)
             elif self.organize_without_isbn:
-                logger.debug(f"No ISBNs found for '{file_path}', organizing by "
-                             'filename and metadata...')
+                logger.debug("No ISBNs for '%s', organizing by "
+                             'filename and metadata...', file_path)
                 self._organize_by_filename_and_meta(
-                    old_path=file_path, prev_reason='No ISBNs found')
+                    old_path=file_path, prev_reason=no_isbn_reason,
+                    file_result=file_result)
             else:
-                skip_file(file_path,
-                          'No ISBNs found; Non-ISBN organization disabled')
+                self._skip_file(file_result, file_path,
+                                f'{no_isbn_reason}; Non-ISBN organization disabled')
+            file_result.timings['organize'] = time.perf_counter() - start
         logger.debug('=====================================================')
-        return 0
+        return file_result
 
     def _update(self, **kwargs):
         logger.debug('Updating attributes for organizer...')
         if self.output_folder != os.getcwd():
-            logger.debug(f'output_folder: {os.getcwd()} [cwd] -> {self.output_folder}')
+            logger.debug('output_folder: %s [cwd] -> %s', os.getcwd(), self.output_folder)
         for k, v in self.__dict__.items():
             new_val = kwargs.get(k)
             if new_val and v != new_val:
-                logger.debug(f'{k}: {v} -> {new_val}')
+                logger.debug('%s: %s -> %s', k, v, new_val)
                 self.__setattr__(k, new_val)
+        self.patterns = PatternRegistry(**self.__dict__)
 
     def _check_folders(self):
         folders = [self.folder_to_organize, self.output_folder, self.output_folder_uncertain,
@@ -1849,21 +4060,68 @@ class OrganizeEbooks:
                 return 1
         return 0
 
-    def organize(self, folder_to_organize, output_folder=os.getcwd(), **kwargs):
-        if folder_to_organize is None:
-            logger.error(red("\nerror: the following arguments are required: folder_to_organize"))
-            return 1
-        self.folder_to_organize = folder_to_organize
+    # The metadata files are saved in one MetadataStore per folder if
+    # `metadata_sink` is 'jsonl' or 'sqlite' (nothing is written when
+    # planning or with `dry_run`)
+    def _open_metadata_store(self):
+        move_executor.metadata_store = None
+        if self.metadata_sink != 'files':
+            move_executor.metadata_store = MetadataStore(self.metadata_sink,
+                                                         self.metadata_sink_batch)
+
+    # Writes the metadata files still buffered in the MetadataStore
+    def _close_metadata_store(self):
+        if move_executor.metadata_store is not None:
+            move_executor.metadata_store.close()
+            move_executor.metadata_store = None
+
+    # Sets the options of the organization. Returns 0 if they are valid, 1
+    # otherwise.
+    def _setup(self, output_folder=os.getcwd(), **kwargs):
         self.output_folder = output_folder
         self._update(**kwargs)
         if self._check_folders():
             return 1
+        scratch.configure(self.scratch_dir, self.scratch_quota_mib)
+        move_executor.clear()
+        if self.plan_file:
+            mode = 'symlink' if self.symlink_only else 'hardlink' if self.hardlink_only else 'move'
+            move_executor.plan = MovePlan(self.plan_file, mode)
+            logger.info(f'Planning the organization in {self.plan_file}, no file will be moved\n')
+        self._open_metadata_store()
+        source_scheduler.configure(self.metadata_source_rate, self.metadata_source_burst)
+        self.local_backends = list(self.metadata_backends)
+        if self.metadata_catalog:
+            if not Path(self.metadata_catalog).is_file():
+                logger.error(red(f"Metadata catalog doesn't exist: {self.metadata_catalog}"))
+                return 1
+            self.local_backends.append(LocalMetadataCatalog(self.metadata_catalog))
+        self.title_index = None
+        if self.title_index_file:
+            self.title_index = TitleIndex(self.title_index_file,
+                                          tokens_to_ignore=self.tokens_to_ignore)
+            self.local_backends.append(self.title_index)
+        self.cost_model = FileCostModel(self.cost_history_file)
+        if self.audit_sample and not re.match(r'^[0-9]+(\.[0-9]+)?%?$', str(self.audit_sample)):
+            logger.error(red(f'Invalid audit sample: {self.audit_sample} (e.g. 500 or 5%)'))
+            return 1
+        if self.corruption_check == 'check_only':
+            logger.info('We are only checking for corruption\n')
+        return 0
+
+    # Returns the sorted list of files to organize or None if the options are
+    # not valid
+    def _get_files(self, folder_to_organize, output_folder=os.getcwd(), **kwargs):
+        if folder_to_organize is None:
+            logger.error(red("\nerror: the following arguments are required: folder_to_organize"))
+            return None
+        self.folder_to_organize = folder_to_organize
+        if self._setup(output_folder, **kwargs):
+            return None
         files = []
         if is_dir_empty(folder_to_organize):
             logger.warning(yellow(f'Folder is empty: {folder_to_organize}'))
-        if self.corruption_check == 'check_only':
-            logger.info('We are only checking for corruption\n')
-        logger.debug(f"Recursively scanning '{folder_to_organize}' for files...")
+        logger.debug("Recursively scanning '%s' for files...", folder_to_organize)
         for fp in Path(folder_to_organize).rglob('*'):
             # Ignore directory and hidden files
             if Path.is_file(fp) and not fp.name.startswith('.'):
@@ -1871,15 +4129,397 @@ class OrganizeEbooks:
                 files.append(fp)
         if not files:
             logger.warning(yellow(f'No ebooks found in folder: {folder_to_organize}'))
-        logger.debug("Files sorted {}".format("in desc" if self.reverse else "in asc"))
-        files.sort(key=lambda x: x.name, reverse=self.reverse)
-        logger.debug('=====================================================')
+        if self.file_order == 'name':
+            logger.debug("Files sorted {}".format("in desc" if self.reverse else "in asc"))
+            files.sort(key=lambda x: x.name, reverse=self.reverse)
+        else:
+            logger.debug('Files sorted by estimated cost (%s)', self.file_order)
+            costs = {fp: self.cost_model.estimate(fp) for fp in files}
+            files.sort(key=costs.get, reverse=self.file_order == 'ljf')
+        return files
+
+    def _is_heavy(self, file_path):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return False
+        return bool(self.heavy_file_size_mib) and size >= self.heavy_file_size_mib * 1024 ** 2
+
+    # Organizes one file in the current thread: the programs run for a heavy
+    # file are limited to `heavy_memory_limit_mib` (see run_command())
+    def _organize_one(self, file_path):
+        # NOTE: not a good idea because then it can't find the file because its filename has been normalized
+        # e.g. Control №290-> Control No290 [FileNotFoundError]
+        # fp = normalize("NFKC", str(fp))
+        file_path = Path(file_path)
+        if not file_path.is_file():
+            # e.g. a file given explicitly in a list of files
+            file_result = FileResult(file_path)
+            self._fail_file(file_result, file_path, 'File not found')
+            return file_result
+        if self._is_past_deadline():
+            return self._skip_left_file(file_path)
+        size = file_path.stat().st_size
+        heavy = self.heavy_file_size_mib and size >= self.heavy_file_size_mib * 1024 ** 2
+        worker_lane.memory_limit_mib = self.heavy_memory_limit_mib if heavy else None
+        try:
+            file_result = self._organize_file(file_path)
+        finally:
+            worker_lane.memory_limit_mib = None
+        self.cost_model.record(file_path, size, sum(file_result.timings.values()))
+        return file_result
+
+    def _is_past_deadline(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    # Result of a file that was not organized because the time budget was
+    # exhausted
+    @staticmethod
+    def _skip_left_file(file_path):
+        logger.debug('%s: %s', TIME_BUDGET_REASON, file_path)
+        return FileResult(file_path, 'skip', TIME_BUDGET_REASON)
+
+    # Yields the files until the time budget is exhausted, the files left are
+    # then added to `files_left` (the files already queued in the threads are
+    # skipped by _organize_one() and _audit_one())
+    def _stop_at_deadline(self, files, files_left):
+        files = iter(files)
         for fp in files:
-            # NOTE: not a good idea because then it can't find the file because its filename has been normalized
-            # e.g. Control №290-> Control No290 [FileNotFoundError]
-            # fp = normalize("NFKC", str(fp))
-            self._organize_file(Path(fp))
+            if self._is_past_deadline():
+                files_left.append(fp)
+                files_left.extend(files)
+                return
+            yield fp
+
+    # Organizes the files in two lanes of threads: the heavy files (bigger than
+    # `heavy_file_size_mib`) in `heavy_jobs` threads and the other files in
+    # `jobs` threads, thus a few huge files can't hold up the small ones (nor
+    # be processed many at a time). The FileResults are yielded in the order
+    # the files are done. Only a few small files per thread are read in advance
+    # from `files` (which can be a generator) while the heavy files are queued
+    # as soon as they are read, thus they never hold up the reading of the
+    # small ones.
+    def _schedule_files(self, files):
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        fast_lane = ThreadPoolExecutor(self.jobs, thread_name_prefix='fast-lane')
+        heavy_lane = ThreadPoolExecutor(self.heavy_jobs, thread_name_prefix='heavy-lane')
+        pending = set()
+        pending_fast = set()
+
+        def wait_pending():
+            nonlocal pending
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending_fast.difference_update(done)
+            return [future.result() for future in done]
+
+        try:
+            for fp in files:
+                if self._is_heavy(fp):
+                    pending.add(heavy_lane.submit(self._organize_one, fp))
+                    continue
+                future = fast_lane.submit(self._organize_one, fp)
+                pending.add(future)
+                pending_fast.add(future)
+                while len(pending_fast) >= 2 * self.jobs:
+                    yield from wait_pending()
+            while pending:
+                yield from wait_pending()
+        finally:
+            # e.g. KeyboardInterrupt: the files not started yet are dropped
+            for future in pending:
+                future.cancel()
+            fast_lane.shutdown()
+            heavy_lane.shutdown()
+
+    # Checks one file for corruption (audit)
+    def _audit_one(self, file_path):
+        if self._is_past_deadline():
+            return self._skip_left_file(file_path)
+        file_result = FileResult(file_path)
+        ext = file_path.suffix[1:]
+        if self.skip_archives and ext != 'epub' and self.patterns.tested_archive_extensions.match(ext):
+            self._skip_file(file_result, file_path, 'File is an archive!')
+            return file_result
+        start = time.perf_counter()
+        file_err = check_file_for_corruption(file_path, self.patterns.tested_archive_extensions)
+        file_result.timings['corruption_check'] = time.perf_counter() - start
+        if file_err:
+            self._handle_corrupt_file(file_path, file_err, file_result)
+        else:
+            self._skip_file(file_result, file_path, 'File appears OK')
+        return file_result
+
+    # Checks the files for corruption in parallel when `corruption_check` is
+    # 'check_only'. The files are checked in `jobs` threads or, by default,
+    # in one thread per CPU, except on a rotational disk or a network
+    # filesystem where only AUDIT_SEEK_BOUND_JOBS files are checked at a time
+    # (in the order of their inodes on a rotational disk). With `audit_report`,
+    # only the files that changed since the previous audit are checked and
+    # with `audit_sample`, only a random sample of them.
+    def _audit_files(self, files):
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        report = AuditReport(self.audit_report) if self.audit_report else None
+        to_audit = []
+        num_unchanged = 0
+        for fp in files:
+            fp = Path(fp)
+            try:
+                stat = fp.stat()
+            except OSError:
+                file_result = FileResult(fp)
+                self._fail_file(file_result, fp, 'File not found')
+                yield file_result
+                continue
+            if report and report.is_audited(fp, stat):
+                num_unchanged += 1
+            else:
+                to_audit.append((fp, stat))
+        if num_unchanged:
+            logger.info(f'{num_unchanged} files are unchanged since the last audit')
+        if self.audit_sample:
+            sample = str(self.audit_sample)
+            if sample.endswith('%'):
+                sample_size = round(len(to_audit) * float(sample[:-1]) / 100)
+            else:
+                sample_size = int(sample)
+            import random
+            to_audit = random.sample(to_audit, min(sample_size, len(to_audit)))
+            logger.info(f'Checking a sample of {len(to_audit)} files')
+        storage_kind = get_storage_kind(to_audit[0][0]) if to_audit else None
+        if self.jobs > 1:
+            jobs = self.jobs
+        elif storage_kind in ['network', 'rotational']:
+            jobs = AUDIT_SEEK_BOUND_JOBS
+        else:
+            jobs = os.cpu_count() or 1
+        if storage_kind == 'rotational':
+            to_audit.sort(key=lambda item: item[1].st_ino)
+        logger.debug('Checking %s files with %s threads (storage: %s)', len(to_audit),
+                     jobs, storage_kind or 'unknown')
+        executor = ThreadPoolExecutor(jobs, thread_name_prefix='audit')
+        pending = {}
+
+        def wait_pending():
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fp, stat = pending.pop(future)
+                file_result = future.result()
+                if report and file_result.reason != TIME_BUDGET_REASON:
+                    status = 'corrupt' if file_result.status == 'fail' else 'ok'
+                    report.add(fp, stat, status, file_result.reason)
+                yield file_result
+
+        try:
+            for fp, stat in to_audit:
+                pending[executor.submit(self._audit_one, fp)] = (fp, stat)
+                while len(pending) >= 2 * jobs:
+                    yield from wait_pending()
+            while pending:
+                yield from wait_pending()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+            if report:
+                report.close()
+
+    # Moves (or links) a file of a plan (see MovePlan) and saves its metadata
+    # files. The entries already applied are skipped.
+    def _apply_entry(self, entry):
+        source, destination = entry['source'], entry['destination']
+        file_result = FileResult(source, metadata_source=entry['metadata_source'])
+        if os.path.lexists(destination):
+            if not os.path.exists(source) or (entry['mode'] != 'move'
+                                              and os.path.samefile(source, destination)):
+                self._save_sidecars(entry)
+                self._skip_file(file_result, source, 'Already applied')
+            else:
+                self._fail_file(file_result, source, f'Destination already exists: {destination}')
+            return file_result
+        try:
+            stat = os.stat(source)
+        except OSError:
+            self._fail_file(file_result, source, 'File not found')
+            return file_result
+        if (stat.st_size, stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+            self._fail_file(file_result, source, 'File changed since the plan')
+            return file_result
+        move_or_link_file(source, destination, self.dry_run, entry['mode'] == 'symlink',
+                          entry['mode'] == 'hardlink')
+        self._save_sidecars(entry)
+        if entry['status'] == 'fail':
+            # e.g. a corrupt file moved to `output_folder_corrupt`
+            self._fail_file(file_result, source, entry['reason'], destination)
+        else:
+            self._ok_file(file_result, source, destination, entry['metadata_source'])
+        return file_result
+
+    # Applies the entries of a plan in `jobs` threads or, by default, in one
+    # thread per CPU
+    def _apply_plan_entries(self, entries):
+        from concurrent.futures import ThreadPoolExecutor
+        jobs = self.jobs if self.jobs > 1 else os.cpu_count() or 1
+        logger.debug('Applying %s moves with %s threads', len(entries), jobs)
+        status_counts = {}
+        try:
+            with ThreadPoolExecutor(jobs, thread_name_prefix='plan') as executor:
+                for file_result in executor.map(self._apply_entry, entries):
+                    status_counts[file_result.status] = status_counts.get(file_result.status, 0) + 1
+                    yield file_result
+        finally:
+            self._close_metadata_store()
+            self._log_summary(status_counts)
+
+    # Confidence of the decision taken for a file in a plan: 'high' for the
+    # books found by ISBN and the corrupt or skipped files, 'medium' for the
+    # pamphlets and 'low' for the books found by non-ISBN metadata (moved to
+    # `output_folder_uncertain`)
+    def _get_confidence(self, file_result):
+        if file_result.status == 'ok':
+            if file_result.metadata_source == 'pamphlet':
+                return 'medium'
+            if self.output_folder_uncertain and \
+                    Path(file_result.new_path).parent == Path(self.output_folder_uncertain):
+                return 'low'
+        return 'high'
+
+    # Logs the number of files per status and the programs that were skipped
+    # because they kept failing
+    def _log_summary(self, status_counts):
+        logger.info(f"\nSummary: {status_counts.get('ok', 0)} organized, "
+                    f"{status_counts.get('skip', 0)} skipped, "
+                    f"{status_counts.get('fail', 0)} failed")
+        memo_lines = self.failure_memo.get_summary() if self.failure_memo else []
+        for line in memo_lines + source_scheduler.get_summary():
+            logger.warning(yellow(line))
+
+    def _organize_files(self, files):
+        if self.isbn_search_stats_file or self.adaptive_isbn_search:
+            self.isbn_search_stats = IsbnSearchStats(self.isbn_search_stats_file)
+        self.failure_memo = FailureMemo(self.failure_memo_file, self.failure_memo_threshold)
+        logger.debug('=====================================================')
+        status_counts = {}
+        files_left = []
+        num_files_left = 0
+        if self.time_budget:
+            logger.info(f'Time budget: {self.time_budget} s')
+            self.deadline = time.monotonic() + self.time_budget
+            files = self._stop_at_deadline(files, files_left)
+
+        def skip_files_left():
+            for fp in files_left:
+                yield self._skip_left_file(fp)
+
+        try:
+            if self.corruption_check == 'check_only':
+                file_results = self._audit_files(files)
+            elif self.jobs > 1:
+                logger.debug('Organizing the files with %s threads (%s threads for the '
+                             'files bigger than %s MiB)', self.jobs, self.heavy_jobs,
+                             self.heavy_file_size_mib)
+                file_results = self._schedule_files(files)
+            else:
+                file_results = (self._organize_one(fp) for fp in files)
+            for file_result in chain(file_results, skip_files_left()):
+                status_counts[file_result.status] = status_counts.get(file_result.status, 0) + 1
+                if file_result.reason == TIME_BUDGET_REASON:
+                    num_files_left += 1
+                if move_executor.plan is not None:
+                    move_executor.plan.add(file_result, self._get_confidence(file_result),
+                                           self.output_metadata_extension)
+                yield file_result
+        finally:
+            if move_executor.plan is not None:
+                move_executor.plan.close()
+                move_executor.plan = None
+            self._close_metadata_store()
+            if self.isbn_search_stats:
+                self.isbn_search_stats.save()
+            self.failure_memo.save()
+            if self.title_index:
+                self.title_index.save()
+            self.cost_model.save()
+            self.deadline = None
+            scratch.cleanup()
+            self._log_summary(status_counts)
+            if num_files_left:
+                logger.warning(yellow(f'{TIME_BUDGET_REASON}: {num_files_left} files were '
+                                      f'not organized (skipped with this reason)'))
+
+    # Saves the results of the organization in `self.results` (and in the
+    # results file if given) and passes them to `on_result` (if given) as soon
+    # as each file is organized
+    def _save_results(self, file_results, on_result=None):
+        self.results = []
+        for file_result in file_results:
+            self.results.append(file_result)
+            if on_result:
+                on_result(file_result)
+        if self.results_file:
+            export_results(self.results, self.results_file)
         return 0
 
+    # Saves the metadata files of an entry of a plan (unless they already exist)
+    def _save_sidecars(self, entry):
+        for path, text in entry['sidecars'].items():
+            if self.dry_run or Path(path).exists():
+                continue
+            save_metadata_file(path, text)
+
+    # Applies a plan saved with `plan_file` (see MovePlan) without searching
+    # the files again: the files are moved (or linked) to their planned
+    # destinations in parallel. The entries already applied (the file is at
+    # its destination) are skipped, thus a plan can be applied again, e.g.
+    # after an interruption. The files that changed since the plan are not
+    # moved.
+    def apply_plan(self, plan_path, on_result=None, **kwargs):
+        self._update(**kwargs)
+        move_executor.clear()
+        move_executor.plan = None
+        self._open_metadata_store()
+        entries = [entry for entry in MovePlan.load(plan_path) if entry['destination']]
+        return self._save_results(self._apply_plan_entries(entries), on_result)
+
+    # Same as organize() but yields the FileResult of each file as soon as it
+    # is organized. Nothing is yielded if the options are not valid.
+    def iter_organize(self, folder_to_organize, output_folder=os.getcwd(), **kwargs):
+        files = self._get_files(folder_to_organize, output_folder, **kwargs)
+        if files is None:
+            return
+        yield from self._organize_files(files)
+
+    # Same as organize_files() but yields the FileResult of each file as soon
+    # as it is organized
+    def iter_organize_files(self, files, output_folder=os.getcwd(), **kwargs):
+        self.folder_to_organize = None
+        if self._setup(output_folder, **kwargs):
+            return
+        yield from self._organize_files(files)
+
+    # The FileResult of each file is saved in `self.results` and passed to
+    # `on_result` (if given) as soon as the file is organized
+    def organize(self, folder_to_organize, output_folder=os.getcwd(),
+                 on_result=None, **kwargs):
+        files = self._get_files(folder_to_organize, output_folder, **kwargs)
+        if files is None:
+            return 1
+        return self._save_results(self._organize_files(files), on_result)
+
+    # Organizes the given files (any iterable of paths, e.g. a generator that
+    # reads them from a pipe) in the given order, without scanning any folder.
+    # Each file is organized as soon as it is received.
+    def organize_files(self, files, output_folder=os.getcwd(), on_result=None,
+                       **kwargs):
+        self.folder_to_organize = None
+        if self._setup(output_folder, **kwargs):
+            return 1
+        return self._save_results(self._organize_files(files), on_result)
+
+
+move_executor = MoveExecutor()
+scratch = ScratchWorkspace()
+source_scheduler = SourceScheduler()
+# State of the thread that organizes a file, see OrganizeEbooks._organize_one()
+worker_lane = threading.local()
 
 organizer = OrganizeEbooks()
@@ -11,9 +11,11 @@ import argparse
 import codecs
 import logging
 import os
+import shutil
+import sys
 
 from organize_ebooks import __version__, lib
-from organize_ebooks.lib import namespace_to_dict, organizer, setup_log, blue, green, red, yellow
+from organize_ebooks.lib import namespace_to_dict, setup_log, blue, green, red, yellow
 
 # import ipdb
 
@@ -134,6 +136,12 @@ def add_general_options(parser, add_opts=None, remove_opts=None,
             '-s', '--symlink-only', dest='symlink_only', action='store_true',
             help='Instead of moving the ebook files, create symbolic links to '
                  'them.')
+    if checker.check('hardlink-only'):
+        parser_general_group.add_argument(
+            '--hardlink-only', dest='hardlink_only', action='store_true',
+            help='Instead of moving the ebook files, create hard links to them. '
+                 'Symbolic links are created for the files that are on another '
+                 'filesystem than the output folder.')
     if checker.check('keep-metadata'):
         parser_general_group.add_argument(
             '-k', '--keep-metadata', dest='keep_metadata', action='store_true',
@@ -149,6 +157,31 @@ def add_general_options(parser, add_opts=None, remove_opts=None,
             help='If this is enabled, the files will be sorted in reverse (i.e. '
                  'descending) order. By default, they are sorted in ascending '
                  'order.')
+    if checker.check('file-order'):
+        parser_general_group.add_argument(
+            '--file-order', dest='file_order', choices=['name', 'cost', 'ljf'],
+            default=lib.FILE_ORDER,
+            help='Order in which the files of the folder are organized: `name` sorts '
+                 'them by filename (see `reverse`), `cost` organizes the cheapest '
+                 'files first (e.g. with `time-budget`) and `ljf` the most expensive '
+                 'files first (longest job first, useful with `jobs`). The cost is '
+                 'estimated from the extension and the size of each file (and from '
+                 '`cost-history` if given).' + get_default_message(lib.FILE_ORDER))
+    if checker.check('cost-history'):
+        parser_general_group.add_argument(
+            '--cost-history', dest='cost_history_file', metavar='PATH',
+            default=lib.COST_HISTORY_FILE,
+            help='JSON file where the time spent on the files of each extension is '
+                 'saved between runs to better estimate the cost of the files.'
+                 + get_default_message(lib.COST_HISTORY_FILE))
+    if checker.check('time-budget'):
+        parser_general_group.add_argument(
+            '--time-budget', dest='time_budget', metavar='SECONDS', type=float,
+            default=lib.TIME_BUDGET,
+            help='Stop starting new files after this number of seconds. The files '
+                 'already started are finished and the files left are reported as '
+                 f'skipped with the reason "{lib.TIME_BUDGET_REASON}".'
+                 + get_default_message(lib.TIME_BUDGET))
     if checker.check('log-level'):
         parser_general_group.add_argument(
             '--log-level', dest='logging_level',
@@ -157,8 +190,14 @@ def add_general_options(parser, add_opts=None, remove_opts=None,
     if checker.check('log-format'):
         parser_general_group.add_argument(
             '--log-format', dest='logging_formatter',
-            choices=['console', 'only_msg', 'simple',], default=lib.LOGGING_FORMATTER,
-            help='Set logging formatter.' + get_default_message(lib.LOGGING_FORMATTER))
+            choices=['console', 'only_msg', 'simple', 'jsonl'], default=lib.LOGGING_FORMATTER,
+            help='Set logging formatter. `jsonl` saves each log record as a JSON '
+                 'line.' + get_default_message(lib.LOGGING_FORMATTER))
+    if checker.check('log-file'):
+        parser_general_group.add_argument(
+            '--log-file', dest='log_file', metavar='PATH',
+            help='Save the logs in this file instead of printing them on the '
+                 'terminal. Useful with `--log-format jsonl` for high-volume runs.')
     return parser_general_group
 
 
@@ -181,6 +220,37 @@ def print_(msg):
         print(msg)
 
 
+# Prints the result of the organization of a file as one JSON line on stdout
+# (the logs are written on stderr), as soon as the file is organized
+def print_result(file_result):
+    import json
+    sys.stdout.write(json.dumps(file_result.to_dict(), ensure_ascii=False) + '\n')
+    sys.stdout.flush()
+
+
+# Yields the paths read from a file ('-' for stdin), one per line or separated
+# by NUL characters (e.g. `find -print0`). The paths are yielded as soon as
+# they are read, thus the files can be organized while the list is written.
+def read_file_list(file_path, null_separator=False):
+    f = sys.stdin if file_path == '-' else open(file_path, 'r')
+    try:
+        if null_separator:
+            rest = ''
+            for chunk in iter(lambda: f.read(65536), ''):
+                *paths, rest = (rest + chunk).split('\0')
+                yield from filter(None, paths)
+            if rest:
+                yield rest
+        else:
+            for line in f:
+                path = line.rstrip('\n')
+                if path:
+                    yield path
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
 # Ref.: https://stackoverflow.com/a/4195302/14664104
 def required_length(nmin, nmax, is_list=True):
     class RequiredLength(argparse.Action):
@@ -202,7 +272,8 @@ def required_length(nmin, nmax, is_list=True):
 
 
 def setup_argparser():
-    width = os.get_terminal_size().columns - 5
+    # NOTE: shutil.get_terminal_size() also works when stdout is not a terminal
+    width = shutil.get_terminal_size().columns - 5
     name_input = 'folder_to_organize'
     usage_msg = blue(f'%(prog)s [OPTIONS] {{{name_input}}}')
     desc_msg = 'Automatically organize folders with potentially huge amounts of ' \
@@ -227,8 +298,11 @@ def setup_argparser():
     convert_group = parser.add_argument_group(title=yellow('Convert-to-txt options'))
     convert_group.add_argument(
         '--djvu', dest='djvu_convert_method',
-        choices=['djvutxt', 'ebook-convert'], default=lib.DJVU_CONVERT_METHOD,
-        help='Set the conversion method for djvu documents.'
+        choices=['djvused', 'djvutxt', 'ebook-convert'], default=lib.DJVU_CONVERT_METHOD,
+        help='''Set the conversion method for djvu documents. With 'djvused', only
+             the text of the first and last pages (see `ocr-only-first-last-pages`)
+             is extracted at first and the whole document is converted with
+             djvutxt only if no ISBNs are found there.'''
              + get_default_message(lib.DJVU_CONVERT_METHOD))
     convert_group.add_argument(
         '--epub', dest='epub_convert_method',
@@ -318,6 +392,72 @@ def setup_argparser():
                 Calibre versions that are older than 2.84, it's required to
                 manually set this option to an empty string.'''
              + get_default_message(lib.ISBN_METADATA_FETCH_ORDER))
+    find_group.add_argument(
+        '--search-stats', dest='isbn_search_stats_file', metavar='PATH',
+        default=lib.ISBN_SEARCH_STATS_FILE,
+        help='''JSON file where the statistics (hit rate and mean latency) of the
+             ISBN search steps are saved per MIME type between runs.'''
+             + get_default_message(lib.ISBN_SEARCH_STATS_FILE))
+    find_group.add_argument(
+        '--adaptive-search', dest='adaptive_isbn_search', action='store_true',
+        help='''For each MIME type, try the ISBN search steps (`ebook-meta`,
+             archive extraction and conversion to text) in the order learned from
+             the `search-stats` file, i.e. the cheapest steps with the best hit
+             rate first. OCR is always tried last.''')
+    find_group.add_argument(
+        '--show-search-policy', dest='show_search_policy', action='store_true',
+        help='Print the ISBN search order learned from the `search-stats` file '
+             'for each MIME type and exit.')
+    find_group.add_argument(
+        '--metadata-catalog', dest='metadata_catalog', metavar='PATH',
+        default=lib.METADATA_CATALOG,
+        help='''SQLite file of a local metadata catalog (see `import-catalog`)
+             where the metadata of the books is searched (by ISBN, and by title
+             and author) before the online sources.'''
+             + get_default_message(lib.METADATA_CATALOG))
+    find_group.add_argument(
+        '--import-catalog', dest='import_catalog', metavar='PATH', nargs='+',
+        help='''Import these files in the `metadata-catalog` (created if
+             necessary) and exit. Each file can be in JSON lines or CSV (with the
+             fields title, authors, isbns, publisher, published, series and
+             languages) or a dump of OpenLibrary editions (import the dump of
+             the authors first for their names). Gzipped files are supported.''')
+    find_group.add_argument(
+        '--fetch-metadata-command', dest='fetch_metadata_command', metavar='CMD',
+        default=lib.FETCH_METADATA_COMMAND,
+        help='Command that fetches the metadata from the online sources. It '
+             'must accept the options of calibre\'s `fetch-ebook-metadata` '
+             '(e.g. a wrapper script or a local stub for tests).'
+             + get_default_message(lib.FETCH_METADATA_COMMAND))
+    find_group.add_argument(
+        '--source-rate', dest='metadata_source_rate', metavar='N', type=float,
+        default=lib.METADATA_SOURCE_RATE,
+        help='Maximum number of requests per second sent to each online '
+             'metadata source (shared by all the `jobs`), 0 to disable the '
+             'pacing. A source that fails (e.g. throttling errors) is skipped '
+             'for a while, with an exponential backoff.'
+             + get_default_message(lib.METADATA_SOURCE_RATE))
+    find_group.add_argument(
+        '--source-burst', dest='metadata_source_burst', metavar='N', type=int,
+        default=lib.METADATA_SOURCE_BURST,
+        help='Number of requests that can be sent at once to an online '
+             'metadata source after a pause.'
+             + get_default_message(lib.METADATA_SOURCE_BURST))
+    find_group.add_argument(
+        '--failure-threshold', dest='failure_memo_threshold', metavar='N', type=int,
+        default=lib.FAILURE_MEMO_THRESHOLD,
+        help='''Once `ebook-meta` or a conversion program (e.g. `ebook-convert`)
+             failed N times for a MIME type because it is not installed or
+             doesn't support this format, it is not run anymore for the files
+             of this MIME type.'''
+             + get_default_message(lib.FAILURE_MEMO_THRESHOLD))
+    find_group.add_argument(
+        '--failure-memo', dest='failure_memo_file', metavar='PATH',
+        default=lib.FAILURE_MEMO_FILE,
+        help='''JSON file where these repeated failures are saved between runs.
+             A blocked program is still tried once per run and its failures
+             are cleared as soon as it succeeds.'''
+             + get_default_message(lib.FAILURE_MEMO_FILE))
     # ===========
     # OCR options
     # ===========
@@ -327,6 +467,20 @@ def setup_argparser():
         choices=['always', 'true', 'false'], default=lib.OCR_ENABLED,
         help='Whether to enable OCR for .pdf, .djvu and image files. It is '
              'disabled by default.' + get_default_message(lib.OCR_ENABLED))
+    ocr_group.add_argument(
+        "--ocr-command", dest='ocr_command',
+        choices=['tesseract_wrapper', 'tesseract_batch'], default=lib.OCR_COMMAND,
+        help='''`tesseract_wrapper`: run tesseract once per page.
+             `tesseract_batch`: rasterize all the pages to OCR with one gs/ddjvu
+             call and OCR them with only one tesseract process (faster).'''
+             + get_default_message(lib.OCR_COMMAND))
+    ocr_group.add_argument(
+        "--ocr-profile", dest='ocr_profile',
+        choices=['fast', 'balanced', 'accurate', 'auto'], default=lib.OCR_PROFILE,
+        help='''Speed vs accuracy of OCR: resolution and colour depth of the page
+             images and tesseract page segmentation mode. `auto`: use the `fast`
+             profile first and the `accurate` one only if no ISBNs are found.'''
+             + get_default_message(lib.OCR_PROFILE))
     ocr_group.add_argument(
         "--ocrop", "--ocr-only-first-last-pages",
         dest='ocr_only_first_last_pages', metavar='PAGES', nargs=2,
@@ -350,6 +504,20 @@ def setup_argparser():
              'check corruption and organize/rename files. `false`: skip corruption check. '
              'This option is useful with the `output-folder-corrupt` option.'
              + get_default_message(lib.CORRUPTION_CHECK))
+    organize_group.add_argument(
+        '--audit-report', dest='audit_report', metavar='PATH',
+        default=lib.AUDIT_REPORT,
+        help='With `corruption-check check_only`, CSV or JSON lines file (.csv, '
+             '.jsonl or .json) where the result of the check of each file is '
+             'appended as soon as it is checked. The files already in the report with the same size '
+             'and modification time are not checked again, thus an interrupted '
+             'audit can be resumed and a new audit only checks the new and '
+             'modified files.' + get_default_message(lib.AUDIT_REPORT))
+    organize_group.add_argument(
+        '--sample', dest='audit_sample', metavar='N[%]', default=lib.AUDIT_SAMPLE,
+        help='With `corruption-check check_only`, only check a random sample of '
+             'the files: a number of files (e.g. 500) or a percentage (e.g. 5%%).'
+             + get_default_message(lib.AUDIT_SAMPLE))
     organize_group.add_argument(
         "-t", '--tested-archive-extensions', dest='tested_archive_extensions',
         metavar='REGEX', default=lib.TESTED_ARCHIVE_EXTENSIONS,
@@ -394,6 +562,23 @@ def setup_argparser():
              'to match most periodicals (magazines, newspapers, etc.) so the '
              'script can ignore them.'
              + get_default_message('complex default value, see the README'))
+    organize_group.add_argument(
+        '--tokens-to-ignore', dest='tokens_to_ignore', metavar='REGEX',
+        default=lib.TOKENS_TO_IGNORE,
+        help='This is a regular expression that is matched against the '
+             'lowercase words of the filenames when the script searches for '
+             'metadata by filename. The matching words (e.g. edition, year or '
+             '`scan`) are removed from the searched title.'
+             + get_default_message('complex default value, see the README'))
+    organize_group.add_argument(
+        '--title-index', dest='title_index_file', metavar='PATH',
+        default=lib.TITLE_INDEX_FILE,
+        help='JSON file where the titles of the books organized with online '
+             'metadata are saved between runs. Books without ISBN whose '
+             'filename is similar to one of these titles are organized with '
+             'the saved metadata without searching online. Without this '
+             'option, no title is indexed.'
+             + get_default_message(lib.TITLE_INDEX_FILE))
     organize_group.add_argument(
         '--pamphlet-included-files', dest='pamphlet_included_files',
         metavar='REGEX', default=lib.PAMPHLET_INCLUDED_FILES,
@@ -423,13 +608,56 @@ def setup_argparser():
         help='Other files that do not contain valid ISBNs and are below this '
              'size in KiBs are considered pamplets/non-ebook documents.'
              + get_default_message(lib.PAMPHLET_MAX_FILESIZE_KIB))
+    organize_group.add_argument(
+        '-j', '--jobs', dest='jobs', metavar='N', type=int, default=lib.JOBS,
+        help='Number of files organized in parallel. The files bigger than '
+             '`heavy-file-size` are organized in a separate lane of '
+             '`heavy-jobs` threads.' + get_default_message(lib.JOBS))
+    organize_group.add_argument(
+        '--heavy-jobs', dest='heavy_jobs', metavar='N', type=int,
+        default=lib.HEAVY_JOBS,
+        help='If `jobs` is greater than 1, number of heavy files (see '
+             '`heavy-file-size`) organized in parallel.'
+             + get_default_message(lib.HEAVY_JOBS))
+    organize_group.add_argument(
+        '--heavy-file-size', dest='heavy_file_size_mib', metavar='MiB', type=int,
+        default=lib.HEAVY_FILE_SIZE_MIB,
+        help='Files bigger than this size in MiB are heavy files: their text is '
+             'searched line by line from a temporary file instead of being loaded '
+             'in memory.' + get_default_message(lib.HEAVY_FILE_SIZE_MIB))
+    organize_group.add_argument(
+        '--heavy-memory-limit', dest='heavy_memory_limit_mib', metavar='MiB',
+        type=int, default=lib.HEAVY_MEMORY_LIMIT_MIB,
+        help='Maximum virtual memory in MiB of each program (e.g. gs, 7z, '
+             'pdftotext) run for a heavy file. A program that needs more fails '
+             'instead of exhausting the memory of the system.'
+             + get_default_message(lib.HEAVY_MEMORY_LIMIT_MIB))
     # ====================
     # Input/Output options
     # ====================
     input_output_group = parser.add_argument_group(title=yellow('Input/Output options'))
-    input_output_group.add_argument(
-        name_input,
+    # Only one of the folder, `files` and `files-from` can be given
+    input_group = input_output_group.add_mutually_exclusive_group()
+    input_group.add_argument(
+        name_input, nargs='?',
         help='Folder containing the ebook files that need to be organized.')
+    input_group.add_argument(
+        '--files', dest='files', metavar='PATH', nargs='+',
+        help='Organize only these files (in this order) instead of the files '
+             'of a folder.')
+    input_group.add_argument(
+        '--files-from', dest='files_from', metavar='PATH',
+        help='''Organize only the files listed in this file, one per line ('-'
+             for stdin). Each file is organized as soon as it is read.''')
+    input_output_group.add_argument(
+        '-0', '--null', dest='null_separator', action='store_true',
+        help='The files in `files-from` are separated by NUL characters instead '
+             'of newlines, e.g. from `find -print0`.')
+    input_output_group.add_argument(
+        '--print-results', dest='print_results', action='store_true',
+        help='''Print the result of each file (status, reason, ISBNs, metadata
+             source, new path and timings) as one JSON line on stdout as soon as
+             it is organized.''')
     input_output_group.add_argument(
         '-o', '--output-folder', dest='output_folder', metavar='PATH', default=os.getcwd(),
         help='The folder where ebooks that were renamed based on the ISBN '
@@ -463,6 +691,52 @@ def setup_argparser():
         help='''If `keep-metadata` is enabled, this is the extension of the
                 additional metadata file that is saved next to each newly renamed file.'''
              + get_default_message(lib.OUTPUT_METADATA_EXTENSION))
+    input_output_group.add_argument(
+        '--metadata-sink', dest='metadata_sink', choices=['files', 'jsonl', 'sqlite'],
+        default=lib.METADATA_SINK,
+        help='''Where the metadata files (see `keep-metadata`) are saved: `files`
+                saves one file next to each book while `jsonl` and `sqlite` save
+                the metadata of all the books of a folder in one hidden file
+                (written in batches). The metadata files can be rebuilt from it
+                with `export-metadata`.'''
+             + get_default_message(lib.METADATA_SINK))
+    input_output_group.add_argument(
+        '--export-metadata', dest='export_metadata', metavar='FOLDER',
+        help='''Write the metadata files saved with `metadata-sink` in this folder
+                (and its subfolders) next to their books and exit. The existing
+                metadata files are not overwritten.''')
+    input_output_group.add_argument(
+        '--results-file', dest='results_file', metavar='PATH',
+        default=lib.RESULTS_FILE,
+        help='''Save the result of the organization of each file (status, reason,
+                ISBNs, metadata source, new path and timings) in this file. The
+                format is given by its extension: jsonl, csv or sqlite.'''
+             + get_default_message(lib.RESULTS_FILE))
+    input_output_group.add_argument(
+        '--plan', dest='plan_file', metavar='PATH', default=lib.PLAN_FILE,
+        help='''Plan the organization in this JSON lines file instead of moving
+                the files: one line per file with its destination, the reason and
+                the confidence of the decision and the metadata to save next to
+                it. The plan can be reviewed and then applied with `apply-plan`.'''
+             + get_default_message(lib.PLAN_FILE))
+    input_output_group.add_argument(
+        '--apply-plan', dest='apply_plan', metavar='PATH',
+        help='''Move the files as planned in this file (see `plan`) and exit.
+                Nothing is searched again and the files are moved in parallel.
+                The files already moved are skipped, thus a plan can be applied
+                again after an interruption.''')
+    input_output_group.add_argument(
+        '--scratch-dir', dest='scratch_dir', metavar='PATH',
+        default=lib.SCRATCH_DIR,
+        help='''Folder where the temporary files (converted text, extracted
+                archives, page images) are created. By default, /dev/shm is used
+                until `scratch-quota` is reached and then the default temp folder.'''
+             + get_default_message(lib.SCRATCH_DIR))
+    input_output_group.add_argument(
+        '--scratch-quota', dest='scratch_quota_mib', metavar='MiB', type=int,
+        default=lib.SCRATCH_QUOTA_MIB,
+        help='Maximum size in MiB of the temporary files kept in /dev/shm.'
+             + get_default_message(lib.SCRATCH_QUOTA_MIB))
     return parser
 
 
@@ -481,7 +755,7 @@ def main():
         args = parser.parse_args()
         QUIET = args.quiet
         setup_log(args.quiet, args.verbose, args.logging_level, args.logging_formatter,
-                  logger_names=['organize_script', 'organize_lib'])
+                  logger_names=['organize_script', 'organize_lib'], log_file=args.log_file)
         # Actions
         error = False
         args_dict = namespace_to_dict(args)
@@ -497,8 +771,44 @@ def main():
             args_dict['isbn_reorder_files'][1] = int(args_dict['isbn_reorder_files'][1])
         if error:
             exit_code = 1
+        elif args.show_search_policy:
+            if not args.isbn_search_stats_file:
+                logger.error(red('error: the `search-stats` file is required to show '
+                                 'the ISBN search policy'))
+                exit_code = 1
+            else:
+                print_(lib.IsbnSearchStats(args.isbn_search_stats_file).get_policy())
+                exit_code = 0
+        elif args.apply_plan:
+            on_result = print_result if args_dict.pop('print_results') else None
+            exit_code = lib.organizer.apply_plan(args_dict.pop('apply_plan'),
+                                                 on_result=on_result, **args_dict)
+        elif args.export_metadata:
+            num_files = lib.MetadataStore.export(args.export_metadata)
+            logger.info(f'{num_files} metadata files written')
+            exit_code = 0
+        elif args.import_catalog:
+            if not args.metadata_catalog:
+                logger.error(red('error: the `metadata-catalog` file is required to '
+                                 'import files'))
+                exit_code = 1
+            else:
+                catalog = lib.LocalMetadataCatalog(args.metadata_catalog)
+                for file_path in args.import_catalog:
+                    catalog.import_file(file_path)
+                catalog.close()
+                exit_code = 0
         else:
-            exit_code = organizer.organize(**args_dict)
+            files = args_dict.pop('files')
+            files_from = args_dict.pop('files_from')
+            null_separator = args_dict.pop('null_separator')
+            on_result = print_result if args_dict.pop('print_results') else None
+            if files or files_from:
+                if files_from:
+                    files = read_file_list(files_from, null_separator)
+                exit_code = lib.organizer.organize_files(files, on_result=on_result, **args_dict)
+            else:
+                exit_code = lib.organizer.organize(on_result=on_result, **args_dict)
     except KeyboardInterrupt:
         # Loggers might not be setup at this point
         print_(yellow('\nProgram stopped!'))
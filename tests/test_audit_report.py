@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+from organize_ebooks.lib import AuditReport
+
+
+@pytest.mark.parametrize('extension', ['csv', 'json', 'jsonl'])
+def test_report_is_resumed(tmp_path, extension):
+    book = tmp_path / 'book.pdf'
+    book.write_bytes(b'%PDF-1.4')
+    report_file = str(tmp_path / f'audit.{extension}')
+    report = AuditReport(report_file)
+    report.add(str(book), os.stat(book), 'ok', 'File appears OK')
+    report.close()
+    report = AuditReport(report_file)
+    assert report.is_audited(str(book), os.stat(book))
+    book.write_bytes(b'%PDF-1.4 modified')
+    assert not report.is_audited(str(book), os.stat(book))
+    report.close()
+
+
+def test_unsupported_format_lists_the_supported_ones(tmp_path):
+    with pytest.raises(ValueError, match="'jsonl', 'json', 'csv'"):
+        AuditReport(str(tmp_path / 'audit.txt'))
@@ -0,0 +1,63 @@
+import pytest
+
+from organize_ebooks.lib import BookMetadata
+
+# Output of calibre's `ebook-meta` (the labels are padded to 20 characters,
+# the longer labels of the custom columns are directly followed by the colon)
+EBOOK_META = '''\
+Title               : The Dispossessed
+Title sort          : Dispossessed, The
+Author(s)           : Ursula K. Le Guin [Le Guin, Ursula K.]
+Publisher           : Harper Voyager
+Tags                : Fiction, Science Fiction
+Languages           : eng
+Published           : 2003-07-29T00:00:00+00:00
+Identifiers         : isbn:9780060512750
+Comments            : <p>Shevek, a brilliant physicist, decides to act.</p>
+Note: this edition has a new introduction.
+Winner of the Hugo and the Nebula awards: an ambiguous utopia.
+<p>Ages 14 and up</p>
+Goodreads Shelf Name: to-read
+Date Read By The Owner: 2021-03-01
+'''
+
+
+def test_parse_ebook_meta():
+    metadata = BookMetadata(EBOOK_META)
+    assert list(metadata.fields) == [
+        'Title', 'Title sort', 'Author(s)', 'Publisher', 'Tags', 'Languages',
+        'Published', 'Identifiers', 'Comments', 'Goodreads Shelf Name',
+        'Date Read By The Owner']
+    assert metadata['Author(s)'] == 'Ursula K. Le Guin [Le Guin, Ursula K.]'
+    assert metadata['Comments'] == (
+        '<p>Shevek, a brilliant physicist, decides to act.</p>\n'
+        'Note: this edition has a new introduction.\n'
+        'Winner of the Hugo and the Nebula awards: an ambiguous utopia.\n'
+        '<p>Ages 14 and up</p>')
+    assert metadata['Goodreads Shelf Name'] == 'to-read'
+    assert metadata['Date Read By The Owner'] == '2021-03-01'
+
+
+def test_round_trip():
+    metadata = BookMetadata(EBOOK_META)
+    text = metadata.to_text()
+    assert BookMetadata(text).fields == metadata.fields
+    assert BookMetadata(text).to_text() == text
+
+
+@pytest.mark.parametrize('line, fields', [
+    ('Title               : A nice ebook', {'Title': 'A nice ebook'}),
+    ('Title               :', {'Title': ''}),
+    ('Some Very Long Label Here: value', {'Some Very Long Label Here': 'value'}),
+    # Too short for a label without padding
+    ('Short Label: value', {}),
+    # A sentence of a comment, not a label
+    ('The book was reviewed by many: all liked it', {}),
+    ('Title: A nice ebook', {}),
+])
+def test_labels(line, fields):
+    assert BookMetadata(line).fields == fields
+
+
+def test_lines_before_the_first_label_are_ignored():
+    assert BookMetadata('Some log line\nTitle               : T').fields == {'Title': 'T'}
@@ -0,0 +1,40 @@
+from organize_ebooks.lib import FailureMemo
+
+MIME_TYPE = 'application/x-foo'
+
+
+def test_file_errors_are_not_memoized():
+    memo = FailureMemo(threshold=2)
+    for _ in range(3):
+        memo.record('ebook-convert', MIME_TYPE, 1, 'Error: This file is encrypted (DRM)')
+    assert memo.is_blocked('ebook-convert', MIME_TYPE) is None
+    assert memo.get_summary() == []
+
+
+def test_tool_failures_are_memoized():
+    memo = FailureMemo(threshold=2)
+    for _ in range(2):
+        memo.record('ebook-convert', MIME_TYPE, 1, 'ValueError: Unsupported input format: foo')
+    # The program is still tried once per run before being skipped
+    assert memo.is_blocked('ebook-convert', MIME_TYPE) is None
+    assert memo.is_blocked('ebook-convert', MIME_TYPE) is not None
+    assert memo.is_blocked('ebook-meta', MIME_TYPE) is None
+
+
+def test_missing_program_is_memoized():
+    memo = FailureMemo(threshold=1)
+    memo.record('djvutxt', 'image/vnd.djvu', 127, "No such file or directory: 'djvutxt'")
+    memo.retried.add(('djvutxt', 'image/vnd.djvu'))
+    assert memo.is_blocked('djvutxt', 'image/vnd.djvu') is not None
+
+
+def test_success_clears_failures(tmp_path):
+    memo_file = tmp_path / 'memo.json'
+    memo = FailureMemo(str(memo_file), threshold=1)
+    memo.record('ebook-convert', MIME_TYPE, 127, 'ebook-convert: command not found')
+    memo.save()
+    memo = FailureMemo(str(memo_file), threshold=1)
+    assert memo.is_blocked('ebook-convert', MIME_TYPE) is None
+    memo.record('ebook-convert', MIME_TYPE, 0, '')
+    assert memo.is_blocked('ebook-convert', MIME_TYPE) is None
+    assert memo.get_summary() == []
@@ -0,0 +1,38 @@
+import pytest
+
+from organize_ebooks.lib import OrganizeEbooks, TitleIndex, guess_title_and_author, tokenize
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('the-pragmatic-programmer', ('the pragmatic programmer', None)),
+    ('the-passionate-programmer', ('the passionate programmer', None)),
+    ('Python-Crash-Course', ('python crash course', None)),
+    ('Ursula_Le_Guin-The.Dispossessed_(2003)_scan', ('the dispossessed', 'ursula le guin')),
+    ('Ursula Le Guin - The Dispossessed (2003)', ('the dispossessed', 'ursula le guin')),
+    ('Ursula Le Guin - [Hainish Cycle] - The Dispossessed', ('the dispossessed', 'ursula le guin')),
+    ('The Dispossessed by Ursula Le Guin', ('the dispossessed', 'ursula le guin')),
+    ('Knuth--TAOCP', ('taocp', 'knuth')),
+    ('Some_Title_2nd_edition', ('some title', None)),
+])
+def test_guess_title_and_author(filename, expected):
+    assert guess_title_and_author(filename) == expected
+
+
+def test_tokenize():
+    assert tokenize('Some_Book-2nd.ed_(2019)') == ['some']
+
+
+def test_title_index_doesnt_match_different_titles():
+    index = TitleIndex()
+    index.add('the-pragmatic-programmer', 'Title               : The Pragmatic Programmer')
+    assert index.search('The Pragmatic Programmer (2nd edition)') is not None
+    assert index.search(guess_title_and_author('the-passionate-programmer')[0]) is None
+
+
+def test_title_index_is_opt_in(tmp_path):
+    organizer = OrganizeEbooks()
+    assert organizer._setup(str(tmp_path)) == 0
+    assert organizer.title_index is None
+    assert not any(isinstance(backend, TitleIndex) for backend in organizer.local_backends)
+    assert organizer._setup(str(tmp_path), title_index_file=str(tmp_path / 'index.json')) == 0
+    assert organizer.title_index in organizer.local_backends
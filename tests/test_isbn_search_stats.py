@@ -0,0 +1,49 @@
+from organize_ebooks.lib import IsbnSearchStats
+
+EPUB = 'application/epub+zip'
+PDF = 'application/pdf'
+
+
+# Runs the steps in the order given by the statistics until one of them finds
+# ISBNs, like search_file_for_isbns()
+def search(stats, mime_type, hits, durations):
+    for step in stats.get_order(mime_type):
+        stats.record(mime_type, step, hits[step], durations[step])
+        if hits[step]:
+            break
+
+
+def test_steps_that_dont_apply_are_left_out():
+    assert IsbnSearchStats.get_steps(EPUB) == ['ebook-meta', 'convert']
+    assert IsbnSearchStats.get_steps(PDF) == IsbnSearchStats.STEPS
+
+
+def test_default_order_until_enough_searches():
+    stats = IsbnSearchStats(min_tries=5)
+    for _ in range(4):
+        search(stats, PDF, {'ebook-meta': False, 'archive': False, 'convert': True},
+               {'ebook-meta': 1.0, 'archive': 0.5, 'convert': 0.1})
+    assert stats.get_order(PDF) == IsbnSearchStats.STEPS
+
+
+def test_learned_order_is_reached_for_epubs():
+    stats = IsbnSearchStats(min_tries=5)
+    hits = {'ebook-meta': False, 'convert': True}
+    durations = {'ebook-meta': 2.0, 'convert': 0.1}
+    for _ in range(5):
+        search(stats, EPUB, hits, durations)
+    assert stats.get_order(EPUB) == ['convert', 'ebook-meta']
+
+
+def test_rarely_reached_steps_are_explored():
+    stats = IsbnSearchStats(min_tries=5)
+    # ebook-meta always finds the ISBNs, thus the conversion is never reached
+    hits = {'ebook-meta': True, 'archive': False, 'convert': True}
+    durations = {'ebook-meta': 3.0, 'archive': 1.0, 'convert': 0.1}
+    orders = []
+    for _ in range(15):
+        orders.append(stats.get_order(PDF))
+        search(stats, PDF, hits, durations)
+    assert orders[0] == IsbnSearchStats.STEPS
+    assert orders[5] == ['archive', 'convert', 'ebook-meta']
+    assert orders[-1] == ['convert', 'ebook-meta', 'archive']
@@ -0,0 +1,108 @@
+import pytest
+
+from organize_ebooks.lib import (dedupe_isbns, filter_valid_isbns, is_isbn_valid,
+                                 isbn10_to_isbn13, isbn13_to_isbn10)
+
+# ISBN-10 -> equivalent ISBN-13
+EQUIVALENT_ISBNS = [
+    ('0306406152', '9780306406157'),
+    ('080442957X', '9780804429573'),
+    ('043942089X', '9780439420891'),
+    ('155192370X', '9781551923703'),
+]
+
+
+@pytest.mark.parametrize('isbn, valid', [
+    # Valid ISBN-10
+    ('0306406152', True),
+    ('080442957X', True),
+    ('080442957x', True),
+    ('0000000000', True),
+    # Invalid ISBN-10
+    ('0306406153', False),
+    ('0804429570', False),
+    ('08044295X7', False),
+    ('X306406152', False),
+    ('030640615', False),
+    # Valid ISBN-13
+    ('9780306406157', True),
+    ('9791090636071', True),
+    ('9780804429573', True),
+    # Invalid ISBN-13
+    ('9780306406158', False),
+    ('9770306406156', False),
+    ('978030640615X', False),
+    ('97803064061570', False),
+])
+def test_filter_valid_isbns(isbn, valid):
+    assert filter_valid_isbns([isbn]) == ({isbn} if valid else set())
+
+
+def test_filter_valid_isbns_many_candidates():
+    candidates = ['9780306406157', '0306406153', '9780306406157', '080442957x', '']
+    assert filter_valid_isbns(candidates) == {'9780306406157', '080442957x'}
+
+
+@pytest.mark.parametrize('isbn, valid', [
+    ('0306406152', True),
+    ('0-306-40615-2', True),
+    ('0 8044 2957 x', True),
+    ('978-0-306-40615-7', True),
+    ('\t9780306406157\n', True),
+    ('978-0-306-40615-8', False),
+    ('0-306-40615-3', False),
+    ('isbn 0306406152', False),
+    ('', False),
+])
+def test_is_isbn_valid(isbn, valid):
+    assert is_isbn_valid(isbn) is valid
+
+
+@pytest.mark.parametrize('isbn10, isbn13', EQUIVALENT_ISBNS)
+def test_isbn10_to_isbn13(isbn10, isbn13):
+    assert isbn10_to_isbn13(isbn10) == isbn13
+    assert isbn10_to_isbn13(isbn10.lower()) == isbn13
+
+
+@pytest.mark.parametrize('isbn10, isbn13', EQUIVALENT_ISBNS)
+def test_isbn13_to_isbn10(isbn10, isbn13):
+    assert isbn13_to_isbn10(isbn13) == isbn10
+
+
+@pytest.mark.parametrize('isbn10, isbn13', EQUIVALENT_ISBNS)
+def test_round_trips(isbn10, isbn13):
+    assert isbn13_to_isbn10(isbn10_to_isbn13(isbn10)) == isbn10
+    assert isbn10_to_isbn13(isbn13_to_isbn10(isbn13)) == isbn13
+    assert is_isbn_valid(isbn10_to_isbn13(isbn10))
+    assert is_isbn_valid(isbn13_to_isbn10(isbn13))
+
+
+@pytest.mark.parametrize('isbn, expected', [
+    ('0-306-40615-2', '9780306406157'),
+    ('9780306406157', '9780306406157'),
+    ('978-0-306-40615-7', '9780306406157'),
+])
+def test_isbn10_to_isbn13_other_forms(isbn, expected):
+    assert isbn10_to_isbn13(isbn) == expected
+
+
+@pytest.mark.parametrize('isbn, expected', [
+    ('978-0-306-40615-7', '0306406152'),
+    ('0306406152', '0306406152'),
+    # The ISBN-13 starting with 979 have no ISBN-10
+    ('9791090636071', None),
+    ('12345', None),
+])
+def test_isbn13_to_isbn10_other_forms(isbn, expected):
+    assert isbn13_to_isbn10(isbn) == expected
+
+
+@pytest.mark.parametrize('isbns, expected', [
+    (['0306406152', '9780306406157'], ['0306406152']),
+    (['9780306406157', '0-306-40615-2'], ['9780306406157']),
+    (['080442957x', '9780804429573', '080442957X'], ['080442957x']),
+    (['9780306406157', '9791090636071', '9780306406157'], ['9780306406157', '9791090636071']),
+    ([], []),
+])
+def test_dedupe_isbns(isbns, expected):
+    assert dedupe_isbns(isbns) == expected
@@ -0,0 +1,59 @@
+import sqlite3
+
+from organize_ebooks.lib import LocalMetadataCatalog
+
+CSV = '''title,authors,isbns,publisher
+The Art of Testing,Jane Doe,9780306406157,ACME
+The Dispossessed,Ursula K. Le Guin,,
+'''
+
+
+def count_books(catalog_file):
+    conn = sqlite3.connect(catalog_file)
+    count = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_import_again_updates_the_books(tmp_path):
+    books_file = tmp_path / 'books.csv'
+    books_file.write_text(CSV)
+    catalog_file = str(tmp_path / 'catalog.sqlite')
+    catalog = LocalMetadataCatalog(catalog_file)
+    assert catalog.import_file(str(books_file)) == 2
+    books_file.write_text(CSV.replace('ACME', 'ACME Press'))
+    assert catalog.import_file(str(books_file)) == 2
+    assert count_books(catalog_file) == 2
+    assert catalog.find_by_isbn('978-0-306-40615-7')['publisher'] == 'ACME Press'
+    assert catalog.search('dispossessed', 'le guin')['title'] == 'The Dispossessed'
+    catalog.close()
+
+
+def test_book_found_by_another_isbn_is_updated(tmp_path):
+    books_file = tmp_path / 'books.jsonl'
+    books_file.write_text('{"title": "The Art of Testing", "isbns": ["0306406152"]}\n')
+    catalog_file = str(tmp_path / 'catalog.sqlite')
+    catalog = LocalMetadataCatalog(catalog_file)
+    catalog.import_file(str(books_file))
+    books_file.write_text('{"title": "The Art of Testing (2nd ed.)", '
+                          '"isbns": ["9780306406157", "0306406152"]}\n')
+    catalog.import_file(str(books_file))
+    assert count_books(catalog_file) == 1
+    assert catalog.find_by_isbn('9780306406157')['title'] == 'The Art of Testing (2nd ed.)'
+    catalog.close()
+
+
+def test_catalog_without_keys_is_migrated(tmp_path):
+    catalog_file = str(tmp_path / 'catalog.sqlite')
+    conn = sqlite3.connect(catalog_file)
+    conn.execute('CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, authors TEXT, '
+                 'publisher TEXT, published TEXT, series TEXT, languages TEXT)')
+    conn.commit()
+    conn.close()
+    books_file = tmp_path / 'books.csv'
+    books_file.write_text(CSV)
+    catalog = LocalMetadataCatalog(catalog_file)
+    catalog.import_file(str(books_file))
+    catalog.import_file(str(books_file))
+    assert count_books(catalog_file) == 2
+    catalog.close()
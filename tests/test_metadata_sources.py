@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+
+import pytest
+
+from organize_ebooks.lib import CalibreMetadataBackend, SourceScheduler
+
+# Stub of calibre's `fetch-ebook-metadata`: each call is logged in `calls`, the
+# sources listed in the `failing` file answer with a throttling error and the
+# book is found by the sources listed in the `finding` file. Like calibre, the
+# log of each source starts with a header.
+STUB = f'''#!{sys.executable}
+import os
+import sys
+
+stub_dir = os.path.dirname(os.path.abspath(__file__))
+sources = [arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--allowed-plugin=')]
+with open(os.path.join(stub_dir, 'calls'), 'a') as f:
+    f.write(','.join(sources) + '\\n')
+
+
+def read(name):
+    with open(os.path.join(stub_dir, name)) as f:
+        return f.read().split()
+
+
+found = False
+for source in sources:
+    print('*' * 30, source, '(1, 0, 0)', '*' * 30, file=sys.stderr)
+    if source in read('failing'):
+        print('HTTP Error 429: Too Many Requests', file=sys.stderr)
+    elif source in read('finding'):
+        print('Found 1 result', file=sys.stderr)
+        found = True
+    else:
+        print('Found 0 results', file=sys.stderr)
+if found:
+    print('Title               : A nice ebook')
+sys.exit(0 if found else 1)
+'''
+
+
+class Stub:
+    def __init__(self, stub_dir):
+        self.stub_dir = stub_dir
+
+    def set(self, name, sources):
+        (self.stub_dir / name).write_text(' '.join(sources))
+
+    @property
+    def calls(self):
+        calls_file = self.stub_dir / 'calls'
+        if not calls_file.exists():
+            return []
+        return [line.split(',') for line in calls_file.read_text().splitlines()]
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    script = tmp_path / 'fetch-ebook-metadata'
+    script.write_text(STUB)
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    stub = Stub(tmp_path)
+    stub.set('failing', [])
+    stub.set('finding', [])
+    return stub
+
+
+def test_sources_with_tokens_are_queried_together(stub):
+    stub.set('finding', ['Google'])
+    backend = CalibreMetadataBackend('Goodreads,Google', scheduler=SourceScheduler(rate=1, burst=3))
+    result = backend.fetch(isbn='9780306406157')
+    assert result.returncode == 0
+    assert stub.calls == [['Goodreads', 'Google']]
+
+
+def test_failing_source_is_skipped_with_backoff(stub):
+    stub.set('failing', ['Goodreads'])
+    scheduler = SourceScheduler(rate=0, backoff=30)
+    backend = CalibreMetadataBackend('Goodreads,Google', scheduler=scheduler)
+    backend.fetch(isbn='9780306406157')
+    # Only the log of Goodreads shows the throttling error
+    assert not scheduler.is_available('Goodreads')
+    assert scheduler.is_available('Google')
+    assert 25 < scheduler.sources['Goodreads']['blocked_until'] - time.monotonic() <= 36
+    stub.set('finding', ['Google'])
+    assert backend.fetch(isbn='9780306406157').returncode == 0
+    assert stub.calls == [['Goodreads', 'Google'], ['Google']]
+    summary = scheduler.get_summary()
+    assert len(summary) == 1 and "'Goodreads'" in summary[0]
+
+
+def test_empty_responses_block_the_source(stub):
+    scheduler = SourceScheduler(rate=0, max_empty=2)
+    backend = CalibreMetadataBackend('Google', scheduler=scheduler)
+    for _ in range(3):
+        backend.fetch(isbn='9780306406157')
+    assert len(stub.calls) == 2
+    assert backend.fetch(isbn='9780306406157').returncode == 1
+
+
+def test_throttled_sources_are_paced(stub):
+    stub.set('finding', ['Amazon.com'])
+    scheduler = SourceScheduler(rate=5, burst=1)
+    backend = CalibreMetadataBackend('Google,Amazon.com', scheduler=scheduler)
+    start = time.monotonic()
+    backend.fetch(isbn='9780306406157')
+    # No token left: the sources are requested one at a time once allowed to
+    backend.fetch(isbn='9780306406157')
+    assert time.monotonic() - start >= 0.15
+    assert stub.calls == [['Google', 'Amazon.com'], ['Google'], ['Amazon.com']]
+
+
+def test_zero_rate_disables_the_pacing():
+    scheduler = SourceScheduler(rate=0, burst=1)
+    start = time.monotonic()
+    assert all(scheduler.acquire('Google') for _ in range(10))
+    assert time.monotonic() - start < 0.1
+    scheduler.configure(rate=-1)
+    assert scheduler.acquire('Google')
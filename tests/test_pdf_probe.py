@@ -0,0 +1,26 @@
+from organize_ebooks.lib import PdfProbe, Result
+
+PDFINFO = 'Pages:          3\nPage size:      612 x 792 pts (letter)\nEncrypted:      no\n'
+
+
+def test_text_hint_is_only_computed_on_access(tmp_path, monkeypatch):
+    pdf = tmp_path / 'book.pdf'
+    pdf.write_bytes(b'%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n%%EOF\n')
+    calls = []
+    monkeypatch.setattr(PdfProbe, 'get_text_hint',
+                        staticmethod(lambda path: calls.append(path) or False))
+    probe = PdfProbe(str(pdf), Result(stdout=PDFINFO, returncode=0))
+    assert (probe.pages, probe.page_size, probe.encrypted) == (3, (612.0, 792.0), False)
+    assert 'not checked' in repr(probe)
+    assert calls == []
+    assert probe.has_text is False
+    assert probe.has_text is False
+    assert calls == [str(pdf)]
+
+
+def test_text_hint(tmp_path):
+    scan, text = tmp_path / 'scan.pdf', tmp_path / 'text.pdf'
+    scan.write_bytes(b'%PDF-1.4\n1 0 obj << /XObject << /Im0 2 0 R >> >> endobj\n')
+    text.write_bytes(b'%PDF-1.4\n1 0 obj << /Font << /F1 2 0 R >> >> endobj\n')
+    assert PdfProbe.get_text_hint(str(scan)) is False
+    assert PdfProbe.get_text_hint(str(text)) is True